@@ -0,0 +1,72 @@
+"""
+AI generation benchmark against the mock completions API.
+
+Starts src/utils/mock_completion_server.py in-process with a fixed per-request
+latency, then generates emails for a synthetic recipient list twice: once
+cold and once from the response cache.
+
+    python -m benchmarks.ai_generation
+    python -m benchmarks.ai_generation --recipients 5000 --latency 0.5 --concurrency 16 --batch-size 25
+
+A serial client would need about recipients x latency seconds.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from src.utils.ai_generation import ResponseCache, generate_ai_emails  # noqa: E402
+from src.utils.mock_completion_server import MockCompletionServer  # noqa: E402
+
+
+def make_recipients(count):
+    return [{
+        'name': f'Recipient {i}',
+        'role': 'Head of Operations',
+        'company': f'Company {i}',
+        'industry': 'logistics',
+        'pain_points': 'manual scheduling'
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie AI generation benchmark')
+    parser.add_argument('--recipients', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.3, help='Seconds the mock takes per request')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--tokens-per-minute', type=int, default=10000000)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help='Fraction of requests the mock answers with 429')
+    args = parser.parse_args()
+
+    server = MockCompletionServer(port=0, latency=args.latency, rate_limit_rate=args.rate_limit_rate).start()
+    cache_path = os.path.join(tempfile.mkdtemp(prefix='inbox_genie_ai_bench_'), 'cache.sqlite3')
+    cache = ResponseCache(cache_path)
+    recipients = make_recipients(args.recipients)
+    try:
+        print(f"{'run':<8}{'emails':>8}{'seconds':>10}{'emails/s':>10}{'requests':>10}{'serial s':>10}")
+        for run in ('cold', 'cached'):
+            requests_before = server.stats['requests']
+            started = time.perf_counter()
+            emails = generate_ai_emails(
+                recipients, sender_name='Benchmark', cache=cache, base_url=server.base_url,
+                api_key='mock', max_concurrency=args.concurrency, batch_size=args.batch_size,
+                tokens_per_minute=args.tokens_per_minute
+            )
+            seconds = time.perf_counter() - started
+            assert all(f'Hi {recipient["name"]},' in email for recipient, email in zip(recipients, emails))
+            print(f"{run:<8}{len(emails):>8}{seconds:>10.2f}{len(emails) / seconds:>10.0f}"
+                  f"{server.stats['requests'] - requests_before:>10}{args.recipients * args.latency:>10.0f}")
+    finally:
+        cache.close()
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
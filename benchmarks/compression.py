@@ -0,0 +1,128 @@
+"""
+Email body compression benchmark.
+
+Compares the stored size and the CPU cost of email bodies from representative
+campaigns: plain UTF-8, zlib, zlib with the shipped preset dictionary (what
+CompressedText stores) and zlib with a dictionary trained on the campaign
+itself (half the bodies train it, the other half are measured):
+
+    python -m benchmarks.compression
+    python -m benchmarks.compression --emails 5000
+
+No database is needed.
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from src.utils.compression import LEVEL, compress_text, decompress_text, train_dictionary  # noqa: E402
+from src.utils.email_generator import EmailGenerator  # noqa: E402
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title></title></head>
+<body style="margin: 0; padding: 0;">
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0">
+<tr><td align="center">
+<span style="font-family: Arial, Helvetica, sans-serif; font-size: 14px; line-height: 1.5; color: #333333;">
+<p>Hi {name},</p>
+<p>I noticed {company} is hiring for its {industry} team and thought of you as {role}.</p>
+{sections}
+<p>Would a 15-minute call next week make sense?</p>
+<p>Best regards,<br>Benchmark<br>Account Executive<br>Inbox Genie</p>
+<p>If you would rather not hear from me, just reply and let me know.</p>
+</span>
+</td></tr></table>
+</body>
+</html>"""
+
+SECTION = ('<p><strong>{title}</strong><br>Teams in {industry} cut manual scheduling by {percent}% '
+           'within a quarter. <a href="https://www.example.com/cases/{slug}" target="_blank">Read the story</a>'
+           '</p>\n')
+
+
+def make_rows(count):
+    for i in range(count):
+        yield {
+            'name': f'Recipient {i}',
+            'role': ('Head of Operations', 'VP Sales', 'CTO')[i % 3],
+            'company': f'Company {i % 1000}',
+            'email': f'recipient{i}@example.com',
+            'industry': ('logistics', 'retail', 'fintech')[i % 3],
+            'pain_points': 'manual scheduling' if i % 2 else ''
+        }
+
+
+def campaigns(count):
+    """Named lists of email bodies, one per recipient"""
+    rows = list(make_rows(count))
+    yield 'cold email', [EmailGenerator.generate_email(row, 'cold_email', 'Benchmark') for row in rows]
+    yield 'follow-up', [EmailGenerator.generate_email(row, 'follow_up', 'Benchmark') for row in rows]
+    yield 'html newsletter', [
+        HTML_TEMPLATE.format(sections=''.join(
+            SECTION.format(title=f'Case study {j}', industry=row['industry'], percent=20 + j, slug=f'case-{j}')
+            for j in range(12)
+        ), **row)
+        for row in rows
+    ]
+
+
+def zlib_codec(dictionary=None):
+    def compress(text):
+        if dictionary is None:
+            compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        return compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+    def decompress(data):
+        if dictionary is None:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        else:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+        return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+    return compress, decompress
+
+
+def measure(bodies, compress, decompress):
+    started = time.perf_counter()
+    stored = [compress(body) for body in bodies]
+    compress_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for data in stored:
+        decompress(data)
+    decompress_seconds = time.perf_counter() - started
+    return (sum(len(data) for data in stored),
+            compress_seconds / len(bodies) * 1e6, decompress_seconds / len(bodies) * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie body compression benchmark')
+    parser.add_argument('--emails', type=int, default=2000, help='Emails per campaign')
+    args = parser.parse_args()
+
+    print(f"{'campaign':<17}{'codec':<18}{'avg bytes':>10}{'ratio':>8}{'compress us':>13}{'decompress us':>15}")
+    for name, bodies in campaigns(args.emails):
+        training, measured = bodies[::2], bodies[1::2]
+        codecs = (
+            ('utf-8', lambda text: text.encode('utf-8'), lambda data: data.decode('utf-8')),
+            ('zlib',) + zlib_codec(),
+            ('zlib + preset',) + (compress_text, decompress_text),
+            ('zlib + trained',) + zlib_codec(train_dictionary(training)),
+        )
+        raw = sum(len(body.encode('utf-8')) for body in measured)
+        for codec, compress, decompress in codecs:
+            size, compress_us, decompress_us = measure(measured, compress, decompress)
+            print(f"{name:<17}{codec:<18}{size / len(measured):>10.0f}{raw / size:>8.2f}"
+                  f"{compress_us:>13.1f}{decompress_us:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
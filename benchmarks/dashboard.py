@@ -0,0 +1,177 @@
+"""
+Dashboard latency on a large account.
+
+Seeds one user with many campaigns and emails, then requests the dashboard
+through the test client and prints p50/p95 latency for:
+
+- legacy: the old per-campaign loop that loaded every email of a campaign
+  and counted opens and clicks in Python (metrics only, no rendering)
+- aggregate: one GROUP BY campaign_name query with SUM(CASE ...) and
+  MAX(sent_at) over the email history (metrics only, no rendering)
+- cold: the dashboard with the stats cache cleared before each request
+- warm: the dashboard served from the stats cache
+
+    python -m benchmarks.dashboard
+    python -m benchmarks.dashboard --emails 50000 --campaigns 50
+
+Uses a throwaway SQLite database unless DATABASE_URI is set. Point it only
+at a scratch database: the seeded tables are dropped first.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'dashboard.db'))
+os.environ['AUTO_MIGRATE'] = '0'
+
+from sqlalchemy import case, func, insert, text  # noqa: E402
+
+from src import migrations  # noqa: E402
+from src.app import app  # noqa: E402
+from src.models import Campaign, EmailHistory, User, db  # noqa: E402
+from src.utils.dashboard_stats import stats_cache  # noqa: E402
+
+USER_ID = 1
+INSERT_CHUNK = 10000
+
+
+def seed(emails, campaigns):
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'id': USER_ID, 'username': 'bench', 'email': 'bench@example.com', 'password': 'x'}
+    ])
+    db.session.execute(insert(Campaign), [
+        {'id': i + 1, 'user_id': USER_ID, 'name': f'Campaign {i}', 'created_at': now - timedelta(days=i),
+         'total': 0, 'sent': 0, 'failed': 0, 'opened': 0, 'clicked': 0}
+        for i in range(campaigns)
+    ])
+    for start in range(0, emails, INSERT_CHUNK):
+        db.session.execute(insert(EmailHistory), [
+            {
+                'user_id': USER_ID,
+                'campaign_id': i % campaigns + 1,
+                'recipient': f'r{i}@example.com',
+                'subject': 'Hello',
+                'campaign_name': f'Campaign {i % campaigns}',
+                'sent_at': now - timedelta(seconds=i),
+                'status': 'sent',
+                'opened': i % 3 == 0,
+                'clicked': i % 7 == 0
+            }
+            for i in range(start, min(start + INSERT_CHUNK, emails))
+        ])
+    # Counters as the worker and tracking buffer would have kept them
+    totals = db.session.query(
+        EmailHistory.campaign_id,
+        func.count(EmailHistory.id),
+        func.sum(case((EmailHistory.opened, 1), else_=0)),
+        func.sum(case((EmailHistory.clicked, 1), else_=0)),
+        func.max(EmailHistory.sent_at)
+    ).group_by(EmailHistory.campaign_id).all()
+    for campaign_id, sent, opened, clicked, last_sent_at in totals:
+        Campaign.query.filter_by(id=campaign_id).update({
+            'total': sent, 'sent': sent, 'opened': opened, 'clicked': clicked, 'last_sent_at': last_sent_at
+        }, synchronize_session=False)
+    db.session.commit()
+
+
+def legacy_metrics(user_id):
+    """The dashboard's campaign metrics as computed before the stats cache"""
+    campaigns = db.session.query(EmailHistory.campaign_name).filter(
+        EmailHistory.user_id == user_id,
+        EmailHistory.campaign_name.isnot(None)
+    ).distinct().all()
+    stats = []
+    for campaign in campaigns:
+        campaign_emails = EmailHistory.query.filter_by(user_id=user_id, campaign_name=campaign[0]).all()
+        total_emails = len(campaign_emails)
+        opened_emails = sum(1 for email in campaign_emails if email.opened)
+        clicked_emails = sum(1 for email in campaign_emails if email.clicked)
+        latest_email = max(campaign_emails, key=lambda x: x.sent_at) if campaign_emails else None
+        stats.append((campaign[0], total_emails, opened_emails, clicked_emails, latest_email.sent_at))
+        db.session.expunge_all()
+    return stats
+
+
+def aggregate_metrics(user_id):
+    """The same metrics from one GROUP BY over the email history"""
+    return db.session.query(
+        EmailHistory.campaign_name,
+        func.count(EmailHistory.id),
+        func.sum(case((EmailHistory.opened, 1), else_=0)),
+        func.sum(case((EmailHistory.clicked, 1), else_=0)),
+        func.max(EmailHistory.sent_at)
+    ).filter(
+        EmailHistory.user_id == user_id,
+        EmailHistory.campaign_name.isnot(None)
+    ).group_by(EmailHistory.campaign_name).all()
+
+
+def measure(run, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    return statistics.median(timings), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie dashboard latency on a large account')
+    parser.add_argument('--emails', type=int, default=500000)
+    parser.add_argument('--campaigns', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--legacy-runs', type=int, default=3, help='Runs of the slow legacy loop')
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.drop_all()
+        migrations.schema_migrations.drop(db.engine, checkfirst=True)
+        migrations.upgrade(db.engine)
+
+        print(f"Seeding {args.emails} emails in {args.campaigns} campaigns on {db.engine.dialect.name}")
+        seed(args.emails, args.campaigns)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(USER_ID)
+            session['_fresh'] = True
+
+        def dashboard():
+            response = client.get('/dashboard')
+            assert response.status_code == 200, response.status_code
+
+        # Template compilation and the progress listener start happen once per process
+        dashboard()
+
+        def cold():
+            stats_cache.clear()
+            dashboard()
+
+        results = [
+            ('legacy', measure(lambda: legacy_metrics(USER_ID), args.legacy_runs)),
+            ('aggregate', measure(lambda: aggregate_metrics(USER_ID), args.runs)),
+            ('cold', measure(cold, args.runs)),
+            ('warm', measure(dashboard, args.runs)),
+        ]
+
+    print(f"\n{'':<12}{'p50 ms':>12}{'p95 ms':>12}")
+    for name, (p50, p95) in results:
+        print(f"{name:<12}{p50:>12.2f}{p95:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Query plans before and after the composite index migration.
+
+Seeds a database with many users, emails, sessions and login attempts, then
+prints the plan and timing of the hot queries (dashboard, session check,
+daily sending limit) without the indexes of migration 0003 and again after
+applying it. tests/test_query_plans.py checks that each plan uses the index
+meant for it:
+
+    python -m benchmarks.query_plans
+    DATABASE_URI=postgresql://... python -m benchmarks.query_plans --users 200
+
+Uses a throwaway SQLite database unless DATABASE_URI is set. Point it only
+at a scratch database: the seeded tables are dropped first.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'query_plans.db'))
+os.environ['AUTO_MIGRATE'] = '0'
+
+from sqlalchemy import func, insert, select, text  # noqa: E402
+
+from src import migrations  # noqa: E402
+from src.app import app  # noqa: E402
+from src.models import EmailHistory, LoginAttempt, User, UserSession, db  # noqa: E402
+
+INDEX_MIGRATION = 3
+
+
+def seed(users, emails_per_user, campaigns_per_user):
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'id': i + 1, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'x'}
+        for i in range(users)
+    ])
+    for user_id in range(1, users + 1):
+        db.session.execute(insert(EmailHistory), [
+            {
+                'user_id': user_id,
+                'recipient': f'r{i}@example.com',
+                'subject': 'Hello',
+                'campaign_name': f'Campaign {i % campaigns_per_user}' if i % 10 else None,
+                'sent_at': now - timedelta(minutes=i),
+                'status': 'sent',
+                'opened': i % 3 == 0,
+                'clicked': i % 7 == 0
+            }
+            for i in range(emails_per_user)
+        ])
+        db.session.execute(insert(UserSession), [
+            {
+                'user_id': user_id,
+                'session_id': f'{user_id}-{i}',
+                'expires_at': now + timedelta(days=1),
+                'is_active': i == 0
+            }
+            for i in range(20)
+        ])
+        db.session.execute(insert(LoginAttempt), [
+            {
+                'identifier': f'user{user_id}@example.com',
+                'identifier_type': 'email',
+                'success': i % 4 == 0,
+                'timestamp': now - timedelta(hours=i)
+            }
+            for i in range(50)
+        ])
+    db.session.commit()
+
+
+def hot_queries(user_id):
+    """
+    The statements the new indexes are meant for, as the routes build them
+
+    Each comes with the index its plan must use. The session check is served
+    by the unique index on session_id, whose name depends on the database.
+    """
+    return [
+        ('dashboard: campaign list', 'ix_email_history_user_id_campaign_name_sent_at', select(EmailHistory.campaign_name).filter(
+            EmailHistory.user_id == user_id,
+            EmailHistory.campaign_name.isnot(None)
+        ).distinct()),
+        ('dashboard: one campaign', 'ix_email_history_user_id_campaign_name_sent_at', select(EmailHistory.id, EmailHistory.opened, EmailHistory.clicked,
+                                           EmailHistory.sent_at).filter_by(
+            user_id=user_id, campaign_name='Campaign 3'
+        )),
+        ('dashboard: recent emails', 'ix_email_history_user_id_sent_at', select(EmailHistory.id).filter_by(user_id=user_id).order_by(
+            EmailHistory.sent_at.desc()
+        ).limit(5)),
+        ('send limit: sent today', 'ix_email_history_user_id_sent_at', select(func.count()).select_from(EmailHistory).filter_by(
+            user_id=user_id, sent_at=func.date(func.now())
+        )),
+        ('session check', 'session_id', select(UserSession.id).filter_by(
+            user_id=user_id, session_id=f'{user_id}-0', is_active=True
+        ).limit(1)),
+        ('login attempts', 'ix_login_attempt_identifier_timestamp', select(func.count()).select_from(LoginAttempt).filter(
+            LoginAttempt.identifier == f'user{user_id}@example.com',
+            LoginAttempt.timestamp > datetime.utcnow() - timedelta(hours=1)
+        )),
+    ]
+
+
+def explain(statement):
+    compiled = statement.compile(dialect=db.engine.dialect)
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql(prefix + str(compiled), params).all()
+    return [row[-1] for row in rows]
+
+
+def timed(statement, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        db.session.execute(statement).all()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def report(title, user_id, repeat):
+    """Print the timing and plan of every hot query"""
+    print(f"\n== {title} ==")
+    for name, _, statement in hot_queries(user_id):
+        print(f"{name:<26}{timed(statement, repeat):>9.3f} ms")
+        for line in explain(statement):
+            print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie query plans before/after migration 0003')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--emails', type=int, default=4000, help='Emails per user')
+    parser.add_argument('--campaigns', type=int, default=40, help='Campaigns per user')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        migrations.schema_migrations.drop(db.engine, checkfirst=True)
+        migrations.upgrade(db.engine, INDEX_MIGRATION - 1)
+
+        print(f"Seeding {args.users} users x {args.emails} emails on {db.engine.dialect.name}")
+        seed(args.users, args.emails, args.campaigns)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        user_id = args.users // 2
+        report('before migration 0003', user_id, args.repeat)
+
+        migrations.upgrade(db.engine)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        report('after migration 0003', user_id, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
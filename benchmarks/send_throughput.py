@@ -0,0 +1,265 @@
+"""
+End-to-end send throughput benchmark.
+
+Drives the three sending entry points against the local SMTP sink and reports
+messages per second, p50/p99 per-message latency and peak RSS:
+
+    python -m benchmarks.send_throughput
+    python -m benchmarks.send_throughput --counts 1000 --scenarios send_email --latency 0.01
+
+Scenarios:
+    send_email   EmailService.send_email called once per message
+    send_bulk    EmailService.send_bulk_emails for the whole batch
+    endpoint     POST /email/process-bulk-emails, then the worker drains the job
+
+Each scenario and size runs in its own process so peak RSS is not shared, and
+the sink runs in another process so its work is not counted. Latency is the
+time of the SMTP hand-off for each message; for the endpoint the request time
+is reported separately.
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ('send_email', 'send_bulk', 'endpoint')
+DEFAULT_COUNTS = (1000, 10000, 100000)
+
+HTML = ('<html><body><h1>Hello {name}</h1><p>Thanks for being a customer. '
+        '<a href="https://example.com/offer">See the offer</a></p></body></html>')
+
+
+def sink_config(port):
+    return {
+        'server': '127.0.0.1',
+        'port': port,
+        'use_tls': False,
+        'username': 'sink',
+        'password': 'sink',
+        'email': 'sender@example.com',
+        'name': 'Benchmark',
+        'max_per_second': 1e9,
+        'burst': 1000000
+    }
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(owner, name, samples):
+    """Wrap owner.name so every call's duration is appended to samples"""
+    original = getattr(owner, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    setattr(owner, name, staticmethod(wrapper) if isinstance(owner, type) else wrapper)
+    return original
+
+
+def run_send_email(count, port):
+    from src.email_service import EmailService
+
+    smtp_config = sink_config(port)
+    samples = []
+    successes = 0
+    start = time.perf_counter()
+    for i in range(count):
+        sent_at = time.perf_counter()
+        success, _ = EmailService.send_email(
+            f'user{i}@example.com', f'Hello user {i}', HTML.format(name=f'user {i}'), smtp_config
+        )
+        samples.append(time.perf_counter() - sent_at)
+        successes += success
+    return time.perf_counter() - start, samples, successes, {}
+
+
+def run_send_bulk(count, port):
+    from src.email_service import EmailService
+
+    recipients = [{'email': f'user{i}@example.com', 'name': f'user {i}'} for i in range(count)]
+    contents = [HTML.format(name=recipient['name']) for recipient in recipients]
+    samples = []
+    timed(EmailService, 'send_prebuilt', samples)
+
+    start = time.perf_counter()
+    results = EmailService.send_bulk_emails(
+        recipients, 'Hello {name}', contents, sink_config(port), delay_seconds=0
+    )
+    return time.perf_counter() - start, samples, results['successful'], {}
+
+
+def run_endpoint(count, port):
+    from src.app import app
+    from src.models import SendJob, SMTPConfig, User, db
+    from src.email_service import EmailService
+    import src.worker as worker
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='bench')
+        db.session.add(user)
+        db.session.commit()
+        smtp_config = SMTPConfig(
+            user_id=user.id, name='sink', server='127.0.0.1', port=port, use_tls=False,
+            username='sink', password='sink', email='sender@example.com',
+            max_per_second=1e9, burst=1000000
+        )
+        db.session.add(smtp_config)
+        db.session.commit()
+        user_id, config_id = user.id, smtp_config.id
+
+    emails = [
+        {'recipient': f'user{i}@example.com', 'subject': f'Hello user {i}',
+         'content': HTML.format(name=f'user {i}')}
+        for i in range(count)
+    ]
+    samples = []
+    timed(EmailService, 'deliver_prebuilt', samples)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    start = time.perf_counter()
+    response = client.post('/email/process-bulk-emails', json={
+        'smtp_config_id': config_id,
+        'campaign_name': 'benchmark',
+        'delay': 0,
+        'emails': emails
+    })
+    request_seconds = time.perf_counter() - start
+    job_id = response.get_json()['job_id']
+
+    while True:
+        worker.run_worker(once=True)
+        with app.app_context():
+            job = db.session.get(SendJob, job_id)
+            if job.status in ('completed', 'failed'):
+                sent = job.sent
+                break
+    return time.perf_counter() - start, samples, sent, {'request_seconds': round(request_seconds, 3)}
+
+
+RUNNERS = {
+    'send_email': run_send_email,
+    'send_bulk': run_send_bulk,
+    'endpoint': run_endpoint
+}
+
+
+def run_one(scenario, count, port):
+    """Run one scenario in this process and return its measurements"""
+    elapsed, samples, sent, extra = RUNNERS[scenario](count, port)
+    result = {
+        'scenario': scenario,
+        'count': count,
+        'sent': sent,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    result.update(extra)
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_sink(port, args):
+    command = [
+        sys.executable, '-m', 'src.utils.smtp_sink', '--port', str(port),
+        '--latency', str(args.latency), '--temp-fail-rate', str(args.temp_fail_rate)
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('SMTP sink did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie send throughput benchmark')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--counts', nargs='+', type=int, default=list(DEFAULT_COUNTS))
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the sink waits before accepting each message')
+    parser.add_argument('--temp-fail-rate', type=float, default=0.0,
+                        help='Fraction of messages the sink defers with 451')
+    parser.add_argument('--json', action='store_true', help='Print one JSON object per run')
+    parser.add_argument('--child', nargs=3, metavar=('SCENARIO', 'COUNT', 'PORT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scenario, count, port = args.child
+        print(json.dumps(run_one(scenario, int(count), int(port))))
+        return
+
+    port = free_port()
+    sink = start_sink(port, args)
+    workdir = tempfile.mkdtemp(prefix='inbox_genie_bench_')
+    try:
+        if not args.json:
+            print(f"{'scenario':<12}{'count':>8}{'sent':>8}{'seconds':>10}{'msg/s':>10}"
+                  f"{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>9}")
+        for scenario in args.scenarios:
+            for count in args.counts:
+                env = dict(os.environ)
+                env['DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, f'{scenario}_{count}.db')}"
+                env['RATE_LIMIT_STATE_FILE'] = os.path.join(workdir, f'{scenario}_{count}.json')
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.send_throughput', '--child', scenario, str(count), str(port)],
+                    cwd=ROOT, env=env, capture_output=True, text=True
+                )
+                if output.returncode != 0:
+                    print(f"{scenario} x {count} failed:\n{output.stderr}", file=sys.stderr)
+                    continue
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print(f"{scenario:<12}{count:>8}{result['sent']:>8}{result['seconds']:>10}"
+                          f"{result['messages_per_second']:>10}{result['p50_ms']:>10}"
+                          f"{result['p99_ms']:>10}{result['peak_rss_mb']:>9}")
+    finally:
+        sink.terminate()
+        sink.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Tracking rewrite benchmark.
+
+Measures how many messages per second get the open pixel and click tracking
+added, on bodies of increasing size, for the single-pass rewriter and for the
+previous two-pass approach (kept here as the baseline):
+
+    python -m benchmarks.tracking_rewrite
+    python -m benchmarks.tracking_rewrite --sizes 100 --links 500 --seconds 2
+
+Runs on one core; no database or SMTP server is needed.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from src.utils.tracking import generate_tracking_token  # noqa: E402
+from src.utils.tracking_rewriter import rewrite_tracking  # noqa: E402
+
+BASE_URL = 'https://app.example.com'
+DEFAULT_SIZES = (2, 20, 200)  # KB
+
+
+def make_html(size_kb, links):
+    """A body of roughly size_kb kilobytes with the given number of links"""
+    paragraph = ('<p>We help teams like yours ship faster without adding headcount. '
+                 'Here is what changed for customers last quarter.</p>\n')
+    parts = []
+    for i in range(links):
+        parts.append(f'<p><a href="https://example.com/page/{i % 20}?utm_source=mail&amp;id={i % 5}" '
+                     f'class="link">Read more</a></p>\n')
+    if links:
+        parts.append('<p><a href="https://example.com/unsubscribe">Unsubscribe</a></p>\n')
+    filler = max(0, size_kb * 1024 - sum(len(part) for part in parts))
+    parts.insert(0, paragraph * (filler // len(paragraph) + 1))
+    return '<html><body>\n' + ''.join(parts) + '</body></html>'
+
+
+def legacy_rewrite(html_content, email_id, base_url):
+    """The previous add_tracking_pixel followed by add_click_tracking"""
+    token = generate_tracking_token(email_id)
+    pixel_url = f"{base_url}/track/open/{token}.gif"
+    tracking_pixel = (f'<img src="{pixel_url}" width="1" height="1" alt="" '
+                      f'style="display:none;border:0;width:1px;height:1px" />')
+    if '</body>' in html_content:
+        html_content = html_content.replace('</body>', f'{tracking_pixel}</body>')
+    else:
+        html_content = f'{html_content}{tracking_pixel}'
+
+    token = generate_tracking_token(email_id)
+    link_pattern = re.compile(r'<a\s+(?:[^>]*?\s+)?href=(["\'])(.*?)\1', re.IGNORECASE)
+
+    def replace_link(match):
+        href = match.group(2)
+        if 'unsubscribe' in href.lower() or 'mailto:' in href.lower():
+            return match.group(0)
+        tracking_url = f"{base_url}/track/click/{token}?url={href}"
+        return match.group(0).replace(match.group(2), tracking_url)
+
+    return link_pattern.sub(replace_link, html_content)
+
+
+def single_pass_rewrite(html_content, email_id, base_url):
+    return rewrite_tracking(html_content, generate_tracking_token(email_id), base_url)
+
+
+def measure(function, html_content, seconds):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(20):
+            function(html_content, count + 1, BASE_URL)
+            count += 1
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie tracking rewrite benchmark')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES),
+                        help='Body sizes in KB')
+    parser.add_argument('--links', type=int, default=50, help='Links per body')
+    parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on each measurement')
+    args = parser.parse_args()
+
+    print(f"{'size KB':>8}{'links':>7}{'legacy msg/s':>15}{'single msg/s':>15}{'MB/s':>9}{'speedup':>9}")
+    for size_kb in args.sizes:
+        html_content = make_html(size_kb, args.links)
+        legacy = measure(legacy_rewrite, html_content, args.seconds)
+        single = measure(single_pass_rewrite, html_content, args.seconds)
+        throughput = single * len(html_content) / 1e6
+        print(f"{size_kb:>8}{args.links:>7}{legacy:>15.0f}{single:>15.0f}{throughput:>9.1f}{single / legacy:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
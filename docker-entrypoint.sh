@@ -20,8 +20,8 @@ done
 echo "PostgreSQL started"
 
 # Run database migrations
-echo "Creating/updating database tables..."
-python -c "from src.app import app; from src.models import db; app.app_context().push(); db.create_all()"
+echo "Applying database migrations..."
+python -m src.migrations
 
 echo "Database setup complete"
 
@@ -0,0 +1,563 @@
+import asyncio
+import base64
+import os
+import queue
+import re
+import ssl
+import threading
+import weakref
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .email_service import EmailService
+from .utils.smtp_pool import SMTPConnectionPool
+from .utils.rate_limiter import RateLimitExceeded, limits_for
+from .utils.mime_builder import CampaignMessageBuilder
+from .utils.smtp_health import circuit_breakers, is_outage, smtp_health
+
+
+# In-flight messages and connections per SMTP configuration when the workers use this engine
+ASYNC_CONCURRENCY = int(os.getenv('SMTP_ASYNC_CONCURRENCY', 1000))
+ASYNC_CONNECTIONS = int(os.getenv('SMTP_ASYNC_CONNECTIONS', 20))
+
+
+class SMTPReplyError(Exception):
+    """An SMTP command got an unexpected reply from the server"""
+
+    def __init__(self, code: int, message: str, command: str = ''):
+        self.code = code
+        self.message = message
+        self.command = command
+        super().__init__(f"{code} {message}" + (f" (in reply to {command})" if command else ''))
+
+
+_BARE_LF = re.compile(rb'(?<!\r)\n')
+_LEADING_DOT = re.compile(rb'^\.', re.MULTILINE)
+
+
+async def start_tls(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, sslcontext: ssl.SSLContext,
+                    server_hostname: Optional[str] = None
+                    ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Upgrade a stream connection to TLS
+
+    StreamWriter.start_tls only exists from Python 3.11. Before that the
+    transport is upgraded with loop.start_tls and given a new reader and
+    writer; the plain-text ones must not be used afterwards.
+
+    Returns:
+        The reader and writer to use for the rest of the connection
+    """
+    if hasattr(writer, 'start_tls'):
+        await writer.start_tls(sslcontext, server_hostname=server_hostname)
+        return reader, writer
+    loop = asyncio.get_running_loop()
+    # Built the way asyncio.open_connection builds its pair
+    tls_reader = asyncio.StreamReader()
+    protocol = asyncio.StreamReaderProtocol(tls_reader)
+    transport = await loop.start_tls(writer.transport, protocol, sslcontext, server_hostname=server_hostname)
+    # loop.start_tls does not call connection_made on the new protocol
+    protocol.connection_made(transport)
+    return tls_reader, asyncio.StreamWriter(transport, protocol, tls_reader, loop)
+
+
+def _prepare_data(message) -> bytes:
+    """Normalise line endings to CRLF and dot-stuff a message for DATA"""
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    data = _LEADING_DOT.sub(b'..', _BARE_LF.sub(b'\r\n', message))
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+class AsyncSMTPClient:
+    """
+    Minimal SMTP client built on asyncio streams
+
+    Supports EHLO, STARTTLS, AUTH PLAIN/LOGIN, PIPELINING of the envelope
+    commands, and MAIL/RCPT/DATA. One client is one connection; use
+    AsyncSMTPPool to share connections between coroutines.
+    """
+
+    def __init__(self, server: str, port: int = 587, use_tls: bool = True,
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 timeout: float = 30.0, local_hostname: str = 'localhost'):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.local_hostname = local_hostname
+        self.extensions: Dict[str, str] = {}
+        self._reader = None
+        self._writer = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _read_reply(self) -> Tuple[int, str]:
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionError("SMTP server closed the connection")
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            lines.append(line[4:])
+            if len(line) < 4 or line[3] != '-':
+                return int(line[:3]), '\n'.join(lines)
+
+    async def _send_line(self, line: str):
+        if '\r' in line or '\n' in line:
+            # An address with a line break would smuggle in extra SMTP commands
+            raise ValueError("SMTP command contains a line break")
+        self._writer.write(line.encode('utf-8') + b'\r\n')
+        await self._writer.drain()
+
+    async def command(self, line: str, expected=(250,)) -> Tuple[int, str]:
+        """Send a command and check the reply code"""
+        await self._send_line(line)
+        code, message = await self._read_reply()
+        if code not in expected:
+            raise SMTPReplyError(code, message, line.split(' ', 1)[0])
+        return code, message
+
+    async def _ehlo(self):
+        _, message = await self.command(f"EHLO {self.local_hostname}")
+        self.extensions = {}
+        for line in message.split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.upper()] = params
+
+    async def connect(self):
+        """Open the connection, upgrade to TLS if configured, and log in"""
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port), self.timeout
+        )
+        code, message = await self._read_reply()
+        if code != 220:
+            raise SMTPReplyError(code, message, 'CONNECT')
+        await self._ehlo()
+
+        if self.use_tls:
+            await self.command("STARTTLS", expected=(220,))
+            self._reader, self._writer = await start_tls(self._reader, self._writer, ssl.create_default_context(),
+                                                         server_hostname=self.server)
+            await self._ehlo()
+
+        if self.username:
+            await self._login()
+
+    async def _login(self):
+        mechanisms = self.extensions.get('AUTH', '').upper().split()
+        if 'PLAIN' in mechanisms or not mechanisms:
+            token = base64.b64encode(f"\0{self.username}\0{self.password}".encode()).decode()
+            await self._auth_command(f"AUTH PLAIN {token}", token, expected=(235,))
+        else:
+            await self.command("AUTH LOGIN", expected=(334,))
+            username = base64.b64encode(self.username.encode()).decode()
+            await self._auth_command(username, username, expected=(334,))
+            password = base64.b64encode(self.password.encode()).decode()
+            await self._auth_command(password, password, expected=(235,))
+
+    async def _auth_command(self, line: str, secret: str, expected):
+        """Send a line carrying credentials; errors never repeat them, even if the server echoes them"""
+        try:
+            return await self.command(line, expected=expected)
+        except SMTPReplyError as e:
+            raise SMTPReplyError(e.code, e.message.replace(secret, '[redacted]'), 'AUTH') from None
+
+    async def sendmail(self, sender: str, recipients: List[str], message) -> Dict[str, Tuple[int, str]]:
+        """
+        Send one message
+
+        Returns:
+            Dictionary of refused recipients, like smtplib.SMTP.sendmail
+
+        Raises:
+            SMTPReplyError if the sender, every recipient, or the data is refused
+        """
+        envelope = [f"MAIL FROM:<{sender}>"] + [f"RCPT TO:<{rcpt}>" for rcpt in recipients]
+        if any('\r' in line or '\n' in line for line in envelope):
+            raise ValueError("SMTP command contains a line break")
+
+        if 'PIPELINING' in self.extensions:
+            self._writer.write(''.join(line + '\r\n' for line in envelope).encode('utf-8'))
+            await self._writer.drain()
+            replies = [await self._read_reply() for _ in envelope]
+        else:
+            replies = []
+            for line in envelope:
+                await self._send_line(line)
+                replies.append(await self._read_reply())
+
+        code, text = replies[0]
+        if code != 250:
+            await self.reset()
+            raise SMTPReplyError(code, text, 'MAIL')
+
+        refused = {
+            rcpt: reply for rcpt, reply in zip(recipients, replies[1:])
+            if reply[0] not in (250, 251)
+        }
+        if len(refused) == len(recipients):
+            await self.reset()
+            code, text = next(iter(refused.values()))
+            raise SMTPReplyError(code, text, 'RCPT')
+
+        await self.command("DATA", expected=(354,))
+        self._writer.write(_prepare_data(message))
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if code != 250:
+            raise SMTPReplyError(code, text, 'DATA')
+        return refused
+
+    async def reset(self):
+        try:
+            await self.command("RSET")
+        except Exception:
+            pass
+
+    async def noop(self) -> bool:
+        try:
+            await self.command("NOOP")
+            return True
+        except Exception:
+            return False
+
+    async def quit(self):
+        """Say goodbye to the server and close the connection"""
+        if self._writer is None:
+            return
+        try:
+            await self.command("QUIT", expected=(221,))
+        except Exception:
+            pass
+        await self.close()
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except Exception:
+            pass
+        self._writer = None
+        self._reader = None
+
+
+class AsyncSMTPPool:
+    """Bounded set of AsyncSMTPClient connections per SMTP configuration"""
+
+    def __init__(self, max_connections: int = 20, timeout: float = 30.0):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle: Dict[Tuple, List[AsyncSMTPClient]] = {}
+        self._slots: Dict[Tuple, asyncio.Semaphore] = {}
+
+    async def _acquire(self, smtp_config: Dict) -> Tuple[Tuple, AsyncSMTPClient]:
+        key = SMTPConnectionPool.config_key(smtp_config)
+        slots = self._slots.setdefault(key, asyncio.Semaphore(self.max_connections))
+        await slots.acquire()
+        idle = self._idle.setdefault(key, [])
+        while idle:
+            client = idle.pop()
+            if client.is_connected:
+                return key, client
+        client = AsyncSMTPClient(
+            smtp_config.get('server'),
+            int(smtp_config.get('port', 587)),
+            use_tls=smtp_config.get('use_tls', True),
+            username=smtp_config.get('username'),
+            password=smtp_config.get('password'),
+            timeout=self.timeout
+        )
+        try:
+            started = asyncio.get_running_loop().time()
+            await client.connect()
+            smtp_health.record_connect(smtp_config, asyncio.get_running_loop().time() - started)
+        except Exception:
+            slots.release()
+            await client.close()
+            raise
+        return key, client
+
+    def _release(self, key: Tuple, client: AsyncSMTPClient, reusable: bool):
+        if reusable and client.is_connected:
+            self._idle[key].append(client)
+        self._slots[key].release()
+
+    async def sendmail(self, smtp_config: Dict, sender: str, recipients: List[str], message):
+        """Send a message over a pooled connection, failing fast while the server's breaker is open"""
+        breaker_key = circuit_breakers.key_for(smtp_config)
+        circuit_breakers.check(breaker_key)
+        try:
+            refused = await self._sendmail(smtp_config, sender, recipients, message)
+        except Exception as e:
+            if is_outage(e):
+                circuit_breakers.record_failure(breaker_key)
+            else:
+                circuit_breakers.record_response(breaker_key)
+            smtp_health.record_send(smtp_config, False, e)
+            raise
+        circuit_breakers.record_success(breaker_key)
+        smtp_health.record_send(smtp_config, True)
+        return refused
+
+    async def _sendmail(self, smtp_config: Dict, sender: str, recipients: List[str], message):
+        key, client = await self._acquire(smtp_config)
+        try:
+            refused = await client.sendmail(sender, recipients, message)
+        except SMTPReplyError as e:
+            # The session survives a refused envelope; anything else is suspect
+            reusable = e.command in ('MAIL', 'RCPT')
+            if not reusable:
+                await client.close()
+            self._release(key, client, reusable)
+            raise
+        except BaseException:
+            await client.close()
+            self._release(key, client, False)
+            raise
+        self._release(key, client, True)
+        return refused
+
+    async def close_all(self):
+        for clients in self._idle.values():
+            for client in clients:
+                await client.quit()
+            clients.clear()
+
+
+# Per event loop, one lock per rate limit key that its waiters queue on
+_limiter_locks = weakref.WeakKeyDictionary()
+
+
+def _limiter_lock(key) -> asyncio.Lock:
+    locks = _limiter_locks.setdefault(asyncio.get_running_loop(), {})
+    if key not in locks:
+        locks[key] = asyncio.Lock()
+    return locks[key]
+
+
+async def wait_for_rate_limit(rate_limiter, key, smtp_config: Dict, delay_seconds: Optional[float],
+                              max_wait: Optional[float] = None):
+    """
+    Wait for a send to be allowed without blocking the event loop; no limiter means no wait
+
+    The limiter may do file or database I/O, so it is called from a thread.
+    Waiters for the same key queue on one lock and only the one at its head
+    asks the limiter, so a thousand waiting sends cost one call per token
+    rather than a thousand.
+
+    Raises:
+        RateLimitExceeded: If max_wait is given and the send would have to wait longer
+    """
+    if not rate_limiter:
+        return
+    limits = limits_for(smtp_config, delay_seconds)
+    loop = asyncio.get_running_loop()
+    deadline = None if max_wait is None else loop.time() + max_wait
+    lock = _limiter_lock(key)
+    try:
+        await asyncio.wait_for(lock.acquire(), None if deadline is None else max(0.0, deadline - loop.time()))
+    except asyncio.TimeoutError:
+        # Still queued behind other sends at the deadline
+        raise RateLimitExceeded(key, max_wait) from None
+    try:
+        while True:
+            wait = await asyncio.to_thread(rate_limiter.try_acquire, key, **limits)
+            if wait <= 0:
+                return
+            if deadline is not None and loop.time() + wait > deadline:
+                raise RateLimitExceeded(key, wait)
+            await asyncio.sleep(wait)
+    finally:
+        lock.release()
+
+
+class AsyncEmailService:
+    """
+    asyncio counterpart of EmailService
+
+    Results follow the same (success, message) contract as
+    EmailService.send_email so callers can switch engines freely.
+    """
+
+    def __init__(self, max_connections: int = 20, rate_limiter=None):
+        self.pool = AsyncSMTPPool(max_connections=max_connections)
+        self.rate_limiter = rate_limiter
+
+    async def _wait_for_rate_limit(self, smtp_config: Dict, delay_seconds: Optional[float]):
+        key = smtp_config.get('id') or SMTPConnectionPool.config_key(smtp_config)
+        await wait_for_rate_limit(self.rate_limiter, key, smtp_config, delay_seconds)
+
+    async def send_email(
+        self,
+        recipient_email: str,
+        subject: str,
+        html_content: str,
+        smtp_config: Dict,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        reply_to: Optional[str] = None,
+        delay_seconds: Optional[float] = None
+    ) -> Tuple[bool, str]:
+        """
+        Send an email using the provided SMTP configuration
+
+        Returns:
+            Tuple containing success status (bool) and message (str)
+        """
+        try:
+            if not all([smtp_config.get('email'), smtp_config.get('server'),
+                        smtp_config.get('username'), smtp_config.get('password')]):
+                return False, "Missing required SMTP settings"
+
+            recipients, message = EmailService.build_message(
+                recipient_email, subject, html_content, smtp_config,
+                cc=cc, bcc=bcc, reply_to=reply_to
+            )
+            await self._wait_for_rate_limit(smtp_config, delay_seconds)
+            await self.pool.sendmail(smtp_config, smtp_config.get('email'), recipients, message)
+            return True, "Email sent successfully"
+
+        except Exception as e:
+            return False, f"Failed to send email: {str(e)}"
+
+    async def send_many(self, messages: List[Dict], smtp_config: Dict,
+                        concurrency: int = 1000, delay_seconds: Optional[float] = None
+                        ) -> List[Tuple[bool, str]]:
+        """
+        Send many emails concurrently through one SMTP configuration
+
+        Args:
+            messages: Dictionaries with recipient_email, subject, html_content
+                and optionally cc, bcc and reply_to
+            smtp_config: Dictionary containing SMTP configuration
+            concurrency: Maximum messages in flight at once; they share the
+                pool's connections
+            delay_seconds: Optional cap on the send rate, as in send_bulk_emails
+
+        Returns:
+            List of (success, message) tuples in the same order as messages
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        builder = CampaignMessageBuilder(smtp_config)
+        sender_email = smtp_config.get('email')
+
+        async def send_one(message: Dict) -> Tuple[bool, str]:
+            async with semaphore:
+                # Messages with their own CC/BCC/Reply-To cannot share the campaign skeleton
+                if message.get('cc') or message.get('bcc') or message.get('reply_to'):
+                    return await self.send_email(
+                        recipient_email=message['recipient_email'],
+                        subject=message.get('subject', ''),
+                        html_content=message.get('html_content', ''),
+                        smtp_config=smtp_config,
+                        cc=message.get('cc'),
+                        bcc=message.get('bcc'),
+                        reply_to=message.get('reply_to'),
+                        delay_seconds=delay_seconds
+                    )
+                try:
+                    data = builder.build(message['recipient_email'], message.get('subject', ''),
+                                         message.get('html_content', ''))
+                    await self._wait_for_rate_limit(smtp_config, delay_seconds)
+                    await self.pool.sendmail(smtp_config, sender_email,
+                                             builder.envelope_recipients(message['recipient_email']), data)
+                    return True, "Email sent successfully"
+                except Exception as e:
+                    return False, f"Failed to send email: {str(e)}"
+
+        if not all([sender_email, smtp_config.get('server'),
+                    smtp_config.get('username'), smtp_config.get('password')]):
+            return [(False, "Missing required SMTP settings")] * len(messages)
+
+        return list(await asyncio.gather(*(send_one(message) for message in messages)))
+
+    async def close(self):
+        await self.pool.close_all()
+
+    @staticmethod
+    def run_send_many(messages: List[Dict], smtp_config: Dict, **kwargs) -> List[Tuple[bool, str]]:
+        """Synchronous entry point for send_many, for workers without an event loop"""
+        async def run():
+            service = AsyncEmailService(max_connections=kwargs.pop('max_connections', 20),
+                                        rate_limiter=kwargs.pop('rate_limiter', None))
+            try:
+                return await service.send_many(messages, smtp_config, **kwargs)
+            finally:
+                await service.close()
+        return asyncio.run(run())
+
+
+def run_dispatcher(dispatcher, assignments: Dict, prepare_fn: Callable[[object, Dict, object], Tuple[List[str], bytes]],
+                   concurrency: int = ASYNC_CONCURRENCY, max_connections: int = ASYNC_CONNECTIONS
+                   ) -> Iterator[Tuple[object, object, bool, str, Optional[BaseException]]]:
+    """
+    asyncio counterpart of MultiSenderDispatcher.run
+
+    The messages are sent from an event loop on a helper thread, so up to
+    ``concurrency`` of them are in flight over at most ``max_connections``
+    connections per SMTP configuration, instead of one thread each. Results
+    are yielded on the calling thread as they complete, in the same form as
+    MultiSenderDispatcher.run.
+
+    Args:
+        dispatcher: MultiSenderDispatcher holding the SMTP configurations,
+            rate limiter, send delay and thread initializer
+        assignments: Mapping of config key to the items it should send
+        prepare_fn: Called as prepare_fn(key, smtp_config, item); returns the
+            envelope recipients and message bytes, or raises on failure
+        concurrency: Maximum messages in flight at once
+        max_connections: Maximum connections per SMTP configuration
+    """
+    results = queue.Queue()
+    finished = object()
+
+    async def send_all():
+        loop = asyncio.get_running_loop()
+        pool = AsyncSMTPPool(max_connections=max_connections)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send_one(key, item):
+            smtp_config = dispatcher.smtp_configs[key]
+            async with semaphore:
+                try:
+                    recipients, message = prepare_fn(key, smtp_config, item)
+                    await wait_for_rate_limit(dispatcher.rate_limiter, key, smtp_config,
+                                              dispatcher.delay_seconds, dispatcher.max_wait)
+                    started = loop.time()
+                    await pool.sendmail(smtp_config, smtp_config.get('email'), recipients, message)
+                    dispatcher.latency_tracker.observe(key, loop.time() - started)
+                    results.put((key, item, True, "Email sent successfully", None))
+                except Exception as e:
+                    results.put((key, item, False, str(e), e))
+
+        try:
+            await asyncio.gather(*(send_one(key, item) for key, items in assignments.items() for item in items))
+        finally:
+            await pool.close_all()
+
+    def run():
+        try:
+            if dispatcher.thread_initializer:
+                dispatcher.thread_initializer()
+            asyncio.run(send_all())
+        finally:
+            results.put(finished)
+
+    thread = threading.Thread(target=run, name='smtp-async', daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = results.get()
+            if result is finished:
+                return
+            yield result
+    finally:
+        thread.join()
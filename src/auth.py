@@ -14,6 +14,7 @@ import secrets
 
 # Import database models
 from .models import db, User, LoginAttempt, UserSession
+from . import migrations
 
 # Create blueprint for auth routes
 auth_bp = Blueprint('auth', __name__)
@@ -417,7 +418,10 @@ def init_auth(app):
     login_manager.init_app(app)
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
-    with app.app_context():
-        db.create_all()
+    # Bring the schema up to date; deployments run `python -m src.migrations`
+    # instead and set AUTO_MIGRATE=0
+    if migrations.AUTO_MIGRATE:
+        with app.app_context():
+            migrations.upgrade(db.engine)
     
     return app
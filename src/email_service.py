@@ -6,6 +6,16 @@ from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
 from datetime import datetime
 from typing import Dict, List, Optional, Union, Tuple
+from .utils.smtp_pool import smtp_pool
+from .models import db
+from .utils.rate_limiter import memory_rate_limiter, limits_for, shared_rate_limiter
+from .utils.mime_builder import CampaignMessageBuilder
+from .utils.tracking import generate_tracking_token
+from .utils.tracking_rewriter import rewrite_tracking
+
+# Rate limiter shared with the workers, created on first use
+_shared_rate_limiter = None
+
 
 class EmailService:
     """Service for handling email configuration and sending through SMTP"""
@@ -38,60 +48,131 @@ class EmailService:
             Tuple containing success status (bool) and message (str)
         """
         try:
-            # Extract SMTP settings from config
-            sender_email = smtp_config.get('email')
-            sender_name = smtp_config.get('name', '')
-            server = smtp_config.get('server')
-            port = int(smtp_config.get('port', 587))
-            username = smtp_config.get('username')
-            password = smtp_config.get('password')
-            use_tls = smtp_config.get('use_tls', True)
-            
-            # Validate required SMTP settings
-            if not all([sender_email, server, username, password]):
-                return False, "Missing required SMTP settings"
-            
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = formataddr((sender_name, sender_email))
-            msg['To'] = recipient_email
-            
-            # Add CC recipients if provided
-            if cc:
-                msg['Cc'] = ', '.join(cc)
-                
-            # Add Reply-To if provided
-            if reply_to:
-                msg['Reply-To'] = reply_to
-                
-            # Add HTML content
-            msg.attach(MIMEText(html_content, 'html'))
+            EmailService.deliver(
+                recipient_email, subject, html_content, smtp_config,
+                cc=cc, bcc=bcc, reply_to=reply_to
+            )
+            return True, "Email sent successfully"
             
-            # Get all recipients (for sending)
-            recipients = [recipient_email]
-            if cc:
-                recipients.extend(cc)
-            if bcc:
-                recipients.extend(bcc)
+        except ValueError as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"Failed to send email: {str(e)}"
+    
+    @staticmethod
+    def deliver(
+        recipient_email: str,
+        subject: str,
+        html_content: str,
+        smtp_config: Dict,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        reply_to: Optional[str] = None
+    ) -> None:
+        """
+        Send an email, raising on failure
+        
+        Same as send_email, but the original exception is propagated so
+        callers such as the background worker can tell transient failures
+        from permanent ones.
+        
+        Raises:
+            ValueError: If required SMTP settings are missing
+            smtplib.SMTPException or OSError: If sending fails
+        """
+        # Extract SMTP settings from config
+        sender_email = smtp_config.get('email')
+        server = smtp_config.get('server')
+        username = smtp_config.get('username')
+        password = smtp_config.get('password')
+        
+        # Validate required SMTP settings
+        if not all([sender_email, server, username, password]):
+            raise ValueError("Missing required SMTP settings")
+        
+        # Create message
+        recipients, message = EmailService.build_message(
+            recipient_email, subject, html_content, smtp_config,
+            cc=cc, bcc=bcc, reply_to=reply_to
+        )
+        
+        # Send over a pooled, already authenticated SMTP session
+        smtp_pool.sendmail(smtp_config, sender_email, recipients, message)
+    
+    @staticmethod
+    def send_prebuilt(recipients: List[str], message: bytes, smtp_config: Dict) -> Tuple[bool, str]:
+        """
+        Send a message that was already assembled, e.g. by CampaignMessageBuilder
+        
+        Args:
+            recipients: Envelope recipients (To, CC and BCC addresses)
+            message: Wire-format message bytes with CRLF line endings
+            smtp_config: Dictionary containing SMTP configuration
             
-            # Connect to SMTP server and send email
-            if use_tls:
-                context = ssl.create_default_context()
-                with smtplib.SMTP(server, port) as smtp:
-                    smtp.starttls(context=context)
-                    smtp.login(username, password)
-                    smtp.sendmail(sender_email, recipients, msg.as_string())
-            else:
-                with smtplib.SMTP(server, port) as smtp:
-                    smtp.login(username, password)
-                    smtp.sendmail(sender_email, recipients, msg.as_string())
-                    
+        Returns:
+            Tuple containing success status (bool) and message (str)
+        """
+        try:
+            EmailService.deliver_prebuilt(recipients, message, smtp_config)
             return True, "Email sent successfully"
-            
         except Exception as e:
             return False, f"Failed to send email: {str(e)}"
     
+    @staticmethod
+    def deliver_prebuilt(recipients: List[str], message: bytes, smtp_config: Dict) -> None:
+        """Send an already assembled message, raising on failure like deliver"""
+        smtp_pool.sendmail(smtp_config, smtp_config.get('email'), recipients, message)
+    
+    @staticmethod
+    def build_message(
+        recipient_email: str,
+        subject: str,
+        html_content: str,
+        smtp_config: Dict,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        reply_to: Optional[str] = None
+    ) -> Tuple[List[str], str]:
+        """
+        Build the MIME message for an email
+        
+        Args:
+            recipient_email: Email address of the recipient
+            subject: Email subject line
+            html_content: HTML content of the email
+            smtp_config: Dictionary containing SMTP configuration
+            cc: List of CC email addresses
+            bcc: List of BCC email addresses
+            reply_to: Reply-to email address
+            
+        Returns:
+            Tuple containing the envelope recipients and the serialized message
+        """
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = formataddr((smtp_config.get('name', ''), smtp_config.get('email')))
+        msg['To'] = recipient_email
+        
+        # Add CC recipients if provided
+        if cc:
+            msg['Cc'] = ', '.join(cc)
+            
+        # Add Reply-To if provided
+        if reply_to:
+            msg['Reply-To'] = reply_to
+            
+        # Add HTML content
+        msg.attach(MIMEText(html_content, 'html'))
+        
+        # Get all recipients (for sending)
+        recipients = [recipient_email]
+        if cc:
+            recipients.extend(cc)
+        if bcc:
+            recipients.extend(bcc)
+        
+        return recipients, msg.as_string()
+    
     @staticmethod
     def test_smtp_connection(smtp_config: Dict) -> Tuple[bool, str]:
         """
@@ -130,6 +211,23 @@ class EmailService:
         except Exception as e:
             return False, f"Failed to connect to SMTP server: {str(e)}"
     
+    @staticmethod
+    def rate_limiter_for(smtp_config: Dict):
+        """
+        Get the rate limiter for an SMTP configuration
+
+        Saved configurations share their limit with the workers and every
+        other web process, so several processes sending for the same sender
+        stay within its rate together. Unsaved configurations have no shared
+        key and are limited per process.
+        """
+        global _shared_rate_limiter
+        if not smtp_config.get('id'):
+            return memory_rate_limiter
+        if _shared_rate_limiter is None:
+            _shared_rate_limiter = shared_rate_limiter(db)
+        return _shared_rate_limiter
+    
     @staticmethod
     def send_bulk_emails(
         recipients: List[Dict],
@@ -149,7 +247,7 @@ class EmailService:
             subject_template: Email subject line template
             email_contents: List of HTML content for each email
             smtp_config: Dictionary containing SMTP configuration
-            delay_seconds: Seconds to wait between emails (avoid rate limiting)
+            delay_seconds: Minimum average seconds between emails; caps the configured send rate
             cc: List of CC email addresses
             bcc: List of BCC email addresses
             reply_to: Reply-to email address
@@ -169,6 +267,16 @@ class EmailService:
             results["errors"].append("Number of recipients does not match number of email contents")
             return results
         
+        # Missing SMTP settings fail every message the same way
+        if not all([smtp_config.get('email'), smtp_config.get('server'),
+                    smtp_config.get('username'), smtp_config.get('password')]):
+            results["failed"] = len(recipients)
+            results["errors"].append("Missing required SMTP settings")
+            return results
+        
+        # Headers and MIME structure shared by the whole batch are encoded once
+        builder = CampaignMessageBuilder(smtp_config, cc=cc, bcc=bcc, reply_to=reply_to)
+        
         # Send each email
         for i, recipient in enumerate(recipients):
             recipient_email = recipient.get('email')
@@ -183,15 +291,15 @@ class EmailService:
                 if isinstance(value, str):
                     subject = subject.replace(f"{{{key}}}", value)
             
+            # Wait for the rate limiter instead of sleeping a fixed interval
+            limiter_key = smtp_config.get('id') or smtp_pool.config_key(smtp_config)
+            EmailService.rate_limiter_for(smtp_config).acquire(limiter_key, **limits_for(smtp_config, delay_seconds))
+            
             # Send the email
-            success, message = EmailService.send_email(
-                recipient_email=recipient_email,
-                subject=subject,
-                html_content=email_contents[i],
-                smtp_config=smtp_config,
-                cc=cc,
-                bcc=bcc,
-                reply_to=reply_to
+            success, message = EmailService.send_prebuilt(
+                builder.envelope_recipients(recipient_email),
+                builder.build(recipient_email, subject, email_contents[i]),
+                smtp_config
             )
             
             if success:
@@ -200,17 +308,15 @@ class EmailService:
                 results["failed"] += 1
                 results["errors"].append(f"Failed to send to {recipient_email}: {message}")
                 
-            # Add delay between sends to avoid rate limiting
-            if i < len(recipients) - 1 and delay_seconds > 0:
-                import time
-                time.sleep(delay_seconds)
-                
         return results
     
     @staticmethod
-    def add_tracking_pixel(html_content: str, email_id: int, base_url: str) -> str:
+    def add_tracking(html_content: str, email_id: int, base_url: str) -> str:
         """
-        Add tracking pixel to email HTML content
+        Add the tracking pixel and click tracking to email HTML content
+        
+        Both are added in a single scan of the HTML, with one token for the
+        pixel and every link.
         
         Args:
             html_content: Original HTML content of email
@@ -218,29 +324,29 @@ class EmailService:
             base_url: Base URL for tracking links (should include protocol and domain)
             
         Returns:
-            HTML content with tracking pixel added
+            HTML content with tracking added
         """
-        from app import generate_tracking_token
-        
-        # Generate tracking token for this email
-        token = generate_tracking_token(email_id)
-        
-        # Create tracking pixel URL
-        pixel_url = f"{base_url}/track/open/{token}.gif"
-        
-        # Add tracking pixel at the end of the email body
-        tracking_pixel = f'<img src="{pixel_url}" width="1" height="1" alt="" style="display:none;border:0;width:1px;height:1px" />'
+        return rewrite_tracking(html_content, generate_tracking_token(email_id), base_url)
+    
+    @staticmethod
+    def add_tracking_pixel(html_content: str, email_id: int, base_url: str, token: str = None) -> str:
+        """
+        Add tracking pixel to email HTML content
         
-        # Insert the tracking pixel before the closing body tag
-        if '</body>' in html_content:
-            html_content = html_content.replace('</body>', f'{tracking_pixel}</body>')
-        else:
-            html_content = f'{html_content}{tracking_pixel}'
+        Args:
+            html_content: Original HTML content of email
+            email_id: ID of the email in the database
+            base_url: Base URL for tracking links (should include protocol and domain)
+            token: Tracking token for the email, generated if not given
             
-        return html_content
+        Returns:
+            HTML content with tracking pixel added
+        """
+        token = token or generate_tracking_token(email_id)
+        return rewrite_tracking(html_content, token, base_url, links=False)
     
     @staticmethod
-    def add_click_tracking(html_content: str, email_id: int, base_url: str) -> str:
+    def add_click_tracking(html_content: str, email_id: int, base_url: str, token: str = None) -> str:
         """
         Add click tracking to all links in the email
         
@@ -248,30 +354,10 @@ class EmailService:
             html_content: Original HTML content of email
             email_id: ID of the email in the database
             base_url: Base URL for tracking links
+            token: Tracking token for the email, generated if not given
             
         Returns:
             HTML content with click tracking added to links
         """
-        import re
-        from app import generate_tracking_token
-        
-        # Generate tracking token for this email
-        token = generate_tracking_token(email_id)
-        
-        # Find all links in the HTML
-        link_pattern = re.compile(r'<a\s+(?:[^>]*?\s+)?href=(["\'])(.*?)\1', re.IGNORECASE)
-        
-        def replace_link(match):
-            href = match.group(2)
-            # Don't track unsubscribe or special links
-            if 'unsubscribe' in href.lower() or 'mailto:' in href.lower():
-                return match.group(0)
-            
-            # Create tracking URL with original URL as parameter
-            tracking_url = f"{base_url}/track/click/{token}?url={href}"
-            return match.group(0).replace(match.group(2), tracking_url)
-        
-        # Replace all links with tracking links
-        tracked_html = link_pattern.sub(replace_link, html_content)
-        
-        return tracked_html
+        token = token or generate_tracking_token(email_id)
+        return rewrite_tracking(html_content, token, base_url, pixel=False)
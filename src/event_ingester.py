@@ -0,0 +1,198 @@
+"""
+Ingester for the tracking event log.
+
+The tracking endpoints append open and click events to local segment files
+(see src/utils/event_log.py). This process loads sealed segments into the
+TrackingEvent table in bulk and adds them to the per-email open and click
+counters. Run it on the same host as the web server, pointing at the same
+TRACKING_LOG_DIR:
+
+    python -m src.event_ingester
+
+Each segment is loaded in one transaction that also records it in
+TrackingSegment, so a segment that is still on disk after a crash is
+recognised and not counted twice. A segment that cannot be loaded is renamed
+to ``.failed`` and left for inspection, so it does not hold up the rest.
+"""
+
+import argparse
+import csv
+import io
+import os
+import time
+from collections import Counter
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.exc import OperationalError
+
+from .app import app
+from .models import EmailHistory, TrackingEvent, TrackingSegment, db
+from .utils.event_log import LOG_DIR, SEALED_SUFFIX, read_segment, seal_orphaned_segments, sealed_segments
+
+# Email IDs checked for existence per query
+LOOKUP_CHUNK = 1000
+
+_COLUMNS = ('email_history_id', 'kind', 'occurred_at', 'link_index')
+
+# Segments that failed to load are renamed to this suffix and not retried
+FAILED_SUFFIX = '.failed'
+
+
+def _existing_email_ids(email_ids):
+    existing = set()
+    email_ids = list(email_ids)
+    for start in range(0, len(email_ids), LOOKUP_CHUNK):
+        chunk = email_ids[start:start + LOOKUP_CHUNK]
+        existing.update(row.id for row in db.session.query(EmailHistory.id).filter(EmailHistory.id.in_(chunk)))
+    return existing
+
+
+def _copy_events(rows):
+    """Load events with COPY on PostgreSQL, inside the session's transaction"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row['email_history_id'], row['kind'], row['occurred_at'].isoformat(),
+            '' if row['link_index'] is None else row['link_index']
+        ])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {TrackingEvent.__tablename__} ({', '.join(_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def ingest_segment(path):
+    """
+    Load one sealed segment and delete it
+
+    Events for emails that no longer exist are dropped.
+
+    Returns:
+        Number of events loaded
+    """
+    name = os.path.basename(path)
+    if db.session.get(TrackingSegment, name):
+        # Loaded before, but the file outlived the commit
+        os.remove(path)
+        return 0
+
+    events = read_segment(path)
+    existing = _existing_email_ids({event[0] for event in events})
+    rows = [dict(zip(_COLUMNS, event)) for event in events if event[0] in existing]
+
+    if rows:
+        if db.engine.dialect.name == 'postgresql':
+            _copy_events(rows)
+        else:
+            db.session.execute(insert(TrackingEvent), rows)
+
+        counts = Counter((row['email_history_id'], row['kind']) for row in rows)
+        table = EmailHistory.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam('email_id'))
+            .values(
+                open_count=func.coalesce(table.c.open_count, 0) + bindparam('opens'),
+                click_count=func.coalesce(table.c.click_count, 0) + bindparam('clicks')
+            ),
+            [
+                {'email_id': email_id, 'opens': counts[(email_id, 'open')], 'clicks': counts[(email_id, 'click')]}
+                for email_id in {row['email_history_id'] for row in rows}
+            ]
+        )
+
+    db.session.add(TrackingSegment(name=name, events=len(rows)))
+    db.session.commit()
+    os.remove(path)
+    return len(rows)
+
+
+def quarantine_segment(path):
+    """
+    Set aside a segment that failed to load
+
+    Returns:
+        Its new path, or None if it is already gone
+    """
+    target = path[:-len(SEALED_SUFFIX)] + FAILED_SUFFIX
+    try:
+        os.replace(path, target)
+    except FileNotFoundError:
+        return None
+    return target
+
+
+def ingest_pending(directory=LOG_DIR):
+    """
+    Load every sealed segment in the log directory
+
+    A segment that fails to load is quarantined and the rest are still
+    loaded. Database connection errors are not the segment's fault: they end
+    the pass and the segments are tried again by the next one.
+
+    Returns:
+        Tuple of (segments loaded, events loaded)
+    """
+    seal_orphaned_segments(directory)
+    segments = loaded = 0
+    for path in sealed_segments(directory):
+        try:
+            loaded += ingest_segment(path)
+            segments += 1
+        except OperationalError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error ingesting tracking segment {path}, moved to {quarantine_segment(path)}: {str(e)}")
+    return segments, loaded
+
+
+def run_ingester(directory=LOG_DIR, poll_interval=5.0, once=False):
+    """
+    Load sealed segments as they appear until interrupted
+
+    Args:
+        directory: Tracking event log directory
+        poll_interval: Seconds to wait between scans
+        once: Load what is there now and return (useful for cron and tests)
+    """
+    with app.app_context():
+        while True:
+            try:
+                segments, events = ingest_pending(directory)
+                if segments:
+                    print(f"Ingested {events} tracking events from {segments} segments")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Tracking ingestion pass failed: {str(e)}")
+                if once:
+                    raise
+
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie tracking event ingester')
+    parser.add_argument('--directory', default=LOG_DIR, help='Tracking event log directory')
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                        help='Seconds to wait between scans for sealed segments')
+    parser.add_argument('--once', action='store_true', help='Load the pending segments and exit')
+    args = parser.parse_args()
+
+    try:
+        run_ingester(directory=args.directory, poll_interval=args.poll_interval, once=args.once)
+    except KeyboardInterrupt:
+        print("Ingester stopped")
+
+
+if __name__ == '__main__':
+    main()
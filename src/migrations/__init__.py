@@ -0,0 +1,118 @@
+"""
+Versioned schema migrations.
+
+Each module in src/migrations/versions is one migration, named
+``<version>_<description>.py`` and defining ``upgrade(connection)``. Applied
+versions are recorded in the schema_migrations table, and pending ones run
+in version order, each in its own transaction. Run them at deploy time with:
+
+    python -m src.migrations            # apply pending migrations
+    python -m src.migrations --status   # list applied and pending versions
+
+On PostgreSQL an advisory lock makes concurrent runs (several containers
+starting at once) wait for each other instead of racing.
+
+Migrations must never be edited once released; change the schema with a new
+one. Each migration defines the tables and columns it works on itself rather
+than importing the models, so it does the same thing however the models
+change later. Databases created before migrations existed may already have
+some of a later migration's changes: create indexes with
+``checkfirst=True`` and check for columns before adding them.
+"""
+
+import importlib
+import os
+import pkgutil
+from collections import namedtuple
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select, text
+
+from . import versions
+
+Migration = namedtuple('Migration', ['version', 'name', 'upgrade'])
+
+# Whether the web app applies pending migrations when it starts
+AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', '1') not in ('0', 'false', 'False')
+
+# Arbitrary key for pg_advisory_lock, shared by every migration run
+ADVISORY_LOCK_KEY = 48151623
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+def load_migrations() -> List[Migration]:
+    """All migrations in src/migrations/versions, in version order"""
+    migrations = []
+    for module_info in pkgutil.iter_modules(versions.__path__):
+        version, _, name = module_info.name.partition('_')
+        if not version.isdigit():
+            continue
+        module = importlib.import_module(f'{versions.__name__}.{module_info.name}')
+        migrations.append(Migration(int(version), name, module.upgrade))
+    migrations.sort(key=lambda migration: migration.version)
+    seen = set()
+    for migration in migrations:
+        if migration.version in seen:
+            raise RuntimeError(f"Duplicate migration version {migration.version}")
+        seen.add(migration.version)
+    return migrations
+
+
+def applied_versions(connection) -> set:
+    """Versions already applied to the database"""
+    schema_migrations.create(connection, checkfirst=True)
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(engine, target: Optional[int] = None) -> List[Migration]:
+    """
+    Apply pending migrations
+
+    Args:
+        engine: SQLAlchemy engine of the database to migrate
+        target: Highest version to apply (all pending ones by default)
+
+    Returns:
+        The migrations that were applied
+    """
+    applied = []
+    with engine.connect() as lock_connection:
+        postgres = engine.dialect.name == 'postgresql'
+        if postgres:
+            lock_connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+            lock_connection.commit()
+        try:
+            with engine.begin() as connection:
+                done = applied_versions(connection)
+            for migration in load_migrations():
+                if migration.version in done or (target is not None and migration.version > target):
+                    continue
+                with engine.begin() as connection:
+                    print(f"Applying migration {migration.version:04d} {migration.name}")
+                    migration.upgrade(connection)
+                    connection.execute(insert(schema_migrations).values(
+                        version=migration.version,
+                        name=migration.name,
+                        applied_at=datetime.utcnow()
+                    ))
+                applied.append(migration)
+        finally:
+            if postgres:
+                lock_connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': ADVISORY_LOCK_KEY})
+                lock_connection.commit()
+    return applied
+
+
+def status(engine) -> List[tuple]:
+    """(version, name, applied) for every known migration"""
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+    return [(migration.version, migration.name, migration.version in done) for migration in load_migrations()]
@@ -0,0 +1,27 @@
+import argparse
+
+from .. import migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie schema migrations')
+    parser.add_argument('--status', action='store_true', help='List migrations instead of applying them')
+    parser.add_argument('--target', type=int, help='Highest migration version to apply')
+    args = parser.parse_args()
+
+    # Migrations are applied below, not as a side effect of loading the app
+    migrations.AUTO_MIGRATE = False
+    from ..app import app
+    from ..models import db
+
+    with app.app_context():
+        if args.status:
+            for version, name, applied in migrations.status(db.engine):
+                print(f"{version:04d} {name:<30} {'applied' if applied else 'pending'}")
+            return
+        applied = migrations.upgrade(db.engine, args.target)
+        print(f"Applied {len(applied)} migration(s)" if applied else "Database is up to date")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Create the tables that db.create_all() used to create at startup
+
+The tables are defined here as the models were when migrations were
+introduced, so running this migration always creates the same schema
+whatever the models look like now. Only missing tables are created;
+tables from older versions are brought up to date by migration 2.
+
+Compressed text columns (see src/utils/compression.py) are binary columns.
+"""
+
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, MetaData,
+                        String, Table, Text)
+
+# Column defaults are not part of the DDL; migration 2 fills the columns it
+# adds to older tables with them
+SCHEMA = MetaData()
+
+Table(
+    'email_body', SCHEMA,
+    Column('hash', String(64), primary_key=True),
+    Column('content', LargeBinary, nullable=False),
+    Column('is_template', Boolean, default=False),
+    Column('created_at', DateTime)
+)
+
+Table(
+    'login_attempt', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('email', String(120)),
+    Column('username', String(64)),
+    Column('identifier', String(120), nullable=False),
+    Column('identifier_type', String(10), nullable=False, default='email'),
+    Column('ip_address', String(45)),
+    Column('user_agent', String(255)),
+    Column('success', Boolean, default=False),
+    Column('timestamp', DateTime)
+)
+
+Table(
+    'rate_limit_state', SCHEMA,
+    Column('smtp_config_id', Integer, primary_key=True),
+    Column('tokens', Float, nullable=False),
+    Column('updated_at', Float, nullable=False),
+    Column('hour_started_at', Float, nullable=False),
+    Column('hour_count', Integer, nullable=False, default=0)
+)
+
+Table(
+    'tracking_segment', SCHEMA,
+    Column('name', String(255), primary_key=True),
+    Column('events', Integer, default=0),
+    Column('ingested_at', DateTime)
+)
+
+Table(
+    'user', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(64), unique=True, index=True),
+    Column('email', String(120), unique=True, index=True),
+    Column('password', String(200), nullable=False),
+    Column('created_at', DateTime),
+    Column('last_login', DateTime),
+    Column('email_confirmed', Boolean, default=False),
+    Column('email_confirm_token', String(128)),
+    Column('reset_token', String(128)),
+    Column('reset_token_expiration', DateTime),
+    Column('oauth_provider', String(20)),
+    Column('oauth_id', String(80)),
+    Column('mfa_enabled', Boolean, default=False),
+    Column('mfa_secret', String(32)),
+    Column('login_attempts', Integer, default=0),
+    Column('account_locked', Boolean, default=False),
+    Column('account_locked_until', DateTime),
+    Column('subscription_tier', String(20), default='Basic'),
+    Column('subscription_start_date', DateTime),
+    Column('subscription_end_date', DateTime),
+    Column('is_annual_billing', Boolean, default=False),
+    Column('emails_generated', Integer, default=0),
+    Column('emails_sent', Integer, default=0),
+    Column('bulk_campaigns', Integer, default=0),
+    Column('current_month_usage', Integer, default=0)
+)
+
+Table(
+    'email_template', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('name', String(100), nullable=False),
+    Column('description', Text),
+    Column('content', LargeBinary, nullable=False),
+    Column('template_type', String(50), default='custom'),
+    Column('required_fields', String(255), default='name,company,role'),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('is_public', Boolean, default=False)
+)
+
+Table(
+    'smtp_config', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('name', String(100), nullable=False, default='Default'),
+    Column('server', String(255), nullable=False),
+    Column('port', Integer, nullable=False, default=587),
+    Column('use_tls', Boolean, default=True),
+    Column('username', String(255), nullable=False),
+    Column('password', String(255), nullable=False),
+    Column('email', String(255), nullable=False),
+    Column('display_name', String(255)),
+    Column('reply_to', String(255)),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('is_default', Boolean, default=True),
+    Column('max_per_second', Float, default=0.5),
+    Column('burst', Integer, default=1),
+    Column('max_per_hour', Integer)
+)
+
+Table(
+    'user_session', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('session_id', String(128), nullable=False, unique=True),
+    Column('ip_address', String(45)),
+    Column('user_agent', String(255)),
+    Column('created_at', DateTime),
+    Column('expires_at', DateTime, nullable=False),
+    Column('is_active', Boolean, default=True)
+)
+
+Table(
+    'send_job', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('smtp_config_id', Integer, ForeignKey('smtp_config.id')),
+    Column('smtp_config_ids', String(255)),
+    Column('campaign_name', String(255)),
+    Column('status', String(20), index=True, default='queued'),
+    Column('error_message', Text),
+    Column('next_run_at', DateTime),
+    Column('base_url', String(255)),
+    Column('delay_seconds', Integer, default=0),
+    Column('scheduled_at', DateTime),
+    Column('spread_seconds', Integer, default=0),
+    Column('window_start', String(5)),
+    Column('window_end', String(5)),
+    Column('total', Integer, default=0),
+    Column('sent', Integer, default=0),
+    Column('failed', Integer, default=0),
+    Column('created_at', DateTime),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime)
+)
+
+Table(
+    'smtp_health', SCHEMA,
+    Column('smtp_config_id', Integer, ForeignKey('smtp_config.id'), primary_key=True),
+    Column('state', String(10), default='closed'),
+    Column('consecutive_failures', Integer, default=0),
+    Column('sample_size', Integer, default=0),
+    Column('success_rate', Float),
+    Column('connect_ms', Float),
+    Column('last_error', Text),
+    Column('last_failure_at', DateTime),
+    Column('updated_at', DateTime)
+)
+
+Table(
+    'email_history', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('recipient', String(255), nullable=False),
+    Column('subject', String(255), nullable=False),
+    Column('campaign_name', String(255)),
+    Column('sent_at', DateTime),
+    Column('status', String(20), default='sent'),
+    Column('error_message', Text),
+    Column('opened', Boolean, default=False),
+    Column('opened_at', DateTime),
+    Column('clicked', Boolean, default=False),
+    Column('clicked_at', DateTime),
+    Column('open_count', Integer, default=0),
+    Column('click_count', Integer, default=0),
+    Column('body_hash', String(64), ForeignKey('email_body.hash'), index=True),
+    Column('variables', Text),
+    Column('content', LargeBinary),
+    Column('smtp_config_id', Integer, ForeignKey('smtp_config.id')),
+    Column('job_id', Integer, ForeignKey('send_job.id'), index=True),
+    Column('attempts', Integer, default=0),
+    Column('next_attempt_at', DateTime),
+    Column('due_at', DateTime),
+    Column('claimed_by', String(100)),
+    Column('claim_token', String(32), index=True),
+    Column('lease_expires_at', DateTime, index=True),
+    Index('ix_email_history_status_due_at', 'status', 'due_at')
+)
+
+Table(
+    'dead_letter', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False, index=True),
+    Column('email_history_id', Integer, ForeignKey('email_history.id'), nullable=False),
+    Column('job_id', Integer, ForeignKey('send_job.id'), index=True),
+    Column('attempts', Integer, default=0),
+    Column('error_message', Text),
+    Column('created_at', DateTime),
+    Column('requeued_at', DateTime)
+)
+
+Table(
+    'tracking_event', SCHEMA,
+    Column('id', Integer, primary_key=True),
+    Column('email_history_id', Integer, ForeignKey('email_history.id'), nullable=False),
+    Column('kind', String(10), nullable=False),
+    Column('occurred_at', DateTime, nullable=False),
+    Column('link_index', Integer),
+    Index('ix_tracking_event_email_id_occurred_at', 'email_history_id', 'occurred_at')
+)
+
+
+def upgrade(connection):
+    SCHEMA.create_all(connection, checkfirst=True)
@@ -0,0 +1,63 @@
+"""
+Bring tables created by older versions of the models up to date
+
+db.create_all() never altered existing tables, so databases created before
+the campaign worker, tracking and shared-body changes lack their columns.
+The target is the schema of migration 1, not the current models. Missing
+columns are added as nullable with their foreign key, filled with their
+default where they have one, and indexed as that schema declares. On PostgreSQL, text columns that
+are now stored compressed are converted to bytea, marking each existing
+value as uncompressed.
+"""
+
+import importlib
+
+from sqlalchemy import LargeBinary, inspect, text
+
+from ...utils.compression import RAW
+
+# The tables as migration 1 creates them
+SCHEMA = importlib.import_module(f'{__package__}.0001_baseline').SCHEMA
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    quote = connection.dialect.identifier_preparer.quote
+
+    for table in SCHEMA.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column['name']: column for column in inspector.get_columns(table.name)}
+
+        added = set()
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = f'{quote(column.name)} {column.type.compile(dialect=connection.dialect)}'
+            for foreign_key in column.foreign_keys:
+                target = foreign_key.column
+                ddl += f' REFERENCES {quote(target.table.name)} ({quote(target.name)})'
+            connection.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {ddl}'))
+            added.add(column.name)
+            # Counters and flags start from their default, not NULL
+            if column.default is not None and column.default.is_scalar:
+                connection.execute(text(f'UPDATE {quote(table.name)} SET {quote(column.name)} = :value'),
+                                   {'value': column.default.arg})
+
+        for index in table.indexes:
+            if added.intersection(column.name for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+        if connection.dialect.name != 'postgresql':
+            continue
+        for column in table.columns:
+            existing = columns.get(column.name)
+            # The only binary columns in the schema are the compressed text ones
+            if (isinstance(column.type, LargeBinary) and existing is not None
+                    and existing['type'].python_type is str):
+                name = quote(column.name)
+                connection.execute(text(
+                    f"ALTER TABLE {quote(table.name)} ALTER COLUMN {name} TYPE bytea "
+                    f"USING decode('{RAW:02x}', 'hex') || convert_to({name}, 'UTF8')"
+                ))
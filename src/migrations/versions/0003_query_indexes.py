@@ -0,0 +1,41 @@
+"""
+Composite indexes for the dashboard, login attempts and sending limits
+
+- email_history (user_id, campaign_name, sent_at): the dashboard's campaign
+  list and per-campaign stats
+- email_history (user_id, sent_at): recent emails and the daily limit check
+  in send_bulk_emails
+- login_attempt (identifier, timestamp): recent attempts for a login
+
+check_session_validity's lookup by (user_id, session_id, is_active) needs no
+new index: the unique index on session_id already finds the single row.
+"""
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table
+
+_metadata = MetaData()
+
+# Just the indexed columns, as they were when this migration was written
+_email_history = Table(
+    'email_history', _metadata,
+    Column('user_id', Integer),
+    Column('campaign_name', String(255)),
+    Column('sent_at', DateTime)
+)
+_login_attempt = Table(
+    'login_attempt', _metadata,
+    Column('identifier', String(120)),
+    Column('timestamp', DateTime)
+)
+
+INDEXES = (
+    Index('ix_email_history_user_id_campaign_name_sent_at',
+          _email_history.c.user_id, _email_history.c.campaign_name, _email_history.c.sent_at),
+    Index('ix_email_history_user_id_sent_at', _email_history.c.user_id, _email_history.c.sent_at),
+    Index('ix_login_attempt_identifier_timestamp', _login_attempt.c.identifier, _login_attempt.c.timestamp),
+)
+
+
+def upgrade(connection):
+    for index in INDEXES:
+        index.create(connection, checkfirst=True)
@@ -0,0 +1,96 @@
+"""
+Campaign table, and campaigns for existing emails and send jobs
+
+Creates a campaign for every (user_id, campaign_name) found in
+email_history, with counters computed from its emails, and links the emails
+and send jobs to it.
+"""
+
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table,
+                        UniqueConstraint, and_, case, func, inspect, select, text, update)
+
+_metadata = MetaData()
+
+# The columns used here, as they were when this migration was written
+_email_history = Table(
+    'email_history', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer),
+    Column('campaign_name', String(255)),
+    Column('campaign_id', Integer),
+    Column('status', String(20)),
+    Column('sent_at', DateTime),
+    Column('opened', Boolean),
+    Column('clicked', Boolean)
+)
+_send_job = Table(
+    'send_job', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer),
+    Column('campaign_name', String(255)),
+    Column('campaign_id', Integer)
+)
+Table('user', _metadata, Column('id', Integer, primary_key=True))
+_campaign = Table(
+    'campaign', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('name', String(255), nullable=False),
+    Column('total', Integer),
+    Column('sent', Integer),
+    Column('failed', Integer),
+    Column('opened', Integer),
+    Column('clicked', Integer),
+    Column('created_at', DateTime),
+    Column('last_sent_at', DateTime),
+    UniqueConstraint('user_id', 'name', name='uq_campaign_user_id_name')
+)
+
+
+def _count(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def upgrade(connection):
+    quote = connection.dialect.identifier_preparer.quote
+    _campaign.create(connection, checkfirst=True)
+
+    inspector = inspect(connection)
+    for table in (_email_history, _send_job):
+        if 'campaign_id' not in {column['name'] for column in inspector.get_columns(table.name)}:
+            connection.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN campaign_id INTEGER '
+                                    f'REFERENCES {quote(_campaign.name)} (id)'))
+        Index(f'ix_{table.name}_campaign_id', table.c.campaign_id).create(connection, checkfirst=True)
+
+    history = _email_history
+    existing = select(_campaign.c.id).where(
+        _campaign.c.user_id == history.c.user_id,
+        _campaign.c.name == history.c.campaign_name
+    ).exists()
+    connection.execute(_campaign.insert().from_select(
+        ['user_id', 'name', 'total', 'sent', 'failed', 'opened', 'clicked', 'created_at', 'last_sent_at'],
+        select(
+            history.c.user_id,
+            history.c.campaign_name,
+            func.count(),
+            _count(history.c.status == 'sent'),
+            _count(history.c.status == 'failed'),
+            _count(history.c.opened.is_(True)),
+            _count(history.c.clicked.is_(True)),
+            func.min(history.c.sent_at),
+            func.max(case((history.c.status == 'sent', history.c.sent_at)))
+        ).where(
+            history.c.campaign_name.isnot(None),
+            history.c.campaign_id.is_(None),
+            ~existing
+        ).group_by(history.c.user_id, history.c.campaign_name)
+    ))
+
+    for table in (_email_history, _send_job):
+        connection.execute(update(table).where(
+            table.c.campaign_name.isnot(None),
+            table.c.campaign_id.is_(None)
+        ).values(campaign_id=select(_campaign.c.id).where(and_(
+            _campaign.c.user_id == table.c.user_id,
+            _campaign.c.name == table.c.campaign_name
+        )).scalar_subquery()))
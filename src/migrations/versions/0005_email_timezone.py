@@ -0,0 +1,14 @@
+"""
+Recipient time zone on email_history
+
+Workers check a job's local-time send window again right before sending, so
+each email keeps the time zone its due time was computed in.
+"""
+
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('email_history')}
+    if 'timezone' not in columns:
+        connection.execute(text('ALTER TABLE email_history ADD COLUMN timezone VARCHAR(64)'))
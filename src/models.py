@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+import json
 import os
 
+from .utils.compression import CompressedText
+
 # Initialize SQLAlchemy
 db = SQLAlchemy()
 
@@ -69,6 +72,10 @@ class User(UserMixin, db.Model):
         """Check if user can create custom templates (Professional and Enterprise tiers)"""
         return self.subscription_tier in ['Professional', 'Enterprise']
     
+    def can_schedule_emails(self):
+        """Check if user can schedule campaigns (Professional and Enterprise tiers)"""
+        return self.subscription_tier in ['Professional', 'Enterprise']
+    
     def get_remaining_emails(self):
         """Get the number of emails remaining in the current month"""
         limit = self.get_monthly_email_limit()
@@ -133,6 +140,11 @@ class SMTPConfig(db.Model):
     # Is this the user's default SMTP configuration?
     is_default = db.Column(db.Boolean, default=True)
     
+    # Sending limits enforced by the rate limiter
+    max_per_second = db.Column(db.Float, default=0.5)
+    burst = db.Column(db.Integer, default=1)
+    max_per_hour = db.Column(db.Integer, nullable=True)  # None means no hourly cap
+    
     def to_dict(self):
         """Convert SMTP config to dictionary (without password)"""
         return {
@@ -146,6 +158,10 @@ class SMTPConfig(db.Model):
             'display_name': self.display_name,
             'reply_to': self.reply_to,
             'is_default': self.is_default,
+            'max_per_second': self.max_per_second,
+            'burst': self.burst,
+            'max_per_hour': self.max_per_hour,
+            'health': self.health.to_dict() if self.health else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -153,21 +169,81 @@ class SMTPConfig(db.Model):
     def to_smtp_config(self):
         """Convert to format needed by EmailService"""
         return {
+            'id': self.id,
             'server': self.server,
             'port': self.port,
             'use_tls': self.use_tls,
             'username': self.username,
             'password': self.password,
             'email': self.email,
-            'name': self.display_name
+            'name': self.display_name,
+            'max_per_second': self.max_per_second,
+            'burst': self.burst,
+            'max_per_hour': self.max_per_hour
         }
     
     def __repr__(self):
         return f'<SMTPConfig {self.name} ({self.server})>'
 
 
+class RateLimitState(db.Model):
+    """Token bucket state per SMTP configuration, shared by all send workers"""
+    smtp_config_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix timestamp of the last refill
+    hour_started_at = db.Column(db.Float, nullable=False)
+    hour_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<RateLimitState {self.smtp_config_id} ({self.tokens:.2f} tokens)>'
+
+
+class SMTPHealth(db.Model):
+    """Rolling send health and circuit breaker state per SMTP configuration"""
+    smtp_config_id = db.Column(db.Integer, db.ForeignKey('smtp_config.id'), primary_key=True, autoincrement=False)
+    smtp_config = db.relationship('SMTPConfig', backref=db.backref('health', uselist=False, cascade='all, delete-orphan'))
+    
+    state = db.Column(db.String(10), default='closed')  # closed, open, half_open
+    consecutive_failures = db.Column(db.Integer, default=0)
+    
+    # Over the most recent sends seen by a worker
+    sample_size = db.Column(db.Integer, default=0)
+    success_rate = db.Column(db.Float)
+    connect_ms = db.Column(db.Float)  # Smoothed time to open an authenticated session
+    
+    last_error = db.Column(db.Text)
+    last_failure_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert SMTP health to dictionary"""
+        return {
+            'smtp_config_id': self.smtp_config_id,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'sample_size': self.sample_size,
+            'success_rate': self.success_rate,
+            'connect_ms': self.connect_ms,
+            'last_error': self.last_error,
+            'last_failure_at': self.last_failure_at.isoformat() if self.last_failure_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<SMTPHealth {self.smtp_config_id} ({self.state})>'
+
+
 class EmailHistory(db.Model):
     """Model for tracking sent emails"""
+    __table_args__ = (
+        # The scheduler looks up due emails by status and due time
+        db.Index('ix_email_history_status_due_at', 'status', 'due_at'),
+        # Dashboard campaign lists and per-campaign stats
+        db.Index('ix_email_history_user_id_campaign_name_sent_at', 'user_id', 'campaign_name', 'sent_at'),
+        # Recent emails and the daily sending limit
+        db.Index('ix_email_history_user_id_sent_at', 'user_id', 'sent_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user = db.relationship('User', backref=db.backref('email_history', lazy=True))
@@ -176,10 +252,12 @@ class EmailHistory(db.Model):
     recipient = db.Column(db.String(255), nullable=False)
     subject = db.Column(db.String(255), nullable=False)
     campaign_name = db.Column(db.String(255))  # For bulk emails
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=True, index=True)
+    campaign = db.relationship('Campaign', backref=db.backref('emails', lazy='dynamic'))
     
     # Tracking
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default="sent")  # sent, failed, etc.
+    status = db.Column(db.String(20), default="sent")  # scheduled, queued, sending, sent, failed, etc.
     error_message = db.Column(db.Text)
     
     # Analytics
@@ -188,17 +266,266 @@ class EmailHistory(db.Model):
     clicked = db.Column(db.Boolean, default=False)
     clicked_at = db.Column(db.DateTime)
     
-    # Store email content for reference
-    content = db.Column(db.Text)
+    # Every open and click, rolled up from TrackingEvent by the event ingester
+    open_count = db.Column(db.Integer, default=0)
+    click_count = db.Column(db.Integer, default=0)
+    
+    # Email content, stored once per distinct body in EmailBody. Template bodies
+    # are rendered with the row's variables (JSON) when the content is read.
+    # Body columns are deferred so list and dashboard queries never load them.
+    body_hash = db.Column(db.String(64), db.ForeignKey('email_body.hash'), nullable=True, index=True)
+    body = db.relationship('EmailBody')
+    variables = db.deferred(db.Column(db.Text), group='body')
+    
+    # Full content of rows written before bodies were shared, until migrated
+    stored_content = db.deferred(db.Column('content', CompressedText), group='body')
     
     # Reference to the SMTP configuration used
     smtp_config_id = db.Column(db.Integer, db.ForeignKey('smtp_config.id'), nullable=True)
     smtp_config = db.relationship('SMTPConfig', backref=db.backref('emails_sent', lazy=True))
     
+    # Background send job this email belongs to (bulk campaigns only)
+    job_id = db.Column(db.Integer, db.ForeignKey('send_job.id'), nullable=True, index=True)
+    job = db.relationship('SendJob', backref=db.backref('emails', lazy='dynamic'))
+    
+    # Retry state for transient failures
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # None means send as soon as possible
+    
+    # When a scheduled email is released to the send queue (naive UTC)
+    due_at = db.Column(db.DateTime, nullable=True)
+    
+    # Recipient's IANA time zone, for the job's local-time send window
+    timezone = db.Column(db.String(64))
+    
+    # Worker claim while status is 'sending'; other workers may take the email once the lease expires
+    claimed_by = db.Column(db.String(100))
+    claim_token = db.Column(db.String(32), index=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    
+    @property
+    def content(self):
+        """The email body, rendered from its shared template if it has one"""
+        if self.body is None:
+            return self.stored_content
+        if not self.body.is_template:
+            return self.body.content
+        from .utils.email_bodies import render_body
+        return render_body(self.body.content, json.loads(self.variables or '{}'))
+    
+    @content.setter
+    def content(self, value):
+        # Kept for callers that set a full body; use intern_bodies to share it
+        self.stored_content = value
+    
     def __repr__(self):
         return f'<EmailHistory {self.recipient} ({self.sent_at})>'
 
 
+class EmailBody(db.Model):
+    """Email bodies and body templates, stored once and keyed by the SHA-256 of their content"""
+    hash = db.Column(db.String(64), primary_key=True)
+    content = db.Column(CompressedText, nullable=False)
+    is_template = db.Column(db.Boolean, default=False)  # Rendered with each email's variables
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<EmailBody {self.hash[:12]}{" (template)" if self.is_template else ""}>'
+
+
+class Campaign(db.Model):
+    """
+    A named bulk campaign of one user
+
+    The counters are kept up to date as emails are queued, sent, opened and
+    clicked, so campaign lists and stats never have to scan EmailHistory.
+    opened and clicked count emails, not hits.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_campaign_user_id_name'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User', backref=db.backref('campaigns', lazy=True))
+    name = db.Column(db.String(255), nullable=False)
+    
+    # Emails queued, and how many of them were sent, failed for good, opened and clicked
+    total = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    opened = db.Column(db.Integer, default=0)
+    clicked = db.Column(db.Integer, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_sent_at = db.Column(db.DateTime, nullable=True)
+    
+    def rate(self, count):
+        """Percentage of sent emails, rounded"""
+        return round(count / self.sent * 100) if self.sent else 0
+    
+    def to_dict(self):
+        """Convert campaign to dictionary"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'opened': self.opened,
+            'clicked': self.clicked,
+            'open_rate': self.rate(self.opened),
+            'click_rate': self.rate(self.clicked),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_sent_at': self.last_sent_at.isoformat() if self.last_sent_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Campaign {self.name} ({self.sent}/{self.total} sent)>'
+
+
+class SendJob(db.Model):
+    """Model for bulk send jobs executed by the background worker"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User', backref=db.backref('send_jobs', lazy=True))
+    
+    smtp_config_id = db.Column(db.Integer, db.ForeignKey('smtp_config.id'), nullable=True)
+    smtp_config = db.relationship('SMTPConfig', backref=db.backref('send_jobs', lazy=True))
+    
+    # SMTP configurations a multi-sender job is spread across (comma-separated ids)
+    smtp_config_ids = db.Column(db.String(255))
+    
+    campaign_name = db.Column(db.String(255))
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=True, index=True)
+    
+    # Job state: scheduled, queued, running, completed, failed
+    status = db.Column(db.String(20), default="queued", index=True)
+    error_message = db.Column(db.Text)
+    
+    # When the next pending retry is due (informational; workers claim due emails directly)
+    next_run_at = db.Column(db.DateTime, nullable=True)
+    
+    # Send options captured at submission time
+    base_url = db.Column(db.String(255))  # For tracking links
+    delay_seconds = db.Column(db.Integer, default=0)
+    
+    # Scheduling: start time (naive UTC), spread duration and local-time send window (HH:MM)
+    scheduled_at = db.Column(db.DateTime, nullable=True)
+    spread_seconds = db.Column(db.Integer, default=0)
+    window_start = db.Column(db.String(5))
+    window_end = db.Column(db.String(5))
+    
+    # Progress counters
+    total = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    
+    # Tracking
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def get_smtp_config_ids(self):
+        """Get the ids of every SMTP configuration this job sends through"""
+        if self.smtp_config_ids:
+            return [int(config_id) for config_id in self.smtp_config_ids.split(',') if config_id]
+        return [self.smtp_config_id] if self.smtp_config_id else []
+    
+    def to_dict(self):
+        """Convert send job to dictionary"""
+        return {
+            'id': self.id,
+            'campaign_name': self.campaign_name,
+            'campaign_id': self.campaign_id,
+            'smtp_config_id': self.smtp_config_id,
+            'smtp_config_ids': self.get_smtp_config_ids(),
+            'status': self.status,
+            'error_message': self.error_message,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'pending': max(0, (self.total or 0) - (self.sent or 0) - (self.failed or 0)),
+            'scheduled_at': self.scheduled_at.isoformat() if self.scheduled_at else None,
+            'next_run_at': self.next_run_at.isoformat() if self.next_run_at else None,
+            'spread_seconds': self.spread_seconds,
+            'send_window': [self.window_start, self.window_end] if self.window_start else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<SendJob {self.id} {self.campaign_name} ({self.status})>'
+
+
+class DeadLetter(db.Model):
+    """Emails that exhausted their retries, kept so they can be re-queued"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    email_history_id = db.Column(db.Integer, db.ForeignKey('email_history.id'), nullable=False)
+    email = db.relationship('EmailHistory', backref=db.backref('dead_letters', lazy=True))
+    job_id = db.Column(db.Integer, db.ForeignKey('send_job.id'), nullable=True, index=True)
+    
+    attempts = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    requeued_at = db.Column(db.DateTime, nullable=True)  # None while still dead
+    
+    def to_dict(self):
+        """Convert dead letter to dictionary"""
+        return {
+            'id': self.id,
+            'email_history_id': self.email_history_id,
+            'job_id': self.job_id,
+            'recipient': self.email.recipient if self.email else None,
+            'attempts': self.attempts,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'requeued_at': self.requeued_at.isoformat() if self.requeued_at else None
+        }
+    
+    def __repr__(self):
+        return f'<DeadLetter {self.email_history_id} ({self.attempts} attempts)>'
+
+
+class TrackingEvent(db.Model):
+    """Individual open and click events, bulk-loaded from the tracking event log"""
+    __table_args__ = (
+        db.Index('ix_tracking_event_email_id_occurred_at', 'email_history_id', 'occurred_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    email_history_id = db.Column(db.Integer, db.ForeignKey('email_history.id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # open, click
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    link_index = db.Column(db.Integer, nullable=True)  # Position of the clicked link in the email
+    
+    def to_dict(self):
+        """Convert tracking event to dictionary"""
+        return {
+            'id': self.id,
+            'email_history_id': self.email_history_id,
+            'kind': self.kind,
+            'occurred_at': self.occurred_at.isoformat() if self.occurred_at else None,
+            'link_index': self.link_index
+        }
+    
+    def __repr__(self):
+        return f'<TrackingEvent {self.kind} {self.email_history_id} ({self.occurred_at})>'
+
+
+class TrackingSegment(db.Model):
+    """Event log segments already ingested, so a segment is never loaded twice"""
+    name = db.Column(db.String(255), primary_key=True)
+    events = db.Column(db.Integer, default=0)
+    ingested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TrackingSegment {self.name} ({self.events} events)>'
+
+
 class EmailTemplate(db.Model):
     """Model for custom email templates"""
     id = db.Column(db.Integer, primary_key=True)
@@ -208,7 +535,7 @@ class EmailTemplate(db.Model):
     # Template details
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    content = db.Column(db.Text, nullable=False)
+    content = db.deferred(db.Column(CompressedText, nullable=False))  # Loaded on first access
     
     # Template type (cold_email, follow_up, meeting_request, custom)
     template_type = db.Column(db.String(50), default="custom")
@@ -243,6 +570,11 @@ class EmailTemplate(db.Model):
 
 class LoginAttempt(db.Model):
     """Model to track login attempts for security monitoring"""
+    __table_args__ = (
+        # Recent attempts for an identifier
+        db.Index('ix_login_attempt_identifier_timestamp', 'identifier', 'timestamp'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), nullable=True)  # Can be null if username login
     username = db.Column(db.String(64), nullable=True)  # Can be null if email login
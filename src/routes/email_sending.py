@@ -1,11 +1,22 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+import codecs
+import io
+import json
+import queue
+from flask import (Blueprint, Response, current_app, render_template, request, jsonify, flash, redirect,
+                   stream_with_context, url_for)
 from flask_login import login_required, current_user
 from sqlalchemy import func
 from datetime import datetime
-import time
-from ..models import EmailHistory, EmailTemplate, SMTPConfig, db
+from ..models import DeadLetter, EmailHistory, EmailTemplate, SMTPConfig, SendJob, db
+from ..utils.campaigns import add_campaign_counts, get_or_create_campaign
+from ..utils.dashboard_stats import stats_cache
+from ..utils.email_bodies import intern_bodies, store_email_bodies
 from ..utils.email_generator import EmailGenerator
 from ..email_service import EmailService
+from ..utils.template_engine import TemplateError
+from ..utils.scheduling import compute_due_times, get_timezone, parse_send_window, parse_start_time
+from ..utils.smtp_health import save_health
+from ..utils.progress import TERMINAL_STATUSES, format_event, progress_broker, progress_listener, progress_snapshot
 
 email_bp = Blueprint('email', __name__, url_prefix='/email')
 
@@ -59,16 +70,8 @@ def send_bulk_emails():
                 "error": f"You have reached your daily email limit ({email_limit}). Please upgrade your subscription to send more emails."
             }), 403
         
-        # Prepare SMTP configuration dict
-        smtp_config_dict = {
-            'server': smtp_config.server,
-            'port': smtp_config.port,
-            'username': smtp_config.username,
-            'password': smtp_config.password,
-            'use_tls': smtp_config.use_tls,
-            'email': smtp_config.email,
-            'name': smtp_config.display_name
-        }
+        # Prepare SMTP configuration dict (with the id, so send health is recorded)
+        smtp_config_dict = smtp_config.to_smtp_config()
         
         # Debug information
         print(f"SMTP Config: {smtp_config_dict}")
@@ -109,7 +112,7 @@ def send_bulk_emails():
                     smtp_config_id=smtp_config.id,
                     recipient=recipient_email,
                     subject=subject,
-                    content=content,
+                    body_hash=intern_bodies([(content, False)])[0],
                     status='sent',
                     sent_at=datetime.now()
                 )
@@ -127,7 +130,7 @@ def send_bulk_emails():
                     smtp_config_id=smtp_config.id,
                     recipient=recipient_email,
                     subject=subject,
-                    content=content,
+                    body_hash=intern_bodies([(content, False)])[0] if content else None,
                     status='failed',
                     error_message=error_message,
                     sent_at=datetime.now()
@@ -136,6 +139,8 @@ def send_bulk_emails():
         
         # Commit all the email history records at once
         db.session.commit()
+        save_health(db)
+        stats_cache.invalidate(current_user.id)
         
         return jsonify({
             "success": True,
@@ -167,6 +172,63 @@ def email_generator():
     
     return jsonify({'email': email_content})
 
+@email_bp.route('/generate-bulk', methods=['POST'])
+@login_required
+def generate_bulk():
+    """
+    Generate personalized emails for every row of a CSV upload, streamed as NDJSON
+    
+    The CSV comes as a multipart 'file', as csv_data in a JSON body, or as the
+    raw request body. It is read and answered row by row, so uploads of any
+    size use bounded memory. Each line of the response is an 'email' or
+    'error' record; the last is a 'summary' with the totals.
+    """
+    template_id = request.args.get('template_id') or request.form.get('template_id') or 'default_cold_email'
+    template_type, template_content = 'cold_email', None
+    if template_id.startswith('default_'):
+        template_type = template_id.replace('default_', '')
+    else:
+        if template_id.isdigit():
+            template_content = EmailTemplate.query.filter(
+                EmailTemplate.id == int(template_id),
+                (EmailTemplate.user_id == current_user.id) | EmailTemplate.is_public.is_(True)
+            ).first()
+        if not template_content:
+            return jsonify({
+                'success': False,
+                'message': 'Template not found'
+            }), 404
+    
+    # Binary lines decoded one at a time: TextIOWrapper would need readable()
+    # and seekable(), which the spooled upload file lacks before Python 3.11
+    if 'file' in request.files:
+        csv_file = codecs.iterdecode(request.files['file'].stream, 'utf-8-sig')
+    elif request.is_json:
+        csv_file = io.StringIO((request.get_json(silent=True) or {}).get('csv_data') or '')
+    else:
+        csv_file = codecs.iterdecode(request.stream, 'utf-8-sig')
+    
+    def stream():
+        total = successful = errors = 0
+        for record in EmailGenerator.iter_csv_emails(csv_file, template_type, template_content):
+            if record['row'] != 1:
+                total += 1
+            if record['type'] == 'email':
+                successful += 1
+            else:
+                errors += 1
+            yield json.dumps(record) + '\n'
+        yield json.dumps({
+            'type': 'summary',
+            'total_recipients': total,
+            'successful_recipients': successful,
+            'errors': errors
+        }) + '\n'
+    
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers={
+        'X-Accel-Buffering': 'no'
+    })
+
 @email_bp.route('/send', methods=['POST'])
 @login_required
 def send_email():
@@ -194,7 +256,7 @@ def send_email():
             user_id=current_user.id,
             recipient=recipient,
             subject=subject,
-            content=html_content,
+            body_hash=intern_bodies([(html_content, False)])[0],
             smtp_config_id=smtp_config.id
         )
         db.session.add(email_history)
@@ -202,8 +264,7 @@ def send_email():
         
         # Add tracking to the email content
         base_url = request.host_url.rstrip('/')
-        html_content = EmailService.add_tracking_pixel(html_content, email_history.id, base_url)
-        html_content = EmailService.add_click_tracking(html_content, email_history.id, base_url)
+        html_content = EmailService.add_tracking(html_content, email_history.id, base_url)
         
         # Send the email
         smtp_config_dict = smtp_config.to_smtp_config()
@@ -219,6 +280,8 @@ def send_email():
         if not success:
             email_history.error_message = message
         db.session.commit()
+        save_health(db)
+        stats_cache.invalidate(current_user.id)
         
         # Increment usage counter
         current_user.increment_usage()
@@ -238,7 +301,7 @@ def send_email():
 @email_bp.route('/process-bulk-emails', methods=['POST'])
 @login_required
 def process_bulk_emails():
-    """API endpoint to process bulk emails"""
+    """API endpoint to queue bulk emails for the background worker"""
     if not current_user.is_authenticated:
         return jsonify({
             'success': False,
@@ -258,31 +321,45 @@ def process_bulk_emails():
         
         # Extract data
         smtp_config_id = data.get('smtp_config_id')
+        smtp_config_ids = data.get('smtp_config_ids')
         emails = data.get('emails', [])
         campaign_name = data.get('campaign_name')
         delay = int(data.get('delay', 2))
         
         # Validate required fields
-        if not all([smtp_config_id, emails, campaign_name]):
+        if not all([smtp_config_id or smtp_config_ids, emails, campaign_name]):
             return jsonify({
                 'success': False,
                 'message': 'Missing required fields'
             })
         
-        # Get SMTP config
-        smtp_config = SMTPConfig.query.get(smtp_config_id)
-        if not smtp_config or smtp_config.user_id != current_user.id:
+        # Get SMTP configs: a single one, a chosen subset, or all of the user's configs
+        if smtp_config_id == 'all':
+            smtp_configs = SMTPConfig.query.filter_by(user_id=current_user.id).all()
+        elif smtp_config_ids:
+            smtp_configs = SMTPConfig.query.filter(
+                SMTPConfig.id.in_(smtp_config_ids),
+                SMTPConfig.user_id == current_user.id
+            ).all()
+            if len(smtp_configs) != len(set(smtp_config_ids)):
+                smtp_configs = []
+        else:
+            smtp_config = SMTPConfig.query.get(smtp_config_id)
+            smtp_configs = [smtp_config] if smtp_config and smtp_config.user_id == current_user.id else []
+        
+        if not smtp_configs:
             return jsonify({
                 'success': False,
                 'message': 'Invalid SMTP configuration'
             })
         
+        # Single-config jobs keep the config on every row; multi-sender jobs
+        # are assigned a config per email when the worker dispatches them
+        smtp_config = smtp_configs[0] if len(smtp_configs) == 1 else None
+        
         # Get base URL for tracking
         base_url = request.host_url.rstrip('/')
         
-        # Configure SMTP settings
-        smtp_config_dict = smtp_config.to_smtp_config()
-        
         # Validate recipients and email content
         if not emails or not isinstance(emails, list):
             return jsonify({
@@ -290,94 +367,249 @@ def process_bulk_emails():
                 'message': 'Invalid email data'
             })
         
-        results = {
-            'success': True,
-            'total': len(emails),
-            'sent': 0,
-            'failed': 0,
-            'errors': []
-        }
-        
-        # Create email history records first to get IDs for tracking
-        email_records = []
-        for email_data in emails:
-            # Extract recipient and content
-            recipient = email_data.get('recipient')
-            subject = email_data.get('subject')
-            content = email_data.get('content')
-            
-            # Create email history record
+        # Optional scheduling: start time, spread duration and a local-time send window
+        start_at = data.get('start_at')
+        spread_minutes = data.get('spread_minutes')
+        window_start = data.get('window_start')
+        window_end = data.get('window_end')
+        scheduled = any([start_at, spread_minutes, window_start, window_end])
+        due_times = [None] * len(emails)
+        timezone_names = [None] * len(emails)
+        
+        if scheduled:
+            if not current_user.can_schedule_emails():
+                return jsonify({
+                    'success': False,
+                    'message': 'Email scheduling is available on the Professional and Enterprise plans'
+                })
+            try:
+                start_at = parse_start_time(start_at)
+                spread_seconds = int(float(spread_minutes or 0) * 60)
+                window = parse_send_window(window_start, window_end)
+                default_timezone = data.get('timezone')
+                timezones = [get_timezone(email_data.get('timezone') or default_timezone)
+                             for email_data in emails] if window else None
+                timezone_names = [tz.key for tz in timezones] if window else [None] * len(emails)
+            except (TypeError, ValueError) as e:
+                return jsonify({
+                    'success': False,
+                    'message': f'Invalid schedule: {str(e)}'
+                })
+            due_times = compute_due_times(len(emails), start_at, spread_seconds, window, timezones)
+        
+        # Emails carry their own content, or variables for a shared template
+        try:
+            bodies = store_email_bodies(emails, data.get('template'))
+        except TemplateError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid template: {str(e)}'
+            })
+        
+        # Jobs submitted under the same name add to the same campaign
+        campaign = get_or_create_campaign(current_user.id, campaign_name)
+        add_campaign_counts(campaign.id, total=len(emails))
+        
+        # Create the send job; the background worker picks it up
+        job = SendJob(
+            user_id=current_user.id,
+            campaign_id=campaign.id,
+            smtp_config_id=smtp_config.id if smtp_config else None,
+            smtp_config_ids=','.join(str(config.id) for config in smtp_configs),
+            campaign_name=campaign_name,
+            base_url=base_url,
+            delay_seconds=delay,
+            total=len(emails),
+            status='scheduled' if scheduled else 'queued'
+        )
+        if scheduled:
+            job.scheduled_at = start_at or datetime.utcnow()
+            job.spread_seconds = spread_seconds
+            job.window_start = window_start
+            job.window_end = window_end
+            job.next_run_at = min(due_times)
+        db.session.add(job)
+        
+        # Queue one email history record per message; scheduled ones wait for their due time.
+        # Bodies are stored once per distinct content, or once per template plus variables
+        for email_data, due_at, timezone_name, (body_hash, variables) in zip(emails, due_times, timezone_names, bodies):
             email_history = EmailHistory(
                 user_id=current_user.id,
-                recipient=recipient,
-                subject=subject,
-                content=content,
+                recipient=email_data.get('recipient'),
+                subject=email_data.get('subject'),
+                body_hash=body_hash,
+                variables=variables,
                 campaign_name=campaign_name,
-                smtp_config_id=smtp_config.id
+                campaign_id=campaign.id,
+                smtp_config_id=smtp_config.id if smtp_config else None,
+                status='scheduled' if scheduled else 'queued',
+                due_at=due_at,
+                timezone=timezone_name,
+                job=job
             )
             db.session.add(email_history)
-            
-            # Store for later processing
-            email_records.append({
-                'record': email_history,
-                'recipient': recipient,
-                'subject': subject,
-                'content': content
-            })
         
-        # Commit to get IDs assigned
-        db.session.commit()
-        
-        # Process each email with tracking
-        for email_data in email_records:
-            record = email_data['record']
-            recipient = email_data['recipient']
-            subject = email_data['subject']
-            content = email_data['content']
-            
-            try:
-                # Add tracking to the email content
-                tracked_content = EmailService.add_tracking_pixel(content, record.id, base_url)
-                tracked_content = EmailService.add_click_tracking(tracked_content, record.id, base_url)
-                
-                # Send the email
-                success, message = EmailService.send_email(
-                    recipient_email=recipient,
-                    subject=subject,
-                    html_content=tracked_content,
-                    smtp_config=smtp_config_dict
-                )
-                
-                # Update record with status
-                record.status = 'sent' if success else 'failed'
-                if not success:
-                    record.error_message = message
-                    results['failed'] += 1
-                    results['errors'].append(f"Failed to send to {recipient}: {message}")
-                else:
-                    results['sent'] += 1
-                
-                # Add delay between emails if specified
-                if delay > 0:
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                # Update record with error
-                record.status = 'failed'
-                record.error_message = str(e)
-                results['failed'] += 1
-                results['errors'].append(f"Error sending to {recipient}: {str(e)}")
-        
-        # Commit all updates
         db.session.commit()
+        stats_cache.invalidate(current_user.id)
         
         # Update user stats
         current_user.record_bulk_campaign(len(emails))
         
-        return jsonify(results)
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'total': job.total,
+            'status_url': url_for('email.job_status', job_id=job.id),
+            'events_url': url_for('email.job_events', job_id=job.id)
+        }), 202
         
     except Exception as e:
         return jsonify({
             'success': False,
             'message': f'Error processing bulk emails: {str(e)}'
         })
+
+@email_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """API endpoint to report the progress of a bulk send job"""
+    job = SendJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': 'Send job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    })
+
+@email_bp.route('/jobs/<int:job_id>/events')
+@login_required
+def job_events(job_id):
+    """Server-Sent Events stream of a send job's counters and throughput"""
+    job = SendJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': 'Send job not found'
+        }), 404
+    
+    progress_listener.ensure_started(current_app._get_current_object())
+    # Subscribe before reading the counters, so a terminal event published
+    # in between is queued instead of lost
+    subscriber = progress_broker.subscribe(job_id)
+    try:
+        db.session.refresh(job)
+        snapshot = progress_snapshot(job)
+    except Exception:
+        progress_broker.unsubscribe(job_id, subscriber)
+        raise
+    progress_broker.set_baseline(job_id, snapshot)
+    # Events arrive from the broker; the stream itself never touches the database
+    db.session.close()
+    
+    def stream():
+        try:
+            yield format_event(dict(snapshot, throughput=0.0))
+            if snapshot['status'] in TERMINAL_STATUSES:
+                return
+            done = snapshot['sent'] + snapshot['failed']
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                if event['sent'] + event['failed'] < done and event['status'] not in TERMINAL_STATUSES:
+                    # Published before the snapshot was read
+                    continue
+                yield format_event(event)
+                if event['status'] in TERMINAL_STATUSES:
+                    return
+        finally:
+            progress_broker.unsubscribe(job_id, subscriber)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@email_bp.route('/dead-letters')
+@login_required
+def dead_letters():
+    """API endpoint to list emails that exhausted their retries"""
+    query = DeadLetter.query.filter(
+        DeadLetter.user_id == current_user.id,
+        DeadLetter.requeued_at.is_(None)
+    )
+    job_id = request.args.get('job_id', type=int)
+    if job_id:
+        query = query.filter(DeadLetter.job_id == job_id)
+    
+    letters = query.order_by(DeadLetter.created_at.desc()).limit(500).all()
+    return jsonify({
+        'success': True,
+        'dead_letters': [letter.to_dict() for letter in letters]
+    })
+
+@email_bp.route('/dead-letters/requeue', methods=['POST'])
+@login_required
+def requeue_dead_letters():
+    """API endpoint to put dead-lettered emails back on the send queue in bulk"""
+    try:
+        data = request.json or {}
+        query = DeadLetter.query.filter(
+            DeadLetter.user_id == current_user.id,
+            DeadLetter.requeued_at.is_(None)
+        )
+        if data.get('job_id'):
+            query = query.filter(DeadLetter.job_id == data['job_id'])
+        if data.get('ids'):
+            query = query.filter(DeadLetter.id.in_(data['ids']))
+        
+        letters = query.with_entities(DeadLetter.id, DeadLetter.email_history_id, DeadLetter.job_id).all()
+        if not letters:
+            return jsonify({'success': True, 'requeued': 0})
+        
+        # Reset the emails so the worker sends them again
+        EmailHistory.query.filter(
+            EmailHistory.id.in_([letter.email_history_id for letter in letters])
+        ).update({
+            'status': 'queued',
+            'attempts': 0,
+            'next_attempt_at': None,
+            'error_message': None,
+            'claimed_by': None,
+            'claim_token': None,
+            'lease_expires_at': None
+        }, synchronize_session=False)
+        
+        # Reopen the affected jobs
+        requeued_per_job = {}
+        for letter in letters:
+            requeued_per_job[letter.job_id] = requeued_per_job.get(letter.job_id, 0) + 1
+        for job in SendJob.query.filter(SendJob.id.in_(list(requeued_per_job))).all():
+            job.failed = max(0, job.failed - requeued_per_job[job.id])
+            add_campaign_counts(job.campaign_id, failed=-requeued_per_job[job.id])
+            job.status = 'queued'
+            job.next_run_at = None
+            job.finished_at = None
+        
+        DeadLetter.query.filter(
+            DeadLetter.id.in_([letter.id for letter in letters])
+        ).update({'requeued_at': datetime.utcnow()}, synchronize_session=False)
+        
+        db.session.commit()
+        stats_cache.invalidate(current_user.id)
+        
+        return jsonify({'success': True, 'requeued': len(letters)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Error re-queuing emails: {str(e)}'
+        }), 500
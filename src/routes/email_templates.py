@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import login_required, current_user
 from datetime import datetime
+from sqlalchemy.orm import undefer
 from ..models import EmailTemplate, db
 from ..utils.email_generator import EmailGenerator
 
@@ -184,8 +185,10 @@ def get_all_templates():
             }
         ]
         
-        # Get user's custom templates from database
-        custom_templates = EmailTemplate.query.filter_by(user_id=current_user.id).all()
+        # Get user's custom templates from database, with their (deferred) content
+        custom_templates = EmailTemplate.query.options(undefer(EmailTemplate.content)).filter_by(
+            user_id=current_user.id
+        ).all()
         
         # Convert to list of dictionaries
         custom_templates_list = []
@@ -1,25 +1,27 @@
-from flask import Blueprint, make_response, redirect, request
-from datetime import datetime
-from ..models import EmailHistory, db
-from ..utils.tracking import decode_tracking_token
+import base64
+from flask import Blueprint, current_app, make_response, redirect, request
+from ..utils.event_log import event_log
+from ..utils.tracking import decode_tracking_token, verify_click_url
+from ..utils.tracking_buffer import tracking_buffer
 
 tracking_bp = Blueprint('tracking', __name__, url_prefix='/track')
 
+# Transparent 1x1 pixel GIF
+TRANSPARENT_PIXEL = base64.b64decode(b'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
 @tracking_bp.route('/open/<token>.gif')
 def track_open(token):
     """Track email opens via a transparent tracking pixel"""
     email_id = decode_tracking_token(token)
     
     if email_id:
-        email = EmailHistory.query.get(email_id)
-        if email and not email.opened:
-            email.opened = True
-            email.opened_at = datetime.utcnow()
-            db.session.commit()
+        # Every open goes to the event log; the first also marks the email as opened.
+        # Both are written to the database later, in bulk.
+        event_log.append('open', email_id)
+        tracking_buffer.ensure_started(current_app._get_current_object())
+        tracking_buffer.record('open', email_id)
     
-    # Return a transparent 1x1 pixel GIF
-    transparent_pixel = b'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
-    response = make_response(transparent_pixel)
+    response = make_response(TRANSPARENT_PIXEL)
     response.headers.set('Content-Type', 'image/gif')
     response.headers.set('Cache-Control', 'no-cache, no-store, must-revalidate')
     return response
@@ -29,12 +31,15 @@ def track_click(token):
     """Track email link clicks"""
     email_id = decode_tracking_token(token)
     redirect_url = request.args.get('url', '/')
+
+    # Only redirect to targets signed for this token, so the endpoint can't be
+    # used as an open redirect
+    if not verify_click_url(token, redirect_url, request.args.get('s')):
+        redirect_url = '/'
     
     if email_id:
-        email = EmailHistory.query.get(email_id)
-        if email and not email.clicked:
-            email.clicked = True
-            email.clicked_at = datetime.utcnow()
-            db.session.commit()
+        event_log.append('click', email_id, request.args.get('l', type=int))
+        tracking_buffer.ensure_started(current_app._get_current_object())
+        tracking_buffer.record('click', email_id)
     
     return redirect(redirect_url)
@@ -1,9 +1,10 @@
-from flask import Blueprint, render_template, redirect, url_for, request, jsonify, flash
+from flask import Blueprint, current_app, render_template, redirect, url_for, request, jsonify, flash
 from flask_login import login_required, current_user
-from sqlalchemy import func
 from datetime import datetime, date, timedelta
-from ..models import EmailHistory, EmailTemplate, SMTPConfig, db
+from ..models import EmailTemplate, SMTPConfig
+from ..utils.dashboard_stats import stats_cache
 from ..utils.email_generator import EmailGenerator
+from ..utils.progress import progress_listener
 from ..email_service import EmailService
 
 main_bp = Blueprint('main', __name__)
@@ -25,56 +26,32 @@ def home():
 @login_required
 def dashboard():
     """Render the dashboard page with analytics data"""
+    # Worker progress notifications invalidate cached stats in this process
+    progress_listener.ensure_started(current_app._get_current_object())
+    
     try:
-        # Count emails sent by the current user
-        emails_count = EmailHistory.query.filter_by(user_id=current_user.id).count()
-        
-        # Count unique bulk campaigns
-        campaigns_count = db.session.query(func.count(func.distinct(EmailHistory.campaign_name))).filter(
-            EmailHistory.user_id == current_user.id,
-            EmailHistory.campaign_name.isnot(None)
-        ).scalar() or 0
-        
-        # Calculate open and click rates from real data
+        # Counts, campaign counters and recent emails, cached per user for a few seconds
+        stats = stats_cache.get(current_user.id)
+        emails_count = stats['emails_count']
+        campaigns_count = len(stats['campaigns'])
         campaign_stats = []
         
-        # Get all campaigns for the user
-        campaigns = db.session.query(EmailHistory.campaign_name).filter(
-            EmailHistory.user_id == current_user.id,
-            EmailHistory.campaign_name.isnot(None)
-        ).distinct().all()
-        
         # Average score placeholders (we'll calculate better metrics later)
         avg_score = 8.7  
         
-        # Calculate metrics for each campaign
-        for campaign in campaigns:
-            campaign_name = campaign[0]
-            campaign_emails = EmailHistory.query.filter_by(
-                user_id=current_user.id,
-                campaign_name=campaign_name
-            ).all()
-            
-            total_emails = len(campaign_emails)
-            opened_emails = sum(1 for email in campaign_emails if email.opened)
-            clicked_emails = sum(1 for email in campaign_emails if email.clicked)
-            
-            # Calculate rates
-            open_rate = round((opened_emails / total_emails) * 100) if total_emails > 0 else 0
-            click_rate = round((clicked_emails / total_emails) * 100) if total_emails > 0 else 0
-            reply_rate = round(click_rate * 0.6)  # Placeholder: estimate reply rate from click rate
-            
-            latest_email = max(campaign_emails, key=lambda x: x.sent_at) if campaign_emails else None
+        for campaign in stats['campaigns']:
+            reply_rate = round(campaign['click_rate'] * 0.6)  # Placeholder: estimate reply rate from click rate
+            latest = campaign['latest']
             
             campaign_stats.append({
-                'name': campaign_name,
+                'name': campaign['name'],
                 'type': 'Email Campaign',
-                'emails_sent': total_emails,
-                'date': latest_email.sent_at.strftime('%b %d, %Y') if latest_email else 'Unknown',
-                'open_rate': open_rate,
-                'click_rate': click_rate,
+                'emails_sent': campaign['total'],
+                'date': latest.strftime('%b %d, %Y') if latest else 'Unknown',
+                'open_rate': campaign['open_rate'],
+                'click_rate': campaign['click_rate'],
                 'reply_rate': reply_rate,
-                'status': 'Active' if latest_email and (datetime.utcnow() - latest_email.sent_at).days < 7 else 'Completed'
+                'status': 'Active' if latest and (datetime.utcnow() - latest).days < 7 else 'Completed'
             })
         
         # Add demo data if no campaigns exist
@@ -110,13 +87,12 @@ def dashboard():
         avg_score = 0
         usage_percentage = 0
         campaign_stats = []
+        stats = {'recent_emails': []}
     
     # Get recent activity
     recent_activity = []
-    recent_emails = EmailHistory.query.filter_by(user_id=current_user.id).order_by(EmailHistory.sent_at.desc()).limit(5).all()
-    
-    for email in recent_emails:
-        time_diff = datetime.utcnow() - email.sent_at
+    for email in stats['recent_emails']:
+        time_diff = datetime.utcnow() - email['sent_at']
         if time_diff.days > 0:
             time_ago = f"{time_diff.days} days ago"
         elif time_diff.seconds >= 3600:
@@ -124,11 +100,11 @@ def dashboard():
         else:
             time_ago = f"{time_diff.seconds // 60} minutes ago"
             
-        activity_type = "campaign" if email.campaign_name else "email"
+        activity_type = "campaign" if email['campaign_name'] else "email"
         activity = {
             'type': activity_type,
-            'title': f"{'Bulk Email' if email.campaign_name else 'Email'} sent to {email.recipient}",
-            'description': f"Subject: {email.subject}",
+            'title': f"{'Bulk Email' if email['campaign_name'] else 'Email'} sent to {email['recipient']}",
+            'description': f"Subject: {email['subject']}",
             'time': time_ago
         }
         recent_activity.append(activity)
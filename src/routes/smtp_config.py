@@ -20,6 +20,17 @@ def email_settings():
                           smtp_configs=smtp_configs,
                           email_history=email_history)
 
+def parse_rate_limits(form):
+    """Read the optional sending limits from an SMTP configuration form"""
+    max_per_second = form.get('max_per_second', '').strip()
+    burst = form.get('burst', '').strip()
+    max_per_hour = form.get('max_per_hour', '').strip()
+    return {
+        'max_per_second': float(max_per_second) if max_per_second else 0.5,
+        'burst': int(burst) if burst else 1,
+        'max_per_hour': int(max_per_hour) if max_per_hour else None
+    }
+
 @smtp_bp.route('/add', methods=['POST'])
 @login_required
 def add_smtp_config():
@@ -42,7 +53,8 @@ def add_smtp_config():
             email=request.form.get('email'),
             display_name=request.form.get('display_name'),
             reply_to=request.form.get('reply_to'),
-            is_default=bool(request.form.get('is_default'))
+            is_default=bool(request.form.get('is_default')),
+            **parse_rate_limits(request.form)
         )
         
         db.session.add(smtp_config)
@@ -81,6 +93,10 @@ def update_smtp_config():
         smtp_config.display_name = request.form.get('display_name')
         smtp_config.reply_to = request.form.get('reply_to')
         
+        # Update sending limits
+        for field, value in parse_rate_limits(request.form).items():
+            setattr(smtp_config, field, value)
+        
         db.session.commit()
         flash('SMTP configuration updated successfully', 'success')
     except Exception as e:
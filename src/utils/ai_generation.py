@@ -0,0 +1,372 @@
+"""
+Model-written email personalisation.
+
+Calling the model once per recipient, one after another, would make bulk
+generation take hours. AIEmailClient runs on asyncio instead:
+
+- prompts are grouped into batches, each sent as one completions request
+  with a list of prompts (up to AI_BATCH_SIZE, waiting at most
+  AI_BATCH_WAIT_MS for a batch to fill);
+- at most AI_MAX_CONCURRENCY requests are in flight;
+- requests wait for AI_TOKENS_PER_MINUTE budget before they are sent, and
+  the budget is corrected with the usage the API reports;
+- responses are cached on disk (AI_CACHE_PATH), keyed by a hash of the model
+  and the normalised prompt, which holds the recipient fields, with
+  least-recently-used entries evicted beyond AI_CACHE_ENTRIES. The cache is
+  read and written from worker threads, off the event loop.
+
+Set OPENAI_BASE_URL to point the client at another server, such as
+src/utils/mock_completion_server.py for development.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from .email_generator import DEFAULT_SENDER_NAME
+
+MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo-instruct')
+MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', 8))
+BATCH_SIZE = int(os.getenv('AI_BATCH_SIZE', 20))
+BATCH_WAIT_MS = float(os.getenv('AI_BATCH_WAIT_MS', 20))
+TOKENS_PER_MINUTE = int(os.getenv('AI_TOKENS_PER_MINUTE', 90000))
+MAX_TOKENS = int(os.getenv('AI_MAX_TOKENS', 400))
+CACHE_PATH = os.getenv('AI_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'inbox_genie_ai_cache.sqlite3'))
+CACHE_ENTRIES = int(os.getenv('AI_CACHE_ENTRIES', 100000))
+
+# Recipient fields given to the model, in prompt order
+PROMPT_FIELDS = (
+    ('name', 'Name'),
+    ('role', 'Role'),
+    ('company', 'Company'),
+    ('industry', 'Industry'),
+    ('recent_activity', 'Recent activity'),
+    ('industry_news', 'Industry news'),
+    ('pain_points', 'Pain points')
+)
+
+INSTRUCTIONS = {
+    'cold_email': 'Write a short cold email that opens with something specific to the recipient, '
+                  'shows how we can help with their challenges and ends with a low-pressure call to action.',
+    'follow_up': 'Write a brief, polite follow-up to an earlier email that received no reply.',
+    'meeting_request': 'Write a brief email asking for a 15-minute call next week.'
+}
+
+
+def _normalise(value) -> str:
+    return ' '.join(str(value).split())
+
+
+def build_prompt(recipient_data: Dict, template_type: str = 'cold_email',
+                 sender_name: str = DEFAULT_SENDER_NAME) -> str:
+    """
+    Completion prompt for one recipient
+
+    Whitespace is normalised and empty fields are left out, so recipients that
+    differ only in formatting share a cache entry.
+    """
+    lines = [
+        'You are an assistant writing professional, conversational outreach emails. '
+        'Avoid fluff and generic compliments.',
+        INSTRUCTIONS.get(template_type, INSTRUCTIONS['cold_email']),
+        '',
+        'Recipient:'
+    ]
+    for field, label in PROMPT_FIELDS:
+        value = _normalise(recipient_data.get(field) or '')
+        if value:
+            lines.append(f'{label}: {value}')
+    lines.extend(['', f'Sign the email as {_normalise(sender_name)}.', '', 'Email:'])
+    return '\n'.join(lines)
+
+
+def estimate_tokens(prompt: str, max_tokens: int = MAX_TOKENS) -> int:
+    """Worst-case tokens for one prompt: about four characters per token plus the completion"""
+    return len(prompt) // 4 + 1 + max_tokens
+
+
+class ResponseCache:
+    """
+    On-disk LRU cache of model responses, stored in a SQLite file
+
+    Safe to share between threads and between processes on one host.
+    Eviction removes the least recently used tenth of the entries once the
+    cache grows past max_entries, so it does not run on every insert.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)')
+        self._size = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key_for(model: str, prompt: str, max_tokens: int) -> str:
+        return hashlib.sha256(json.dumps([model, max_tokens, prompt]).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+            return row[0]
+
+    def put_many(self, entries: Dict[str, str]):
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN')
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)',
+                [(key, response, now) for key, response in entries.items()]
+            )
+            self._connection.execute('COMMIT')
+            self._size += len(entries)
+            if self._size > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        self._size = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        excess = self._size - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)',
+                (excess,)
+            )
+            self._size -= excess
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class TokenBudget:
+    """
+    Per-minute token budget shared by the requests of one client
+
+    Refills continuously at tokens_per_minute / 60 per second up to one
+    minute's worth. Requests reserve their estimate up front and the
+    difference is settled once the real usage is known.
+    """
+
+    def __init__(self, tokens_per_minute: int = TOKENS_PER_MINUTE):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens: int):
+        """Wait until the budget allows tokens to be spent, then spend them"""
+        tokens = min(tokens, self.capacity)
+        # The lock keeps waiters in order, so large requests are not starved
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def settle(self, reserved: int, used: int):
+        """Return an over-estimate to the budget, or charge an under-estimate"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + reserved - used)
+
+
+class AIEmailClient:
+    """
+    Concurrent, batching, budgeted and cached completions client
+
+    Use as an async context manager:
+
+        async with AIEmailClient() as client:
+            emails = await client.generate_many(prompts)
+
+    Args:
+        model: Completions model name
+        api_key: API key (defaults to OPENAI_API_KEY)
+        base_url: API base URL (defaults to OPENAI_BASE_URL or the OpenAI API)
+        max_concurrency: Requests in flight at once
+        batch_size: Prompts per request
+        batch_wait_ms: How long to wait for a batch to fill
+        tokens_per_minute: Token budget
+        max_tokens: Completion length limit per prompt
+        cache: ResponseCache, or None to disable caching
+        max_retries: Retries for rate-limited or failed requests
+    """
+
+    def __init__(self, model: str = MODEL, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_concurrency: int = MAX_CONCURRENCY, batch_size: int = BATCH_SIZE,
+                 batch_wait_ms: float = BATCH_WAIT_MS, tokens_per_minute: int = TOKENS_PER_MINUTE,
+                 max_tokens: int = MAX_TOKENS, cache: Optional[ResponseCache] = None,
+                 max_retries: int = 3, timeout: float = 60.0):
+        self.model = model
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY', '')
+        self.base_url = base_url or os.getenv('OPENAI_BASE_URL') or None
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+        self.budget = TokenBudget(tokens_per_minute)
+        self.stats = {
+            'requests': 0,
+            'prompts': 0,
+            'cache_hits': 0,
+            'tokens': 0
+        }
+        self._client = None
+        self._queue = None
+        self._batcher = None
+        self._slots = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+
+    async def __aenter__(self) -> 'AIEmailClient':
+        # Our own HTTP client, sized to the concurrency limit
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+            timeout=self.timeout
+        )
+        self._client = AsyncOpenAI(api_key=self.api_key or 'unset', base_url=self.base_url,
+                                   http_client=http_client, max_retries=self.max_retries)
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._batcher = asyncio.create_task(self._collect_batches())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._batcher.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.close()
+
+    async def generate(self, prompt: str) -> str:
+        """Completion for one prompt, from the cache when possible"""
+        key = ResponseCache.key_for(self.model, prompt, self.max_tokens)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                return cached
+        # Identical prompts already on their way share the request
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            self._queue.put_nowait((key, prompt, future))
+        return await future
+
+    async def generate_many(self, prompts: List[str]) -> List[str]:
+        """Completions for many prompts, in the same order"""
+        return await asyncio.gather(*(self.generate(prompt) for prompt in prompts))
+
+    async def _collect_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Waiting for a slot here holds further batching back while all requests are busy
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        reserved = sum(estimate_tokens(prompt, self.max_tokens) for _, prompt, _ in batch)
+        try:
+            await self.budget.acquire(reserved)
+            response = await self._client.completions.create(
+                model=self.model,
+                prompt=[prompt for _, prompt, _ in batch],
+                max_tokens=self.max_tokens,
+                temperature=0.7
+            )
+            used = response.usage.total_tokens if response.usage else reserved
+            self.budget.settle(reserved, used)
+            self.stats['requests'] += 1
+            self.stats['prompts'] += len(batch)
+            self.stats['tokens'] += used
+
+            texts = {choice.index: choice.text.strip() for choice in response.choices}
+            results = {key: texts.get(index, '') for index, (key, _, _) in enumerate(batch)}
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put_many, results)
+            for key, _, future in batch:
+                if not future.done():
+                    future.set_result(results[key])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for key, _, _ in batch:
+                self._in_flight.pop(key, None)
+            self._slots.release()
+
+
+def generate_ai_emails(recipients: List[Dict], template_type: str = 'cold_email',
+                       sender_name: str = DEFAULT_SENDER_NAME, cache: Optional[ResponseCache] = None,
+                       **client_options) -> List[str]:
+    """
+    Generate model-written emails for many recipients, in recipient order
+
+    Args:
+        recipients: Recipient data dictionaries
+        template_type: cold_email, follow_up or meeting_request
+        sender_name: Name to sign the emails with
+        cache: ResponseCache to use; a cache at AI_CACHE_PATH by default
+        **client_options: Passed to AIEmailClient
+
+    Returns:
+        Email content, one per recipient
+    """
+    prompts = [build_prompt(recipient, template_type, sender_name) for recipient in recipients]
+    own_cache = cache is None
+    cache = ResponseCache() if own_cache else cache
+
+    async def run():
+        async with AIEmailClient(cache=cache, **client_options) as client:
+            return await client.generate_many(prompts)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        if own_cache:
+            cache.close()
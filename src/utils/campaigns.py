@@ -0,0 +1,74 @@
+"""
+Campaign lookup and counter updates.
+
+Campaign counters are only ever changed with relative SQL updates
+(``sent = sent + n``), so workers, web processes and the tracking buffer can
+all add to them at once without losing updates.
+"""
+
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from ..models import Campaign, db
+
+# Campaign counter for each kind of tracking hit
+TRACKING_COUNTERS = {
+    'open': 'opened',
+    'click': 'clicked'
+}
+
+
+def get_or_create_campaign(user_id: int, name: str) -> Campaign:
+    """
+    The user's campaign with this name, created if it does not exist yet
+
+    The new campaign is flushed but not committed.
+    """
+    campaign = Campaign.query.filter_by(user_id=user_id, name=name).first()
+    if campaign:
+        return campaign
+    try:
+        with db.session.begin_nested():
+            campaign = Campaign(user_id=user_id, name=name, total=0, sent=0, failed=0, opened=0, clicked=0)
+            db.session.add(campaign)
+        return campaign
+    except IntegrityError:
+        # Created by a concurrent request in the meantime
+        return Campaign.query.filter_by(user_id=user_id, name=name).one()
+
+
+def add_campaign_counts(campaign_id: Optional[int], sent_at: Optional[datetime] = None, **counts: int):
+    """
+    Add to a campaign's counters without committing
+
+    Args:
+        campaign_id: Campaign to update; None does nothing
+        sent_at: Time of the latest send, if any were sent
+        counts: Amounts to add, by counter name (total, sent, failed, opened, clicked)
+    """
+    values = {
+        getattr(Campaign, name): getattr(Campaign, name) + amount
+        for name, amount in counts.items() if amount
+    }
+    if sent_at is not None:
+        values[Campaign.last_sent_at] = sent_at
+    if campaign_id is None or not values:
+        return
+    Campaign.query.filter_by(id=campaign_id).update(values, synchronize_session=False)
+
+
+def add_tracking_counts(kind: str, campaign_ids: Iterable[Optional[int]]):
+    """
+    Count newly opened or clicked emails in their campaigns, without committing
+
+    Args:
+        kind: 'open' or 'click'
+        campaign_ids: Campaign of each email whose first hit of this kind was just recorded
+    """
+    counter = TRACKING_COUNTERS[kind]
+    per_campaign: Dict[int, int] = Counter(campaign_id for campaign_id in campaign_ids if campaign_id)
+    for campaign_id, amount in per_campaign.items():
+        add_campaign_counts(campaign_id, **{counter: amount})
@@ -0,0 +1,143 @@
+"""
+Cached dashboard statistics.
+
+The dashboard needs a user's email count, their campaigns with counters and
+their latest emails. These come from three indexed queries (see
+compute_dashboard_stats) whose results are kept per user for
+DASHBOARD_STATS_TTL seconds.
+
+Events that change the numbers drop the user's entry: queuing or sending
+emails from the web app, and tracking hits when the tracking buffer writes
+them. Sends by the background workers happen in another process; on
+PostgreSQL their progress notifications drop the entry in every listening
+web process, elsewhere the TTL bounds how stale the numbers can get.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from sqlalchemy import func
+
+from ..models import Campaign, EmailHistory, db
+
+TTL = float(os.getenv('DASHBOARD_STATS_TTL', 30))
+
+# Users whose stats are kept per process
+MAX_USERS = 10000
+
+RECENT_EMAILS = 5
+
+
+def compute_dashboard_stats(user_id: int) -> Dict:
+    """
+    Read a user's dashboard numbers from the database
+
+    Returns:
+        Dictionary with emails_count, campaigns (name, emails queued and
+        sent, rates and the time of the latest send, newest campaign first) and
+        recent_emails (recipient, subject, campaign_name and sent_at of the
+        latest emails)
+    """
+    emails_count = db.session.query(func.count(EmailHistory.id)).filter(
+        EmailHistory.user_id == user_id
+    ).scalar() or 0
+
+    campaigns = Campaign.query.filter_by(user_id=user_id).order_by(Campaign.created_at.desc()).all()
+
+    recent_emails = db.session.query(
+        EmailHistory.recipient, EmailHistory.subject, EmailHistory.campaign_name, EmailHistory.sent_at
+    ).filter(EmailHistory.user_id == user_id).order_by(EmailHistory.sent_at.desc()).limit(RECENT_EMAILS).all()
+
+    return {
+        'emails_count': emails_count,
+        'campaigns': [
+            {
+                'name': campaign.name,
+                'total': campaign.total or 0,
+                'sent': campaign.sent or 0,
+                'open_rate': campaign.rate(campaign.opened or 0),
+                'click_rate': campaign.rate(campaign.clicked or 0),
+                'latest': campaign.last_sent_at or campaign.created_at
+            }
+            for campaign in campaigns
+        ],
+        'recent_emails': [row._asdict() for row in recent_emails]
+    }
+
+
+class StatsCache:
+    """
+    Per-user statistics with a time to live
+
+    Results computed while the user's entry was being invalidated are not
+    stored, so an invalidation is never undone by a slow computation that
+    started before it. Invalidations are only counted for users with a
+    computation in progress, so that bookkeeping stays as small as the
+    number of concurrent requests.
+    """
+
+    def __init__(self, ttl: float = TTL, max_users: int = MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        # Computations in progress and invalidations since they started, per
+        # user, and the count of clear() calls
+        self._computing: Dict[int, int] = {}
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, compute: Callable[[int], Dict] = compute_dashboard_stats) -> Dict:
+        """
+        The user's stats, computed if missing or expired
+
+        The returned dictionary is shared between requests: don't modify it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            generation = (self._epoch, self._generations.get(user_id, 0))
+            self._computing[user_id] = self._computing.get(user_id, 0) + 1
+
+        stats = None
+        try:
+            stats = compute(user_id)
+        finally:
+            with self._lock:
+                if (stats is not None and self.ttl > 0
+                        and (self._epoch, self._generations.get(user_id, 0)) == generation):
+                    self._entries[user_id] = (now + self.ttl, stats)
+                    self._entries.move_to_end(user_id)
+                    if len(self._entries) > self.max_users:
+                        self._entries.popitem(last=False)
+                self._computing[user_id] -= 1
+                if not self._computing[user_id]:
+                    del self._computing[user_id]
+                    self._generations.pop(user_id, None)
+        return stats
+
+    def invalidate(self, *user_ids):
+        """Drop the stats of these users (None is ignored)"""
+        with self._lock:
+            for user_id in user_ids:
+                if user_id is None:
+                    continue
+                self._entries.pop(user_id, None)
+                if user_id in self._computing:
+                    self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        """Drop every user's stats"""
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+
+# Cache shared by the whole process
+stats_cache = StatsCache()
@@ -0,0 +1,159 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .rate_limiter import RateLimitExceeded, limits_for
+
+
+class LatencyTracker:
+    """Exponentially weighted moving average of send latency per SMTP config"""
+
+    def __init__(self, alpha: float = 0.2, default: float = 1.0):
+        self.alpha = alpha
+        self.default = default
+        self._values: Dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds: float):
+        with self._lock:
+            previous = self._values.get(key)
+            if previous is None:
+                self._values[key] = seconds
+            else:
+                self._values[key] = previous + self.alpha * (seconds - previous)
+
+    def get(self, key) -> float:
+        with self._lock:
+            return self._values.get(key, self.default)
+
+
+def sender_capacity(smtp_config: Dict, latency: float, threads: int) -> float:
+    """
+    Estimate the messages per second a single SMTP config can sustain
+
+    The estimate is the lower of what its threads can push at the measured
+    latency and what its configured limits allow.
+    """
+    capacity = threads / max(latency, 1e-3)
+    if smtp_config.get('max_per_second'):
+        capacity = min(capacity, smtp_config['max_per_second'])
+    if smtp_config.get('max_per_hour'):
+        capacity = min(capacity, smtp_config['max_per_hour'] / 3600.0)
+    return capacity
+
+
+def split_weighted(items: List, weights: Dict) -> Dict:
+    """
+    Distribute items across keys in proportion to their weights
+
+    Uses smooth weighted round-robin so every key receives an even spread of
+    the list rather than one contiguous block, which keeps campaign order
+    roughly intact when the senders run in parallel.
+    """
+    keys = [key for key, weight in weights.items() if weight > 0]
+    assignments = {key: [] for key in weights}
+    if not keys:
+        return assignments
+
+    total = sum(weights[key] for key in keys)
+    current = {key: 0.0 for key in keys}
+    for item in items:
+        for key in keys:
+            current[key] += weights[key]
+        chosen = max(keys, key=lambda k: current[k])
+        current[chosen] -= total
+        assignments[chosen].append(item)
+    return assignments
+
+
+class MultiSenderDispatcher:
+    """
+    Sends one campaign through several SMTP configs concurrently
+
+    Each config gets its own thread pool, so a slow relay only holds up the
+    messages assigned to it. When a rate limiter is given, every thread waits
+    for its config's bucket before sending. With max_wait, a send that would
+    have to wait longer than that fails with RateLimitExceeded instead.
+    """
+
+    def __init__(self, smtp_configs: Dict[object, Dict], threads_per_config: int = 4,
+                 rate_limiter=None, delay_seconds: Optional[float] = None,
+                 latency_tracker: LatencyTracker = None, thread_initializer: Callable = None,
+                 max_wait: Optional[float] = None):
+        self.smtp_configs = smtp_configs
+        self.threads_per_config = max(1, threads_per_config)
+        self.rate_limiter = rate_limiter
+        self.delay_seconds = delay_seconds
+        self.max_wait = max_wait
+        self.latency_tracker = latency_tracker or default_latency_tracker
+        self.thread_initializer = thread_initializer
+
+    def plan(self, items: List) -> Dict:
+        """Split items across configs weighted by their limits and measured latency"""
+        weights = {
+            key: sender_capacity(config, self.latency_tracker.get(key), self.threads_per_config)
+            for key, config in self.smtp_configs.items()
+        }
+        return split_weighted(items, weights)
+
+    def run(self, assignments: Dict, send_fn: Callable[[object, Dict, object], Tuple[bool, str]]
+            ) -> Iterator[Tuple[object, object, bool, str, Optional[BaseException]]]:
+        """
+        Send every assigned item and yield results as they complete
+
+        Args:
+            assignments: Mapping of config key to the items it should send
+            send_fn: Called as send_fn(key, smtp_config, item) in a worker
+                thread; returns (success, message) or raises on failure
+
+        Yields:
+            Tuples of (key, item, success, message, error) where error is the
+            exception raised by send_fn, if any
+        """
+        executors = []
+        futures = {}
+        try:
+            for key, items in assignments.items():
+                if not items:
+                    continue
+                executor = ThreadPoolExecutor(
+                    max_workers=min(self.threads_per_config, len(items)),
+                    thread_name_prefix=f'smtp-{key}',
+                    initializer=self.thread_initializer
+                )
+                executors.append(executor)
+                for item in items:
+                    future = executor.submit(self._timed_send, send_fn, key, item)
+                    futures[future] = (key, item)
+
+            for future in as_completed(futures):
+                key, item = futures[future]
+                error = None
+                try:
+                    success, message = future.result()
+                except Exception as e:
+                    success, message, error = False, str(e), e
+                yield key, item, success, message, error
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _timed_send(self, send_fn, key, item):
+        smtp_config = self.smtp_configs[key]
+        if self.rate_limiter:
+            limits = limits_for(smtp_config, self.delay_seconds)
+            if self.max_wait is None:
+                self.rate_limiter.acquire(key, **limits)
+            else:
+                wait = self.rate_limiter.acquire_within(key, self.max_wait, **limits)
+                if wait:
+                    raise RateLimitExceeded(key, wait)
+        start = time.monotonic()
+        result = send_fn(key, smtp_config, item)
+        self.latency_tracker.observe(key, time.monotonic() - start)
+        return result
+
+
+# Latency measurements shared by every dispatcher in the process
+default_latency_tracker = LatencyTracker()
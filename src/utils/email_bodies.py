@@ -0,0 +1,195 @@
+"""
+Content-addressed storage of email bodies.
+
+Bulk campaigns repeat the same body, or the same template with a few
+substituted fields, thousands of times. EmailHistory rows therefore point to
+an EmailBody by the SHA-256 of its content, and template bodies keep only
+the per-recipient variables on the row. Identical bodies are stored once.
+
+Rows written before this scheme keep their full content in the ``content``
+column until migrate_stored_contents moves them over; the workers do that a
+batch at a time whenever they are idle.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from .template_engine import compile_template
+
+# Hashes looked up per query
+LOOKUP_CHUNK = 500
+
+# Rows moved per migration pass
+MIGRATION_BATCH = 500
+
+
+class _Blank(dict):
+    """Variables mapping that renders fields missing from old rows as empty"""
+
+    def __missing__(self, key):
+        return ''
+
+
+def body_hash(content: str, is_template: bool = False) -> str:
+    """Key of a body; a template and a literal body with the same text differ"""
+    prefix = b'template\0' if is_template else b'body\0'
+    return hashlib.sha256(prefix + content.encode('utf-8')).hexdigest()
+
+
+def render_body(template: str, variables: Dict) -> str:
+    """Render a template body with an email's variables"""
+    return compile_template(template).render(_Blank(variables))
+
+
+def record_content(record, bodies: Dict) -> str:
+    """
+    The content of an EmailHistory row, taking its body from a preloaded map
+
+    Args:
+        record: EmailHistory row with its deferred body columns loaded
+        bodies: EmailBody rows by hash, covering the record's body_hash
+
+    Returns:
+        The email body, rendered from its shared template if it has one
+    """
+    body = bodies.get(record.body_hash) if record.body_hash else None
+    if body is None:
+        return record.stored_content
+    if not body.is_template:
+        return body.content
+    return render_body(body.content, json.loads(record.variables or '{}'))
+
+
+def _insert_missing(rows: List[Dict]) -> None:
+    """
+    Insert EmailBody rows, skipping any another transaction added first
+
+    PostgreSQL and SQLite do it in one statement with ON CONFLICT DO NOTHING;
+    other databases insert each row in a savepoint and ignore duplicates.
+    """
+    from ..models import EmailBody, db
+
+    dialects = {'postgresql': postgresql, 'sqlite': sqlite}
+    dialect = dialects.get(db.session.get_bind().dialect.name)
+    if dialect is not None:
+        db.session.execute(dialect.insert(EmailBody).on_conflict_do_nothing(index_elements=['hash']), rows)
+        return
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.add(EmailBody(**row))
+        except IntegrityError:
+            pass
+
+
+def intern_bodies(bodies: Iterable[Tuple[str, bool]]) -> List[str]:
+    """
+    Make sure each body is stored, inserting the missing ones
+
+    Existing bodies are found with one query per LOOKUP_CHUNK distinct
+    hashes. The rest are inserted in the session's transaction, which is not
+    committed; a body another request or worker inserts at the same time is
+    skipped rather than raising.
+
+    Args:
+        bodies: (content, is_template) pairs
+
+    Returns:
+        The hash of each body, in order
+    """
+    from ..models import EmailBody, db
+
+    hashes = []
+    distinct = {}
+    for content, is_template in bodies:
+        key = body_hash(content, is_template)
+        hashes.append(key)
+        distinct.setdefault(key, (content, is_template))
+
+    keys = list(distinct)
+    existing = set()
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        existing.update(row.hash for row in db.session.query(EmailBody.hash).filter(EmailBody.hash.in_(chunk)))
+
+    created_at = datetime.utcnow()
+    # Inserted in hash order so concurrent transactions lock rows in the same order
+    missing = [
+        {'hash': key, 'content': distinct[key][0], 'is_template': distinct[key][1], 'created_at': created_at}
+        for key in sorted(keys) if key not in existing
+    ]
+    if missing:
+        _insert_missing(missing)
+    return hashes
+
+
+def encode_variables(variables: Dict) -> str:
+    """Compact JSON for EmailHistory.variables"""
+    return json.dumps(variables, separators=(',', ':'), sort_keys=True)
+
+
+def store_email_bodies(emails: List[Dict], template: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+    """
+    Intern the bodies of emails about to be queued
+
+    Args:
+        emails: Email dictionaries with a 'content' or, when a template is
+            given, the 'variables' to render it with
+        template: Shared template text for emails without their own content
+
+    Returns:
+        (body_hash, variables JSON or None) for each email, in order
+
+    Raises:
+        TemplateError: If an email's variables cannot fill the template
+    """
+    compiled = compile_template(template) if template else None
+    bodies = []
+    variables = []
+    for email_data in emails:
+        if compiled is not None and not email_data.get('content'):
+            values = email_data.get('variables') or {}
+            compiled.check(values)
+            bodies.append((template, True))
+            variables.append(encode_variables(values))
+        else:
+            bodies.append((email_data.get('content') or '', False))
+            variables.append(None)
+    return list(zip(intern_bodies(bodies), variables))
+
+
+def migrate_stored_contents(limit: int = MIGRATION_BATCH) -> int:
+    """
+    Move a batch of rows with a full stored body to shared EmailBody rows
+
+    Rows are only cleared if no other worker migrated them in the meantime.
+
+    Returns:
+        Number of rows migrated
+    """
+    from ..models import EmailHistory, db
+
+    rows = db.session.query(EmailHistory.id, EmailHistory.stored_content).filter(
+        EmailHistory.body_hash.is_(None),
+        EmailHistory.stored_content.isnot(None)
+    ).limit(limit).all()
+    if not rows:
+        return 0
+
+    hashes = intern_bodies((row.stored_content, False) for row in rows)
+    ids_by_hash = {}
+    for row, key in zip(rows, hashes):
+        ids_by_hash.setdefault(key, []).append(row.id)
+    migrated = 0
+    for key, ids in ids_by_hash.items():
+        migrated += EmailHistory.query.filter(
+            EmailHistory.id.in_(ids),
+            EmailHistory.body_hash.is_(None)
+        ).update({EmailHistory.body_hash: key, EmailHistory.stored_content: None}, synchronize_session=False)
+    db.session.commit()
+    return migrated
@@ -1,22 +1,55 @@
 import io
 import csv
+from flask import has_request_context
 from flask_login import current_user
 from datetime import datetime
 from ..models import EmailHistory, db
+from .template_engine import TemplateError, compile_saved_template, compile_template
+
+# Values used for template fields a recipient does not provide
+TEMPLATE_DEFAULTS = {
+    'name': 'Prospect',
+    'company': 'Company',
+    'role': 'Professional',
+    'industry': 'your industry',
+    'pain_points': ''
+}
+
+# The sender's own details. Recipient data never overrides these, so a CSV
+# with a "position" column can't change the signature.
+SENDER_FIELDS = {
+    'position': '[Your Position]',
+    'contact_info': '[Your Contact Information]'
+}
+
+# Sender name used when there is no signed-in user
+DEFAULT_SENDER_NAME = '[Your Name]'
 
 class EmailGenerator:
     @staticmethod
-    def generate_email(recipient_data, template_type='cold_email'):
+    def current_sender_name():
+        """Name of the signed-in user, for signing generated emails"""
+        if has_request_context() and current_user.is_authenticated:
+            return current_user.username
+        return DEFAULT_SENDER_NAME
+    
+    @staticmethod
+    def generate_email(recipient_data, template_type='cold_email', sender_name=None):
         """
         Generate a personalized cold email based on recipient data
         
         Args:
             recipient_data (dict): Dictionary containing recipient information
             template_type (str): Type of email template to use
+            sender_name (str): Name to sign with; defaults to the signed-in user.
+                Pass it to generate outside a request.
             
         Returns:
             str: Personalized email content
         """
+        if sender_name is None:
+            sender_name = EmailGenerator.current_sender_name()
+        
         # Extract recipient data
         name = recipient_data.get('name', 'Prospect')
         role = recipient_data.get('role', 'Professional')
@@ -55,7 +88,7 @@ I'd love to share how we've helped other {industry} companies achieve similar re
 
 Looking forward to your response,
 
-{current_user.username if current_user.is_authenticated else '[Your Name]'}
+{sender_name}
 [Your Position]
 [Your Company]
 [Your Contact Information]"""
@@ -69,7 +102,7 @@ I'm available to discuss how our solution has helped companies like yours improv
 Let me know if you have 15 minutes this week for a quick call.
 
 Best regards,
-{current_user.username if current_user.is_authenticated else '[Your Name]'}
+{sender_name}
 [Your Position]
 [Your Company]
 [Your Contact Information]"""
@@ -83,7 +116,7 @@ Are you available next Tuesday or Wednesday afternoon?
 Looking forward to connecting!
 
 Best regards,
-{current_user.username if current_user.is_authenticated else '[Your Name]'}
+{sender_name}
 [Your Position]
 [Your Company]
 [Your Contact Information]"""
@@ -100,7 +133,7 @@ I'd love to share how we've helped other {industry} companies achieve similar re
 
 Looking forward to your response,
 
-{current_user.username if current_user.is_authenticated else '[Your Name]'}
+{sender_name}
 [Your Position]
 [Your Company]
 [Your Contact Information]"""
@@ -182,34 +215,150 @@ Looking forward to your response,
 {{contact_info}}"""
     
     @staticmethod
-    def generate_email_from_template(recipient_data, template_content):
+    def _sender_values(sender_name=None):
+        """Values of the sender fields, including {{username}}"""
+        if sender_name is None:
+            sender_name = EmailGenerator.current_sender_name()
+        return dict(SENDER_FIELDS, username=sender_name)
+    
+    @staticmethod
+    def _compile(template):
+        """Compile template text or an EmailTemplate, using the compiled-template cache"""
+        if isinstance(template, str):
+            return compile_template(template)
+        return compile_saved_template(template)
+    
+    @staticmethod
+    def generate_email_from_template(recipient_data, template_content, sender_name=None):
         """
         Generate a personalized email from a template
         
+        Any {{field}} is filled from the recipient data, falling back to the
+        defaults for the standard fields. The sender fields ({{username}},
+        {{position}}, {{contact_info}}) always come from the sender.
+        
         Args:
             recipient_data (dict): Dictionary containing recipient information
-            template_content (str): Email template content
+            template_content (str or EmailTemplate): Email template content, or a saved template
+            sender_name (str): Name for {{username}}; defaults to the signed-in user
             
         Returns:
             str: Personalized email content
+            
+        Raises:
+            TemplateError: If the template uses fields that cannot be filled
+        """
+        compiled = EmailGenerator._compile(template_content)
+        values = {**TEMPLATE_DEFAULTS, **recipient_data, **EmailGenerator._sender_values(sender_name)}
+        compiled.check(values)
+        return compiled.render(values)
+    
+    @staticmethod
+    def generate_emails_from_template(recipients, template_content, sender_name=None, first_row=1):
         """
-        # Replace placeholders in the template
-        email = template_content.replace('{{name}}', recipient_data.get('name', 'Prospect'))
-        email = email.replace('{{company}}', recipient_data.get('company', 'Company'))
-        email = email.replace('{{role}}', recipient_data.get('role', 'Professional'))
-        email = email.replace('{{industry}}', recipient_data.get('industry', 'your industry'))
-        email = email.replace('{{pain_points}}', recipient_data.get('pain_points', ''))
-        email = email.replace('{{username}}', current_user.username if current_user.is_authenticated else '[Your Name]')
-        email = email.replace('{{position}}', '[Your Position]')
-        email = email.replace('{{company}}', '[Your Company]')
-        email = email.replace('{{contact_info}}', '[Your Contact Information]')
+        Generate personalized emails for many recipients from one template
         
-        return email
+        The template is compiled once, and every recipient is checked for the
+        fields it needs beyond the defaults before anything is rendered.
+        
+        Args:
+            recipients (list): Recipient data dictionaries
+            template_content (str or EmailTemplate): Email template content, or a saved template
+            sender_name (str): Name for {{username}}; defaults to the signed-in user
+            first_row (int): Row number of the first recipient, for error messages
+            
+        Returns:
+            list: Personalized email content, one per recipient
+            
+        Raises:
+            TemplateError: If the template uses fields that cannot be filled for
+                some recipient; its row is the first such recipient
+        """
+        if not recipients:
+            return []
+        compiled = EmailGenerator._compile(template_content)
+        sender = EmailGenerator._sender_values(sender_name)
+        # Fields each recipient has to provide itself
+        required = compiled.missing_fields(set(TEMPLATE_DEFAULTS) | set(sender))
+        if required:
+            for row, recipient in enumerate(recipients, start=first_row):
+                missing = [field for field in required if field not in recipient]
+                if missing:
+                    raise TemplateError(missing, row)
+        
+        render = compiled.render
+        return [render({**TEMPLATE_DEFAULTS, **recipient, **sender}) for recipient in recipients]
+    
+    @staticmethod
+    def iter_csv_emails(csv_file, template_type='cold_email', template_content=None, sender_name=None):
+        """Generate emails from CSV data one row at a time
+        
+        Rows are read from the file as they are needed, so only the row being
+        processed is held in memory. Headers are validated once, up front.
+        
+        Args:
+            csv_file: Text file object (or any iterable of lines) with CSV data
+            template_type (str): Type of built-in email template to use
+            template_content (str or EmailTemplate): Custom template to use instead
+            sender_name (str): Name to sign with; defaults to the signed-in user
+            
+        Yields:
+            dict: {'type': 'email', 'row', 'recipient', 'email'} for each generated
+            email, or {'type': 'error', 'row', 'error'} for each problem. A header
+            problem is reported with row 1 and ends the stream.
+        """
+        csv_reader = csv.DictReader(csv_file)
+        
+        # Get headers from CSV
+        headers = csv_reader.fieldnames or []
+        
+        # Validate required fields
+        required_fields = ['name', 'role', 'company', 'email']
+        normalized = {header: header.lower().strip() for header in headers if header is not None}
+        missing_fields = [field for field in required_fields if field not in normalized.values()]
+        if missing_fields:
+            yield {'type': 'error', 'row': 1, 'error': f"Missing required columns: {', '.join(missing_fields)}"}
+            return
+        
+        if sender_name is None:
+            sender_name = EmailGenerator.current_sender_name()
+        
+        render = None
+        if template_content is not None:
+            compiled = EmailGenerator._compile(template_content)
+            sender = EmailGenerator._sender_values(sender_name)
+            try:
+                compiled.check(set(TEMPLATE_DEFAULTS) | set(sender) | set(normalized.values()))
+            except ValueError as e:
+                yield {'type': 'error', 'row': 1, 'error': str(e)}
+                return
+            render = compiled.render
+        
+        for row_num, row in enumerate(csv_reader, start=2):  # Start at 2 to account for header row
+            # Standardized row dictionary with lowercase header names
+            standardized_row = {key: (row[header] or '').strip() for header, key in normalized.items()}
+            
+            # Validate required fields in each row
+            row_errors = [f"Missing {field}" for field in required_fields if not standardized_row.get(field)]
+            if row_errors:
+                yield {'type': 'error', 'row': row_num, 'error': f"Row {row_num}: {', '.join(row_errors)}"}
+                continue
+            
+            try:
+                if render:
+                    email = render({**TEMPLATE_DEFAULTS, **standardized_row, **sender})
+                else:
+                    email = EmailGenerator.generate_email(standardized_row, template_type, sender_name)
+                yield {'type': 'email', 'row': row_num, 'recipient': standardized_row, 'email': email}
+            except Exception as e:
+                yield {'type': 'error', 'row': row_num, 'error': f"Row {row_num}: Failed to generate email: {str(e)}"}
     
     @staticmethod
     def process_csv_data(csv_data, template_type='cold_email'):
         """Process CSV data and generate emails for each recipient
         
+        Collects everything in memory; use iter_csv_emails for large uploads.
+        
         Args:
             csv_data (str): CSV data as a string
             template_type (str): Type of email template to use
@@ -226,52 +375,21 @@ Looking forward to your response,
         }
         
         try:
-            # Parse CSV data
-            csv_file = io.StringIO(csv_data)
-            csv_reader = csv.DictReader(csv_file)
-            
-            # Get headers from CSV
-            headers = csv_reader.fieldnames
-            
-            # Validate required fields
-            required_fields = ['name', 'role', 'company', 'email']
-            missing_fields = [field for field in required_fields if field.lower() not in [h.lower() for h in headers]]
-            
-            if missing_fields:
-                result['success'] = False
-                result['errors'].append(f"Missing required columns: {', '.join(missing_fields)}")
-                return result
-            
-            # Process each row
-            for row_num, row in enumerate(csv_reader, start=2):  # Start at 2 to account for header row
-                result['total_recipients'] += 1
-                
-                # Normalize header names to lowercase and create a standardized row dictionary
-                standardized_row = {}
-                for header in headers:
-                    key = header.lower().strip()
-                    standardized_row[key] = row[header].strip() if row[header] else ''
+            for record in EmailGenerator.iter_csv_emails(io.StringIO(csv_data), template_type):
+                if record['row'] == 1:
+                    result['success'] = False
+                    result['errors'].append(record['error'])
+                    return result
                 
-                # Validate required fields in each row
-                row_errors = []
-                for field in required_fields:
-                    if not standardized_row.get(field):
-                        row_errors.append(f"Missing {field}")
-                        
-                if row_errors:
-                    result['errors'].append(f"Row {row_num}: {', '.join(row_errors)}")
-                    continue
-                
-                try:
-                    # Generate email for this recipient
-                    email = EmailGenerator.generate_email(standardized_row, template_type)
+                result['total_recipients'] += 1
+                if record['type'] == 'email':
                     result['emails'].append({
-                        'recipient': standardized_row,
-                        'email': email
+                        'recipient': record['recipient'],
+                        'email': record['email']
                     })
                     result['successful_recipients'] += 1
-                except Exception as e:
-                    result['errors'].append(f"Row {row_num}: Failed to generate email: {str(e)}")
+                else:
+                    result['errors'].append(record['error'])
                     
             # Update success flag if we have any emails
             if result['successful_recipients'] == 0 and result['total_recipients'] > 0:
@@ -0,0 +1,240 @@
+"""
+Append-only log of tracking events.
+
+The open and click endpoints append one fixed-size binary record per event
+(email ID, kind, time, link index) to a local segment file, which costs a
+single write() and no database work. Each process writes its own segment
+(``<millis>-<pid>-<n>.open``) and seals it by renaming it to ``.log`` once it
+reaches TRACKING_LOG_SEGMENT_BYTES or TRACKING_LOG_SEGMENT_SECONDS, or when
+the process exits. The event ingester (``python -m src.event_ingester``)
+bulk-loads sealed segments into the TrackingEvent table and deletes them.
+
+Age is checked on every append and by a background thread, so the last
+events of a process that has gone quiet are sealed on time too.
+
+The writing process holds an exclusive flock on its open segment. The lock
+goes away with the process however it ends, so the ingester seals an open
+segment only once it can take that lock itself. Process IDs are no use for
+this: the web server and the ingester may run in different containers.
+"""
+
+import atexit
+import fcntl
+import glob
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+LOG_DIR = os.getenv('TRACKING_LOG_DIR', os.path.join(tempfile.gettempdir(), 'inbox_genie_tracking'))
+SEGMENT_BYTES = int(os.getenv('TRACKING_LOG_SEGMENT_BYTES', 4 * 1024 * 1024))
+SEGMENT_SECONDS = float(os.getenv('TRACKING_LOG_SEGMENT_SECONDS', 60))
+
+# email_id, kind code, unix time, link index (-1 for none)
+RECORD = struct.Struct('<IBdi')
+
+# Largest link index a record can hold; anything outside 0..LINK_INDEX_MAX is stored as none
+LINK_INDEX_MAX = 2 ** 31 - 1
+
+KIND_CODES = {'open': 1, 'click': 2}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.log'
+
+# Open segments younger than this are never treated as orphaned, which covers
+# the moment between a writer creating its segment and locking it
+ORPHAN_GRACE_SECONDS = 5.0
+
+
+class EventLog:
+    """
+    Writer for the segmented tracking event log
+
+    Thread-safe within a process. After a fork the child starts its own
+    segment rather than writing into its parent's. While a segment is open,
+    a daemon thread seals it once it is segment_seconds old.
+
+    Args:
+        directory: Directory holding the segment files
+        segment_bytes: Size at which a segment is sealed
+        segment_seconds: Age at which a segment is sealed
+    """
+
+    def __init__(self, directory: str = LOG_DIR, segment_bytes: int = SEGMENT_BYTES,
+                 segment_seconds: float = SEGMENT_SECONDS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self._fd = None
+        self._path = None
+        self._pid = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._sequence = 0
+        self._exit_hook = False
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._flusher_stop = None
+
+    def append(self, kind: str, email_id: int, link_index: Optional[int] = None,
+               occurred_at: Optional[float] = None):
+        """
+        Append one event
+
+        Args:
+            kind: 'open' or 'click'
+            email_id: ID of the EmailHistory record
+            link_index: Position of the clicked link in the email, if known.
+                It comes from the click URL, so values that cannot be a
+                position are recorded as unknown.
+            occurred_at: Unix time of the event (defaults to now)
+        """
+        now = time.time()
+        if link_index is None or not 0 <= link_index <= LINK_INDEX_MAX:
+            link_index = -1
+        record = RECORD.pack(email_id, KIND_CODES[kind], occurred_at or now, link_index)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the inherited segment belongs to the parent. Closing
+                # the copy of its descriptor keeps the child from holding the
+                # parent's lock after the parent exits.
+                if self._fd is not None:
+                    os.close(self._fd)
+                self._fd = None
+                self._path = None
+                self._pid = os.getpid()
+            if (self._fd is None or self._size >= self.segment_bytes
+                    or now - self._opened_at >= self.segment_seconds):
+                self._roll(now)
+            os.write(self._fd, record)
+            self._size += RECORD.size
+
+    def _roll(self, now: float):
+        self._seal()
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{int(now * 1000):013d}-{self._pid}-{self._sequence}{OPEN_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._size = 0
+        self._opened_at = now
+        if not self._exit_hook:
+            atexit.register(self.close)
+            self._exit_hook = True
+        self._start_flusher()
+
+    def _start_flusher(self):
+        # Threads don't survive a fork, so the child starts its own
+        if self._flusher is not None and self._flusher.is_alive() and not self._flusher_stop.is_set():
+            return
+        self._flusher_stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, args=(self._flusher_stop,),
+                                         name='event-log-flusher', daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self, stop: threading.Event):
+        while not stop.wait(self.segment_seconds / 4):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error sealing tracking segment: {str(e)}")
+
+    def flush(self):
+        """Seal the current segment if it has reached its age limit"""
+        with self._lock:
+            if (self._pid == os.getpid() and self._fd is not None
+                    and time.time() - self._opened_at >= self.segment_seconds):
+                self._seal()
+
+    def _seal(self):
+        if self._fd is None:
+            return
+        # Forget the segment first so a failure here can't leave appends
+        # writing to a closed descriptor
+        fd, path = self._fd, self._path
+        self._fd = None
+        self._path = None
+        try:
+            # Renamed while still locked, so the ingester can't seal it too
+            os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        except FileNotFoundError:
+            print(f"Tracking segment {path} was sealed by another process")
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Seal the current segment so the ingester can load it"""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._seal()
+            if self._flusher_stop is not None:
+                self._flusher_stop.set()
+
+
+def _seal_if_unlocked(path: str) -> bool:
+    """Seal an open segment if no process holds its lock"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        if time.time() - os.fstat(fd).st_mtime < ORPHAN_GRACE_SECONDS:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        except FileNotFoundError:
+            return False
+        return True
+    finally:
+        os.close(fd)
+
+
+def seal_orphaned_segments(directory: str = LOG_DIR) -> int:
+    """
+    Seal open segments left behind by processes that died without sealing
+
+    A segment is orphaned when no process holds its lock. The log directory
+    must be on a local filesystem shared by the writers and the ingester.
+
+    Returns:
+        Number of segments sealed
+    """
+    sealed = 0
+    for path in glob.glob(os.path.join(directory, '*' + OPEN_SUFFIX)):
+        if _seal_if_unlocked(path):
+            sealed += 1
+    return sealed
+
+
+def sealed_segments(directory: str = LOG_DIR) -> List[str]:
+    """Paths of sealed segments, oldest first"""
+    return sorted(glob.glob(os.path.join(directory, '*' + SEALED_SUFFIX)))
+
+
+def read_segment(path: str) -> List[Tuple[int, str, datetime, Optional[int]]]:
+    """
+    Decode a segment into (email_id, kind, occurred_at, link_index) tuples
+
+    A torn record at the end (from a crash mid-write) is ignored.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % RECORD.size
+    return [
+        (email_id, KIND_NAMES.get(code, 'open'), datetime.utcfromtimestamp(occurred_at),
+         None if link_index < 0 else link_index)
+        for email_id, code, occurred_at, link_index in RECORD.iter_unpack(data[:usable])
+    ]
+
+
+# Log shared by the whole process
+event_log = EventLog()
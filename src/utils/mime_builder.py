@@ -0,0 +1,149 @@
+import base64
+import secrets
+import time
+from email.errors import HeaderParseError
+from email.header import Header
+from email.utils import formataddr, formatdate
+from typing import Dict, List, Optional, Tuple
+
+CRLF = b'\r\n'
+
+# Longest header line written without folding (RFC 5322 recommends 78)
+MAX_HEADER_LINE = 78
+
+
+def _check_header_value(name: str, value: str) -> str:
+    """
+    Reject values that would end the header early
+
+    A line break in a subject or address would let its text start new
+    headers (e.g. a Bcc), so it fails the message as MIMEMultipart does.
+    """
+    if '\r' in value or '\n' in value:
+        raise HeaderParseError(f"{name} contains a line break")
+    return value
+
+
+def _encode_header_value(name: str, value: str) -> bytes:
+    """Encode a header value, folded to MAX_HEADER_LINE and using RFC 2047 only when it is not plain ASCII"""
+    _check_header_value(name, value)
+    if value.isascii():
+        if len(name) + 2 + len(value) <= MAX_HEADER_LINE:
+            return value.encode('ascii')
+        charset = 'us-ascii'
+    else:
+        charset = 'utf-8'
+    return Header(value, charset, maxlinelen=MAX_HEADER_LINE, header_name=name).encode(
+        linesep='\r\n'
+    ).encode('ascii')
+
+
+def _encode_address(name: Optional[str], address: str) -> bytes:
+    """Format a display name and address; formataddr applies RFC 2047 to non-ASCII names"""
+    _check_header_value('From', name or '')
+    return formataddr((name or '', _check_header_value('From', address))).encode('ascii')
+
+
+class CampaignMessageBuilder:
+    """
+    Assembles wire-format messages for one campaign
+
+    Everything that is the same for every recipient (From, Reply-To, Cc,
+    the MIME structure and boundary, the Message-ID domain) is encoded once
+    when the builder is created. ``build`` then only encodes the per-message
+    headers and the HTML body and joins byte strings, instead of building and
+    serialising a MIMEMultipart tree per recipient.
+
+    The output has the same structure as EmailService.build_message (a
+    multipart/alternative message with a single text/html part) plus Date
+    and Message-ID headers.
+    """
+
+    def __init__(self, smtp_config: Dict, cc: Optional[List[str]] = None,
+                 bcc: Optional[List[str]] = None, reply_to: Optional[str] = None):
+        self.sender_email = smtp_config.get('email')
+        self.extra_recipients = [
+            _check_header_value('Recipient', address) for address in list(cc or []) + list(bcc or [])
+        ]
+        self.boundary = '===============' + secrets.token_hex(16) + '=='
+        self._boundary_bytes = self.boundary.encode('ascii')
+        self._msgid_domain = (self.sender_email or 'localhost').rpartition('@')[2] or 'localhost'
+        self._date_cache: Tuple[int, bytes] = (0, b'')
+
+        headers = [
+            b'Content-Type: multipart/alternative; boundary="' + self._boundary_bytes + b'"',
+            b'MIME-Version: 1.0',
+            b'From: ' + _encode_address(smtp_config.get('name'), self.sender_email or '')
+        ]
+        if cc:
+            headers.append(b'Cc: ' + _encode_header_value('Cc', ', '.join(cc)))
+        if reply_to:
+            headers.append(b'Reply-To: ' + _encode_header_value('Reply-To', reply_to))
+        self._static_headers = CRLF.join(headers) + CRLF
+
+        self._part_open = b'--' + self._boundary_bytes + CRLF
+        self._part_close = CRLF + b'--' + self._boundary_bytes + b'--' + CRLF
+        self._ascii_part_headers = (
+            b'Content-Type: text/html; charset="us-ascii"' + CRLF +
+            b'MIME-Version: 1.0' + CRLF +
+            b'Content-Transfer-Encoding: 7bit' + CRLF + CRLF
+        )
+        self._utf8_part_headers = (
+            b'Content-Type: text/html; charset="utf-8"' + CRLF +
+            b'MIME-Version: 1.0' + CRLF +
+            b'Content-Transfer-Encoding: base64' + CRLF + CRLF
+        )
+
+    def _date_header(self) -> bytes:
+        now = int(time.time())
+        if self._date_cache[0] != now:
+            self._date_cache = (now, b'Date: ' + formatdate(now, localtime=False).encode('ascii') + CRLF)
+        return self._date_cache[1]
+
+    def _message_id(self) -> bytes:
+        return ('Message-ID: <%d.%s@%s>' % (
+            time.time_ns(), secrets.token_hex(8), self._msgid_domain
+        )).encode('ascii') + CRLF
+
+    def _encode_body(self, html_content: str) -> Tuple[bytes, bytes]:
+        """Return the part headers and encoded body for an HTML string"""
+        if html_content.isascii():
+            body = html_content.replace('\r\n', '\n').replace('\n', '\r\n').encode('ascii')
+            lines_ok = all(len(line) <= 998 for line in body.split(CRLF))
+            if lines_ok and self._boundary_bytes not in body:
+                return self._ascii_part_headers, body
+        encoded = base64.encodebytes(html_content.encode('utf-8')).replace(b'\n', CRLF)
+        return self._utf8_part_headers, encoded.rstrip(CRLF)
+
+    def envelope_recipients(self, recipient_email: str) -> List[str]:
+        """All addresses the message must be delivered to"""
+        return [_check_header_value('To', recipient_email)] + self.extra_recipients
+
+    def build(self, recipient_email: str, subject: str, html_content: str) -> bytes:
+        """
+        Assemble the wire-format bytes of one personalised message
+
+        Args:
+            recipient_email: Email address of the recipient
+            subject: Email subject line
+            html_content: HTML content of the email
+
+        Returns:
+            The message with CRLF line endings, ready for SMTP DATA
+
+        Raises:
+            HeaderParseError if the subject or recipient contains a line break
+        """
+        part_headers, body = self._encode_body(html_content or '')
+        return b''.join((
+            self._static_headers,
+            b'Subject: ', _encode_header_value('Subject', subject or ''), CRLF,
+            b'To: ', _encode_header_value('To', recipient_email), CRLF,
+            self._date_header(),
+            self._message_id(),
+            CRLF,
+            self._part_open,
+            part_headers,
+            body,
+            self._part_close
+        ))
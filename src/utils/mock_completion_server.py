@@ -0,0 +1,169 @@
+"""
+Local stand-in for the OpenAI completions API.
+
+Answers ``POST /v1/completions`` like the real endpoint, including a list of
+prompts in one request, so AI generation can be developed and benchmarked
+without an API key or network access:
+
+    python -m src.utils.mock_completion_server --port 8089 --latency 0.3
+
+Point the generator at it with ``OPENAI_BASE_URL=http://127.0.0.1:8089/v1``.
+A fraction of requests can be answered with 429 to exercise retries.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+def _count_tokens(text: str) -> int:
+    # Close enough to a real tokenizer for budgeting: about four characters per token
+    return max(1, len(text) // 4)
+
+
+class MockCompletionServer:
+    """
+    Threaded HTTP server that fakes completions
+
+    Each completion names the recipient found on the prompt's ``Name:`` line,
+    so callers can check that results come back in the right order.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on (0 picks a free one)
+        latency: Seconds to wait before answering each request
+        rate_limit_rate: Fraction of requests answered with 429
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8089, latency: float = 0.0,
+                 rate_limit_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.stats = {
+            'requests': 0,
+            'prompts': 0,
+            'rate_limited': 0,
+            'tokens': 0
+        }
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _complete(self, body: Dict) -> Dict:
+        prompts = body.get('prompt') or ''
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        choices = []
+        completion_tokens = 0
+        for index, prompt in enumerate(prompts):
+            name = next((line.split(':', 1)[1].strip() for line in prompt.splitlines()
+                         if line.startswith('Name:')), 'there')
+            text = (f"\nHi {name},\n\nI came across your work and thought a short note was worth it. "
+                    f"Would you be open to a 15-minute call next week?\n\nBest regards")
+            completion_tokens += _count_tokens(text)
+            choices.append({'text': text, 'index': index, 'logprobs': None, 'finish_reason': 'stop'})
+        prompt_tokens = sum(_count_tokens(prompt) for prompt in prompts)
+        with self._lock:
+            self.stats['prompts'] += len(prompts)
+            self.stats['tokens'] += prompt_tokens + completion_tokens
+        return {
+            'id': f'cmpl-mock-{random.getrandbits(48):012x}',
+            'object': 'text_completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': choices,
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, payload: Dict, headers: Dict = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                with server._lock:
+                    server.stats['requests'] += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if not self.path.rstrip('/').endswith('/completions'):
+                    self._reply(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+                elif random.random() < server.rate_limit_rate:
+                    with server._lock:
+                        server.stats['rate_limited'] += 1
+                    self._reply(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                                {'Retry-After': '0.1'})
+                else:
+                    self._reply(200, server._complete(body))
+
+        return Handler
+
+    def start(self) -> 'MockCompletionServer':
+        """Serve on a background thread and return once listening"""
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-completions', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop a server started with start()"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to give the OpenAI client"""
+        return f'http://{self.host}:{self.port}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI completions server for Inbox Genie')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to wait before answering each request')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 429')
+    args = parser.parse_args()
+
+    server = MockCompletionServer(args.host, args.port, args.latency, args.rate_limit_rate).start()
+    print(f"Mock completions API listening on {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+        print(f"Mock stopped: {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Parallel email generation for very large recipient lists.
+
+Rows are cut into chunks that a ProcessPoolExecutor renders on every core,
+and the results are handed back in row order. Only a window of chunks is in
+flight at a time, so the input can be a generator (e.g. a CSV being read) and
+memory stays bounded however long the list is.
+
+Generation here never touches the request context: the sender name is
+passed in explicitly and templates travel to the workers as text, where each
+process compiles them once.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .email_generator import DEFAULT_SENDER_NAME, EmailGenerator
+
+CHUNK_SIZE = 2000
+
+# Default worker processes
+WORKERS = int(os.getenv('GENERATION_WORKERS', 0)) or os.cpu_count() or 1
+
+
+def _generate_chunk(rows: List[Dict], template_type: str, template_source: Optional[str],
+                    sender_name: str, first_row: int = 1) -> List[str]:
+    """Render one chunk in a worker process"""
+    if template_source is None:
+        return [EmailGenerator.generate_email(row, template_type, sender_name) for row in rows]
+    return EmailGenerator.generate_emails_from_template(rows, template_source, sender_name, first_row)
+
+
+def _chunks(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate_emails_parallel(rows: Iterable[Dict], template_type: str = 'cold_email',
+                             template_source: Optional[str] = None,
+                             sender_name: str = DEFAULT_SENDER_NAME,
+                             workers: int = WORKERS, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Generate one email per row across processes, in row order
+
+    Args:
+        rows: Recipient data dictionaries (any iterable; read lazily)
+        template_type: Built-in template to use when no template_source is given
+        template_source: Custom template text
+        sender_name: Name to sign the emails with
+        workers: Number of worker processes; 1 generates in this process
+        chunk_size: Rows sent to a worker at a time
+
+    Yields:
+        Email content for each row, in the order of the rows
+
+    Raises:
+        TemplateError: If the template uses fields some row cannot fill, with
+            that row's number; rows before its chunk have been yielded
+    """
+    chunks = _chunks(rows, chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        return
+    if template_source is not None:
+        # A template the first row can't fill fails before any workers start
+        EmailGenerator.generate_emails_from_template(first[:1], template_source, sender_name)
+
+    if workers <= 1:
+        first_row = 1
+        for chunk in chain([first], chunks):
+            yield from _generate_chunk(chunk, template_type, template_source, sender_name, first_row)
+            first_row += len(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        next_row = 1
+
+        def submit(chunk):
+            nonlocal next_row
+            future = executor.submit(_generate_chunk, chunk, template_type, template_source,
+                                     sender_name, next_row)
+            next_row += len(chunk)
+            return future
+
+        # Keep every worker busy with one chunk queued behind it
+        pending = deque([submit(first)])
+        pending.extend(submit(chunk) for chunk in islice(chunks, workers * 2 - 1))
+        while pending:
+            emails = pending.popleft().result()
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                pending.append(submit(next_chunk))
+            yield from emails
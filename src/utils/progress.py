@@ -0,0 +1,225 @@
+"""
+Live progress of send jobs for Server-Sent Events.
+
+The worker publishes a small counters event after each batch of results it
+commits. Inside a process, events go through ProgressBroker, an in-memory
+pub/sub that SSE responses subscribe to. Workers usually run in a different
+process than the web server, so on PostgreSQL events also travel over
+LISTEN/NOTIFY and a single listener thread in the web process feeds them into
+the broker. Other databases have no notification channel; there the listener
+thread reads the counters of the jobs being watched once per interval, one
+query for all watchers.
+"""
+
+import json
+import os
+import queue
+import select
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import text
+
+from ..models import SendJob, db
+from .dashboard_stats import stats_cache
+
+# PostgreSQL NOTIFY channel for progress events
+CHANNEL = 'send_progress'
+
+# Seconds between counter reads when the database has no NOTIFY
+POLL_SECONDS = float(os.getenv('PROGRESS_POLL_SECONDS', 1.0))
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+def progress_snapshot(job) -> Dict:
+    """Counters event for a SendJob (or a row with the same columns)"""
+    total = job.total or 0
+    sent = job.sent or 0
+    failed = job.failed or 0
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'total': total,
+        'sent': sent,
+        'failed': failed,
+        'queued': max(0, total - sent - failed)
+    }
+
+
+class ProgressBroker:
+    """
+    In-process publish/subscribe of send job progress
+
+    Each subscriber gets its own bounded queue; a subscriber that falls behind
+    loses its oldest events rather than slowing down publishers, which is fine
+    because every event carries the full counters. Throughput (messages per
+    second, smoothed) is added to events as they are published.
+    """
+
+    def __init__(self, max_queue: int = 100, alpha: float = 0.3):
+        self.max_queue = max_queue
+        self.alpha = alpha
+        self._subscribers: Dict[int, set] = {}
+        self._last: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id: int) -> queue.Queue:
+        """
+        Start receiving events for a job
+
+        Subscribe before reading the job's current counters: an event
+        published in between is then queued rather than missed.
+        """
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(subscriber)
+        return subscriber
+
+    def set_baseline(self, job_id: int, snapshot: Dict):
+        """Use a subscriber's snapshot as the throughput baseline if the job has none yet"""
+        with self._lock:
+            if job_id in self._subscribers and job_id not in self._last:
+                self._last[job_id] = (snapshot['sent'] + snapshot['failed'], snapshot['status'],
+                                      time.monotonic(), 0.0)
+
+    def unsubscribe(self, job_id: int, subscriber: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[job_id]
+                    self._last.pop(job_id, None)
+
+    def watched_jobs(self):
+        """IDs of the jobs that currently have subscribers"""
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, event: Dict):
+        """Deliver a counters event to every subscriber of its job"""
+        job_id = event['job_id']
+        now = time.monotonic()
+        done = event['sent'] + event['failed']
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if not subscribers:
+                return
+            # Last published (done, status, time, throughput) for the job
+            last = self._last.get(job_id)
+            if last and last[0] == done and last[1] == event['status']:
+                return
+            throughput = 0.0
+            if last and now > last[2]:
+                rate = max(0.0, (done - last[0]) / (now - last[2]))
+                throughput = last[3] + self.alpha * (rate - last[3]) if last[3] else rate
+            self._last[job_id] = (done, event['status'], now, throughput)
+
+            # Delivered under the lock so no other publisher can refill a
+            # queue between dropping its oldest event and adding this one
+            event = dict(event, throughput=round(throughput, 2))
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+                    subscriber.put_nowait(event)
+
+
+def notify_progress(job_id: int):
+    """
+    Publish the current counters of a job from the process that changed them
+
+    Called by the worker after it commits results. The event goes to local
+    subscribers and, on PostgreSQL, to every listening web process.
+    """
+    job = db.session.query(
+        SendJob.id, SendJob.user_id, SendJob.status, SendJob.total, SendJob.sent, SendJob.failed
+    ).filter(SendJob.id == job_id).first()
+    if not job:
+        return
+    event = progress_snapshot(job)
+    progress_broker.publish(event)
+    stats_cache.invalidate(job.user_id)
+    if db.engine.dialect.name == 'postgresql':
+        # The owner's id lets listening web processes drop their cached dashboard stats
+        db.session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           {'channel': CHANNEL, 'payload': json.dumps(dict(event, user_id=job.user_id))})
+    db.session.commit()
+
+
+class ProgressListener:
+    """Background thread that feeds events from other processes into the broker"""
+
+    def __init__(self, broker: ProgressBroker):
+        self.broker = broker
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self, app):
+        """Start the listener thread for this process if it is not running yet"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,),
+                                            name='progress-listener', daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        with app.app_context():
+            engine = db.engine
+        while True:
+            try:
+                if engine.dialect.name == 'postgresql':
+                    self._listen(engine)
+                else:
+                    self._poll(app)
+            except Exception as e:
+                print(f"Progress listener error: {str(e)}")
+                time.sleep(POLL_SECONDS)
+
+    def _listen(self, engine):
+        raw = engine.raw_connection()
+        try:
+            connection = raw.driver_connection
+            connection.autocommit = True
+            connection.cursor().execute(f'LISTEN {CHANNEL}')
+            while True:
+                if select.select([connection], [], [], 5.0) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    event = json.loads(notification.payload)
+                    stats_cache.invalidate(event.pop('user_id', None))
+                    self.broker.publish(event)
+        finally:
+            raw.close()
+
+    def _poll(self, app):
+        while True:
+            time.sleep(POLL_SECONDS)
+            job_ids = self.broker.watched_jobs()
+            if not job_ids:
+                continue
+            with app.app_context():
+                rows = db.session.query(
+                    SendJob.id, SendJob.status, SendJob.total, SendJob.sent, SendJob.failed
+                ).filter(SendJob.id.in_(job_ids)).all()
+                for row in rows:
+                    self.broker.publish(progress_snapshot(row))
+
+
+def format_event(event: Dict) -> str:
+    """Serialise an event for a text/event-stream response"""
+    return f"event: progress\ndata: {json.dumps(event)}\n\n"
+
+
+# Broker and listener shared by the whole process
+progress_broker = ProgressBroker()
+progress_listener = ProgressListener(progress_broker)
@@ -0,0 +1,279 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+
+class RateLimitExceeded(Exception):
+    """Raised instead of waiting longer than a caller allows for a rate-limited send"""
+
+    def __init__(self, key, retry_after: float):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"Sending limit reached for SMTP configuration {key} "
+                         f"(next send allowed in {retry_after:.0f}s)")
+
+
+class TokenBucket:
+    """
+    Token bucket with an additional fixed-window hourly cap
+
+    The bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+    second. The state is plain numbers so it can be stored anywhere (process
+    memory, a database row) and passed back to the constructor to restore it.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, hourly_cap: Optional[int] = None,
+                 tokens: Optional[float] = None, updated_at: Optional[float] = None,
+                 hour_started_at: Optional[float] = None, hour_count: int = 0):
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(int(burst), 1)
+        self.hourly_cap = hourly_cap or None
+        now = time.time()
+        self.tokens = float(self.burst if tokens is None else tokens)
+        self.updated_at = now if updated_at is None else updated_at
+        self.hour_started_at = now if hour_started_at is None else hour_started_at
+        self.hour_count = hour_count or 0
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(float(self.burst), self.tokens + elapsed * self.rate)
+        self.updated_at = now
+        if now - self.hour_started_at >= 3600:
+            self.hour_started_at = now
+            self.hour_count = 0
+
+    def try_acquire(self, now: Optional[float] = None) -> float:
+        """
+        Take one token if available
+
+        Returns:
+            0.0 if a token was taken, otherwise the seconds to wait before retrying
+        """
+        now = time.time() if now is None else now
+        self._refill(now)
+
+        if self.hourly_cap and self.hour_count >= self.hourly_cap:
+            return max(0.0, self.hour_started_at + 3600 - now)
+
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.hour_count += 1
+            return 0.0
+
+        return (1.0 - self.tokens) / self.rate
+
+    def state(self) -> Dict:
+        """Return the mutable part of the bucket for storage"""
+        return {
+            'tokens': self.tokens,
+            'updated_at': self.updated_at,
+            'hour_started_at': self.hour_started_at,
+            'hour_count': self.hour_count
+        }
+
+
+class MemoryRateLimitBackend:
+    """Keeps bucket state in process memory (single process, or tests)"""
+
+    def __init__(self):
+        self._states: Dict = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, rate: float, burst: int, hourly_cap: Optional[int]) -> float:
+        with self._lock:
+            bucket = TokenBucket(rate, burst, hourly_cap, **self._states.get(key, {}))
+            wait = bucket.try_acquire()
+            self._states[key] = bucket.state()
+            return wait
+
+
+class SharedFileRateLimitBackend:
+    """
+    Keeps bucket state in a small JSON file guarded by an exclusive file lock
+
+    A shared-memory stand-in for worker processes on one host, used when the
+    database cannot take a write per send (SQLite serialises every writer).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, rate: float, burst: int, hourly_cap: Optional[int]) -> float:
+        import fcntl
+
+        with self._lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                states = json.loads(raw) if raw else {}
+                bucket = TokenBucket(rate, burst, hourly_cap, **states.get(str(key), {}))
+                wait = bucket.try_acquire()
+                states[str(key)] = bucket.state()
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(states))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DatabaseRateLimitBackend:
+    """
+    Keeps bucket state in the rate_limit_state table
+
+    Every worker process sharing the database sees the same bucket. Updates
+    are compare-and-set on ``updated_at`` so concurrent acquirers never both
+    spend the same token; the loser simply re-reads and tries again. The
+    limiter uses its own connection so it never commits the caller's session.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def try_acquire(self, key, rate: float, burst: int, hourly_cap: Optional[int]) -> float:
+        from ..models import RateLimitState
+        table = RateLimitState.__table__
+
+        for _ in range(10):
+            try:
+                wait = self._attempt(table, key, rate, burst, hourly_cap)
+            except IntegrityError:
+                # Another process created the row first
+                continue
+            if wait is not None:
+                return wait
+
+        # Heavy contention; back off briefly rather than spinning
+        return 1.0 / max(float(rate), 1e-6)
+
+    def _attempt(self, table, key, rate, burst, hourly_cap) -> Optional[float]:
+        """Run one read-modify-write; returns None if another process won the race"""
+        with self.db.engine.begin() as conn:
+            row = conn.execute(
+                table.select().where(table.c.smtp_config_id == key)
+            ).mappings().first()
+
+            if row is None:
+                bucket = TokenBucket(rate, burst, hourly_cap)
+                wait = bucket.try_acquire()
+                conn.execute(table.insert().values(smtp_config_id=key, **bucket.state()))
+                return wait
+
+            bucket = TokenBucket(
+                rate, burst, hourly_cap,
+                tokens=row['tokens'],
+                updated_at=row['updated_at'],
+                hour_started_at=row['hour_started_at'],
+                hour_count=row['hour_count']
+            )
+            wait = bucket.try_acquire()
+            result = conn.execute(
+                table.update()
+                .where(table.c.smtp_config_id == key)
+                .where(table.c.updated_at == row['updated_at'])
+                .values(**bucket.state())
+            )
+            return wait if result.rowcount == 1 else None
+
+
+class RateLimiter:
+    """Blocking rate limiter keyed by SMTP configuration"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryRateLimitBackend()
+
+    def acquire(self, key, rate: float, burst: int = 1, hourly_cap: Optional[int] = None,
+                timeout: Optional[float] = None) -> bool:
+        """
+        Wait until a send is allowed for the given key
+
+        Args:
+            key: Identifier of the SMTP configuration
+            rate: Allowed messages per second
+            burst: Messages that may be sent back to back after an idle period
+            hourly_cap: Maximum messages per hour (None for no cap)
+            timeout: Give up after this many seconds (None waits indefinitely)
+
+        Returns:
+            True if the send may proceed, False if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.backend.try_acquire(key, rate, burst, hourly_cap)
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def acquire_within(self, key, max_wait: float, rate: float, burst: int = 1,
+                       hourly_cap: Optional[int] = None) -> float:
+        """
+        Wait for a send only if it will be allowed within max_wait seconds
+
+        Unlike acquire with a timeout, this gives up as soon as the limiter
+        reports a longer wait (an exhausted hourly cap, say) instead of
+        sleeping until the deadline first.
+
+        Returns:
+            0.0 if the send may proceed, otherwise the seconds until the
+            limiter expects to allow it
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.backend.try_acquire(key, rate, burst, hourly_cap)
+            if wait <= 0:
+                return 0.0
+            if time.monotonic() + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+    def try_acquire(self, key, rate: float, burst: int = 1, hourly_cap: Optional[int] = None) -> float:
+        """Non-blocking variant of acquire; returns the seconds to wait (0.0 when allowed)"""
+        return self.backend.try_acquire(key, rate, burst, hourly_cap)
+
+
+def limits_for(smtp_config: Dict, delay_seconds: Optional[float] = None) -> Dict:
+    """
+    Build rate limiter arguments from an SMTP configuration dictionary
+
+    A caller-requested delay between messages is treated as an upper bound on
+    the rate, never as a fixed pause.
+    """
+    rate = smtp_config.get('max_per_second') or 1.0
+    if delay_seconds and delay_seconds > 0:
+        rate = min(rate, 1.0 / delay_seconds)
+    return {
+        'rate': rate,
+        'burst': smtp_config.get('burst') or 1,
+        'hourly_cap': smtp_config.get('max_per_hour') or None
+    }
+
+
+def shared_rate_limiter(db) -> RateLimiter:
+    """
+    Build the limiter shared by every send worker
+
+    Buckets live in the database, except on SQLite where a locked file in the
+    system temp directory stands in for shared memory.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        path = os.getenv('RATE_LIMIT_STATE_FILE',
+                         os.path.join(tempfile.gettempdir(), 'inbox_genie_rate_limits.json'))
+        return RateLimiter(SharedFileRateLimitBackend(path))
+    return RateLimiter(DatabaseRateLimitBackend(db))
+
+
+# Process-local limiter used when no database is available
+memory_rate_limiter = RateLimiter()
@@ -0,0 +1,66 @@
+import os
+import random
+import smtplib
+import socket
+from datetime import datetime, timedelta
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# Attempts per email before it is moved to the dead-letter table
+MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', 5))
+
+# Exponential backoff bounds, in seconds
+BACKOFF_BASE_SECONDS = float(os.getenv('SEND_BACKOFF_BASE_SECONDS', 30))
+BACKOFF_MAX_SECONDS = float(os.getenv('SEND_BACKOFF_MAX_SECONDS', 3600))
+
+
+def classify_code(code) -> str:
+    """Classify an SMTP reply code: 4xx is transient, everything else permanent"""
+    try:
+        return TRANSIENT if 400 <= int(code) < 500 else PERMANENT
+    except (TypeError, ValueError):
+        return PERMANENT
+
+
+def classify_smtp_error(error: BaseException) -> str:
+    """
+    Decide whether a failed send is worth retrying
+
+    Args:
+        error: Exception raised while sending
+
+    Returns:
+        TRANSIENT for 4xx replies, dropped connections and network errors,
+        PERMANENT for 5xx replies and anything unrecognised
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return TRANSIENT if codes and all(classify_code(code) == TRANSIENT for code in codes) else PERMANENT
+
+    # SMTPResponseException (and the async engine's SMTPReplyError) carry the reply code
+    code = getattr(error, 'smtp_code', None) or getattr(error, 'code', None)
+    if isinstance(code, int) and code >= 100:
+        return classify_code(code)
+
+    if isinstance(error, (smtplib.SMTPServerDisconnected, socket.timeout,
+                          ConnectionError, TimeoutError, OSError)):
+        return TRANSIENT
+
+    return PERMANENT
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Seconds to wait before the given retry attempt
+
+    Exponential backoff with full jitter: a random delay between zero and
+    base * 2**attempt, capped at BACKOFF_MAX_SECONDS.
+    """
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+def next_attempt_time(attempt: int, now: datetime = None) -> datetime:
+    """Time at which a message that has failed ``attempt`` times may be retried"""
+    return (now or datetime.utcnow()) + timedelta(seconds=backoff_delay(attempt))
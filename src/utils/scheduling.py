@@ -0,0 +1,157 @@
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from typing import Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def parse_start_time(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an ISO 8601 start time into naive UTC
+
+    Times without an offset are taken to be UTC.
+
+    Raises:
+        ValueError if the value is not a valid ISO 8601 time
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_send_window(start: Optional[str], end: Optional[str]) -> Optional[Tuple[time, time]]:
+    """
+    Parse a local-time send window given as two HH:MM strings
+
+    A window whose end is before its start runs overnight (e.g. 22:00-06:00).
+
+    Raises:
+        ValueError if only one bound is given, or a bound is not HH:MM
+    """
+    if not start and not end:
+        return None
+    if not start or not end:
+        raise ValueError('A send window needs both a start and an end time')
+    window = (time.fromisoformat(start), time.fromisoformat(end))
+    if window[0] == window[1]:
+        raise ValueError('The send window start and end must differ')
+    return window
+
+
+def get_timezone(name: Optional[str]) -> ZoneInfo:
+    """
+    Look up an IANA time zone, defaulting to UTC
+
+    Raises:
+        ValueError for an unknown time zone
+    """
+    try:
+        return ZoneInfo(name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f'Unknown time zone: {name}')
+
+
+def _in_window(local_time: time, window: Tuple[time, time]) -> bool:
+    start, end = window
+    if start < end:
+        return start <= local_time < end
+    return local_time >= start or local_time < end
+
+
+def fit_to_window(due_at: datetime, window: Tuple[time, time], tz: tzinfo) -> datetime:
+    """
+    Move a naive UTC time forward to the next moment inside a local-time window
+
+    Times already inside the window are returned unchanged.
+    """
+    local = due_at.replace(tzinfo=timezone.utc).astimezone(tz)
+    if _in_window(local.time(), window):
+        return due_at
+
+    opening = datetime.combine(local.date(), window[0], tzinfo=tz)
+    if opening <= local:
+        opening = datetime.combine(local.date() + timedelta(days=1), window[0], tzinfo=tz)
+    return opening.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _to_utc(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _window_intervals(after: datetime, window: Tuple[time, time], tz: tzinfo) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    Yield the (opening, closing) naive UTC times of each occurrence of a
+    local-time window, starting with the one open at or next after ``after``
+
+    The first opening is clipped to ``after`` when the window is already open.
+    """
+    start, end = window
+    # An overnight window that opened yesterday may still be open
+    day = after.replace(tzinfo=timezone.utc).astimezone(tz).date() - timedelta(days=1)
+    while True:
+        opening = _to_utc(datetime.combine(day, start, tzinfo=tz))
+        closing = _to_utc(datetime.combine(day if start < end else day + timedelta(days=1), end, tzinfo=tz))
+        if closing > after:
+            yield max(opening, after), closing
+        day += timedelta(days=1)
+
+
+def _spread_in_window(start_at: datetime, offsets: List[float], window: Tuple[time, time],
+                      tz: tzinfo) -> List[datetime]:
+    """
+    Place increasing offsets (seconds of in-window time after start_at) on the clock
+
+    Time outside the window is skipped, so messages keep their even spacing
+    across every opening instead of piling up at the next one.
+    """
+    intervals = _window_intervals(start_at, window, tz)
+    opening, closing = next(intervals)
+    used = 0.0
+    due_times = []
+    for offset in offsets:
+        while offset - used >= (closing - opening).total_seconds():
+            used += (closing - opening).total_seconds()
+            opening, closing = next(intervals)
+        due_times.append(opening + timedelta(seconds=offset - used))
+    return due_times
+
+
+def compute_due_times(count: int, start_at: Optional[datetime] = None, spread_seconds: float = 0,
+                      window: Optional[Tuple[time, time]] = None,
+                      timezones: Optional[List[tzinfo]] = None) -> List[datetime]:
+    """
+    Work out when each message of a campaign should be released for sending
+
+    Messages are spaced evenly from start_at over spread_seconds. With a
+    local send window, only time inside each recipient's window counts
+    towards the spread: the messages are spaced over the window's open hours,
+    continuing at the next opening once a window closes.
+
+    Args:
+        count: Number of messages
+        start_at: Naive UTC start time (defaults to now)
+        spread_seconds: Duration to spread the messages over (in-window time
+            when a window is given)
+        window: Optional (start, end) local send window
+        timezones: Time zone of each recipient, used with the window
+
+    Returns:
+        List of naive UTC due times, one per message, in message order
+    """
+    start_at = start_at or datetime.utcnow()
+    step = spread_seconds / count if count and spread_seconds else 0
+    if not window:
+        return [start_at + timedelta(seconds=step * i) for i in range(count)]
+
+    # Recipients sharing a time zone share window openings
+    by_timezone = {}
+    for i in range(count):
+        by_timezone.setdefault(timezones[i] if timezones else timezone.utc, []).append(i)
+
+    due_times = [None] * count
+    for tz, indexes in by_timezone.items():
+        placed = _spread_in_window(start_at, [step * i for i in indexes], window, tz)
+        for i, due_at in zip(indexes, placed):
+            due_times[i] = due_at
+    return due_times
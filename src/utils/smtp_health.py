@@ -0,0 +1,250 @@
+"""
+Circuit breaking and health statistics for SMTP servers.
+
+When a relay is down every send would otherwise wait out its own connect
+timeout. The breaker for a server:port opens after a number of
+connection-level failures with no successful send in between, and sends to
+it then fail immediately with CircuitOpenError. After a cool-down one send
+is let through as a probe (half-open); its outcome closes the breaker or
+opens it again for longer.
+
+Rejections of individual messages (a 550 for an unknown mailbox, say) show
+the server is up, so they never trip the breaker, although they do count
+against the configuration's success rate. They don't reset the failure
+count either: only a successful send does.
+"""
+
+import os
+import smtplib
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Hashable, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Consecutive failures that open a breaker, and how long it stays open at first
+FAILURE_THRESHOLD = int(os.getenv('SMTP_BREAKER_FAILURES', 5))
+RESET_TIMEOUT_SECONDS = float(os.getenv('SMTP_BREAKER_RESET_SECONDS', 30))
+MAX_RESET_TIMEOUT_SECONDS = float(os.getenv('SMTP_BREAKER_MAX_RESET_SECONDS', 600))
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of contacting a server whose breaker is open"""
+
+    def __init__(self, key, retry_after: float):
+        self.key = key
+        self.retry_after = retry_after
+        server, port = key
+        super().__init__(f"SMTP server {server}:{port} is unavailable "
+                         f"(circuit open, retrying in {retry_after:.0f}s)")
+
+
+def is_outage(error: BaseException) -> bool:
+    """Whether an error means the server could not be reached or is refusing service"""
+    code = getattr(error, 'smtp_code', None) or getattr(error, 'code', None)
+    if isinstance(code, int) and code >= 100:
+        # 421: service not available, closing transmission channel
+        return code == 421
+    return isinstance(error, (ConnectionError, socket.timeout, socket.gaierror,
+                              smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError))
+
+
+class _Breaker:
+    def __init__(self, reset_timeout: float):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.reset_timeout = reset_timeout
+        self.probe_started = None
+
+
+class CircuitBreakerRegistry:
+    """
+    Circuit breakers keyed by (server, port)
+
+    Thread-safe; the sync pool's threads and the asyncio engine share it.
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT_SECONDS,
+                 max_reset_timeout: float = MAX_RESET_TIMEOUT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._breakers: Dict[Hashable, _Breaker] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(smtp_config: Dict):
+        return (smtp_config.get('server'), int(smtp_config.get('port', 587)))
+
+    def _get(self, key) -> _Breaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = _Breaker(self.reset_timeout)
+        return breaker
+
+    def check(self, key):
+        """
+        Allow a call to the server or raise CircuitOpenError
+
+        Once the cool-down has passed a single caller is let through as the
+        half-open probe; everybody else keeps failing fast until it reports.
+        A probe that never reports is replaced after another cool-down.
+        """
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._get(key)
+            if breaker.state == CLOSED:
+                return
+            reopen_at = breaker.opened_at + breaker.reset_timeout
+            if breaker.state == OPEN and now < reopen_at:
+                raise CircuitOpenError(key, reopen_at - now)
+            if breaker.state == HALF_OPEN and now < breaker.probe_started + breaker.reset_timeout:
+                raise CircuitOpenError(key, breaker.probe_started + breaker.reset_timeout - now)
+            breaker.state = HALF_OPEN
+            breaker.probe_started = now
+
+    def record_success(self, key):
+        with self._lock:
+            breaker = self._get(key)
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.reset_timeout = self.reset_timeout
+            breaker.probe_started = None
+
+    def record_response(self, key):
+        """
+        Note an error reply that is not an outage, e.g. a rejected recipient
+
+        The server is reachable, so a half-open probe closes the breaker, but
+        the failure count is left as it is: a server that alternates timeouts
+        with rejections still trips once the timeouts add up.
+        """
+        with self._lock:
+            breaker = self._get(key)
+            if breaker.state == HALF_OPEN:
+                breaker.state = CLOSED
+                breaker.probe_started = None
+
+    def record_failure(self, key):
+        with self._lock:
+            breaker = self._get(key)
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN:
+                # The probe failed: stay open, backing off up to the maximum
+                breaker.reset_timeout = min(breaker.reset_timeout * 2, self.max_reset_timeout)
+                breaker.state = OPEN
+                breaker.opened_at = time.monotonic()
+            elif breaker.state == CLOSED and breaker.failures >= self.failure_threshold:
+                breaker.state = OPEN
+                breaker.opened_at = time.monotonic()
+
+    def state(self, key) -> str:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            return breaker.state if breaker else CLOSED
+
+    def failures(self, key) -> int:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            return breaker.failures if breaker else 0
+
+
+class SMTPHealthStats:
+    """
+    Rolling send statistics per SMTP configuration
+
+    Keeps the outcome of the last ``window`` sends and an exponentially
+    weighted connect latency for every configuration with an id. Only
+    configurations that changed since the last ``collect`` are reported,
+    so saving them stays cheap.
+    """
+
+    def __init__(self, window: int = 200, alpha: float = 0.2):
+        self.window = window
+        self.alpha = alpha
+        self._outcomes: Dict[int, deque] = {}
+        self._connect_ms: Dict[int, float] = {}
+        self._last_error: Dict[int, tuple] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def record_send(self, smtp_config: Dict, success: bool, error: Optional[BaseException] = None):
+        config_id = smtp_config.get('id')
+        if not config_id:
+            return
+        with self._lock:
+            outcomes = self._outcomes.get(config_id)
+            if outcomes is None:
+                outcomes = self._outcomes[config_id] = deque(maxlen=self.window)
+            outcomes.append(success)
+            if error is not None:
+                self._last_error[config_id] = (str(error)[:500], datetime.utcnow())
+            self._dirty.add(config_id)
+
+    def record_connect(self, smtp_config: Dict, seconds: float):
+        config_id = smtp_config.get('id')
+        if not config_id:
+            return
+        milliseconds = seconds * 1000
+        with self._lock:
+            previous = self._connect_ms.get(config_id)
+            self._connect_ms[config_id] = (
+                milliseconds if previous is None else previous + self.alpha * (milliseconds - previous)
+            )
+            self._dirty.add(config_id)
+
+    def snapshot(self, config_id: int) -> Dict:
+        with self._lock:
+            outcomes = self._outcomes.get(config_id) or ()
+            last_error = self._last_error.get(config_id)
+            return {
+                'sample_size': len(outcomes),
+                'success_rate': sum(outcomes) / len(outcomes) if outcomes else None,
+                'connect_ms': self._connect_ms.get(config_id),
+                'last_error': last_error[0] if last_error else None,
+                'last_failure_at': last_error[1] if last_error else None
+            }
+
+    def collect(self):
+        """Snapshots of every configuration that changed since the last call"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return {config_id: self.snapshot(config_id) for config_id in dirty}
+
+
+def save_health(db):
+    """
+    Write changed health statistics and breaker states to SMTPHealth rows
+
+    The worker calls this as it commits results, so the SMTP settings page
+    can show the health seen by the processes that actually send.
+    """
+    from ..models import SMTPConfig, SMTPHealth
+
+    changed = smtp_health.collect()
+    if not changed:
+        return
+    configs = SMTPConfig.query.filter(SMTPConfig.id.in_(list(changed))).all()
+    for config in configs:
+        key = circuit_breakers.key_for({'server': config.server, 'port': config.port})
+        stats = changed[config.id]
+        db.session.merge(SMTPHealth(
+            smtp_config_id=config.id,
+            state=circuit_breakers.state(key),
+            consecutive_failures=circuit_breakers.failures(key),
+            updated_at=datetime.utcnow(),
+            **stats
+        ))
+    db.session.commit()
+
+
+# Breakers and statistics shared by every sender in the process
+circuit_breakers = CircuitBreakerRegistry()
+smtp_health = SMTPHealthStats()
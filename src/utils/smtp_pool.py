@@ -0,0 +1,224 @@
+import atexit
+import os
+import smtplib
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple
+
+from .smtp_health import circuit_breakers, is_outage, smtp_health
+
+
+class _PooledConnection:
+    """An authenticated SMTP session plus the bookkeeping the pool needs"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def close(self):
+        """Close the session, ignoring errors from an already dead socket"""
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class _ConfigPool:
+    """Idle connections and the in-use limit for one SMTP configuration"""
+
+    def __init__(self, max_size: int):
+        self.idle = deque()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+
+class SMTPConnectionPool:
+    """
+    Pool of authenticated SMTP sessions, keyed by SMTP configuration
+
+    Sessions are opened (connect, STARTTLS, login) on first use and returned
+    to the pool afterwards instead of being torn down. A session that has been
+    idle for a while is checked with NOOP before reuse, and sessions idle for
+    longer than ``max_idle_seconds`` are closed.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 4,
+        max_idle_seconds: float = 60.0,
+        max_lifetime_seconds: float = 600.0,
+        health_check_after: float = 5.0,
+        timeout: float = 30.0
+    ):
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._pools: Dict[Tuple, _ConfigPool] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    @staticmethod
+    def config_key(smtp_config: Dict) -> Tuple:
+        """Build the pool key for an SMTP configuration dictionary"""
+        return (
+            smtp_config.get('server'),
+            int(smtp_config.get('port', 587)),
+            smtp_config.get('username'),
+            smtp_config.get('password'),
+            bool(smtp_config.get('use_tls', True))
+        )
+
+    def _get_pool(self, key: Tuple) -> _ConfigPool:
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _ConfigPool(self.max_size)
+                self._pools[key] = pool
+            return pool
+
+    def _connect(self, smtp_config: Dict) -> _PooledConnection:
+        """Open and authenticate a new SMTP session"""
+        server = smtp_config.get('server')
+        port = int(smtp_config.get('port', 587))
+        started = time.monotonic()
+        smtp = smtplib.SMTP(server, port, timeout=self.timeout)
+        try:
+            if smtp_config.get('use_tls', True):
+                smtp.starttls(context=ssl.create_default_context())
+            smtp.login(smtp_config.get('username'), smtp_config.get('password'))
+        except Exception:
+            smtp.close()
+            raise
+        smtp_health.record_connect(smtp_config, time.monotonic() - started)
+        return _PooledConnection(smtp)
+
+    def _is_usable(self, conn: _PooledConnection) -> bool:
+        """Check whether an idle session can be handed out again"""
+        now = time.monotonic()
+        if now - conn.created_at > self.max_lifetime_seconds:
+            return False
+        if now - conn.last_used > self.max_idle_seconds:
+            return False
+        if now - conn.last_used > self.health_check_after:
+            try:
+                code, _ = conn.smtp.noop()
+                return code == 250
+            except Exception:
+                return False
+        return True
+
+    def _checkout(self, smtp_config: Dict, pool: _ConfigPool) -> Tuple[_PooledConnection, bool]:
+        """Return a usable session and whether it was reused from the pool"""
+        while True:
+            with self._lock:
+                conn = pool.idle.pop() if pool.idle else None
+            if conn is None:
+                return self._connect(smtp_config), False
+            if self._is_usable(conn):
+                return conn, True
+            conn.close()
+
+    def _release(self, pool: _ConfigPool, conn: _PooledConnection):
+        conn.last_used = time.monotonic()
+        with self._lock:
+            pool.idle.append(conn)
+            prune_due = conn.last_used - self._last_prune > self.max_idle_seconds
+            if prune_due:
+                self._last_prune = conn.last_used
+        if prune_due:
+            self.prune()
+
+    def sendmail(self, smtp_config: Dict, from_addr: str, to_addrs, msg) -> Dict:
+        """
+        Send a message over a pooled session
+
+        A reused session the server has silently dropped is replaced with a
+        fresh one and the send is retried once. Sends to a server whose
+        circuit breaker is open fail immediately with CircuitOpenError.
+        """
+        breaker_key = circuit_breakers.key_for(smtp_config)
+        circuit_breakers.check(breaker_key)
+        pool = self._get_pool(self.config_key(smtp_config))
+        if not pool.slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Timed out waiting for a pooled SMTP connection")
+        try:
+            refused = self._send(smtp_config, pool, from_addr, to_addrs, msg)
+        except Exception as e:
+            if is_outage(e):
+                circuit_breakers.record_failure(breaker_key)
+            else:
+                circuit_breakers.record_response(breaker_key)
+            smtp_health.record_send(smtp_config, False, e)
+            raise
+        finally:
+            pool.slots.release()
+        circuit_breakers.record_success(breaker_key)
+        smtp_health.record_send(smtp_config, True)
+        return refused
+
+    def _send(self, smtp_config: Dict, pool: _ConfigPool, from_addr: str, to_addrs, msg) -> Dict:
+        """Send over a checked-out session; the caller holds a pool slot"""
+        conn, reused = self._checkout(smtp_config, pool)
+        try:
+            refused = conn.smtp.sendmail(from_addr, to_addrs, msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            conn.close()
+            if not reused:
+                raise
+            conn = self._connect(smtp_config)
+            try:
+                refused = conn.smtp.sendmail(from_addr, to_addrs, msg)
+            except Exception:
+                conn.close()
+                raise
+        except smtplib.SMTPRecipientsRefused:
+            # The session is still in a clean state after a rejected RCPT
+            self._release(pool, conn)
+            raise
+        except Exception:
+            conn.close()
+            raise
+        self._release(pool, conn)
+        return refused
+
+    def prune(self):
+        """Close idle sessions that have exceeded their idle or total lifetime"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for pool in self._pools.values():
+                keep = deque()
+                for conn in pool.idle:
+                    if (now - conn.last_used > self.max_idle_seconds or
+                            now - conn.created_at > self.max_lifetime_seconds):
+                        expired.append(conn)
+                    else:
+                        keep.append(conn)
+                pool.idle = keep
+        for conn in expired:
+            conn.close()
+
+    def close_all(self):
+        """Close every idle session in the pool"""
+        with self._lock:
+            conns = [conn for pool in self._pools.values() for conn in pool.idle]
+            for pool in self._pools.values():
+                pool.idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+# Shared pool used by every send path in the process
+smtp_pool = SMTPConnectionPool(
+    max_size=int(os.getenv('SMTP_POOL_SIZE', 4)),
+    max_idle_seconds=float(os.getenv('SMTP_POOL_IDLE_SECONDS', 60)),
+    max_lifetime_seconds=float(os.getenv('SMTP_POOL_MAX_LIFETIME_SECONDS', 600))
+)
+atexit.register(smtp_pool.close_all)
@@ -0,0 +1,272 @@
+"""
+Local SMTP stand-in for development and benchmarking.
+
+Accepts every message and throws it away, optionally after a delay or with an
+injected failure, so the sending path can be exercised without a real relay:
+
+    python -m src.utils.smtp_sink --port 2525 --latency 0.05 --temp-fail-rate 0.01
+
+Recipients whose local part starts with ``reject`` are refused with 550 and
+those starting with ``defer`` with 451, which makes specific failures easy to
+reproduce. The sink advertises PIPELINING, CHUNKING (BDAT), 8BITMIME and
+AUTH PLAIN/LOGIN and accepts any credentials. STARTTLS is offered only when a
+certificate is given.
+"""
+
+import argparse
+import asyncio
+import random
+import ssl
+import threading
+import time
+from typing import Dict, Optional
+
+from ..async_email_service import start_tls
+
+
+class SMTPSink:
+    """
+    Asyncio SMTP server that counts messages instead of delivering them
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on
+        latency: Seconds to wait before accepting each message
+        command_latency: Seconds to wait before every other reply
+        temp_fail_rate: Fraction of messages answered with 451
+        perm_fail_rate: Fraction of messages answered with 554
+        certfile: Certificate for STARTTLS; without it STARTTLS is not offered
+        keyfile: Private key for the certificate
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 2525, latency: float = 0.0,
+                 command_latency: float = 0.0, temp_fail_rate: float = 0.0,
+                 perm_fail_rate: float = 0.0, certfile: Optional[str] = None,
+                 keyfile: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.command_latency = command_latency
+        self.temp_fail_rate = temp_fail_rate
+        self.perm_fail_rate = perm_fail_rate
+        self.ssl_context = None
+        if certfile:
+            self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+
+        self.stats = {
+            'connections': 0,
+            'messages': 0,
+            'recipients': 0,
+            'bytes': 0,
+            'rejected': 0,
+            'deferred': 0
+        }
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    def _extensions(self, tls_active: bool):
+        extensions = ['PIPELINING', 'CHUNKING', '8BITMIME', 'SIZE 52428800', 'AUTH PLAIN LOGIN']
+        if self.ssl_context and not tls_active:
+            extensions.append('STARTTLS')
+        return extensions
+
+    def _message_reply(self) -> bytes:
+        """Final reply for a message, with injected failures"""
+        roll = random.random()
+        if roll < self.perm_fail_rate:
+            self.stats['rejected'] += 1
+            return b'554 5.6.0 Injected permanent failure\r\n'
+        if roll < self.perm_fail_rate + self.temp_fail_rate:
+            self.stats['deferred'] += 1
+            return b'451 4.3.0 Injected temporary failure\r\n'
+        self.stats['messages'] += 1
+        return b'250 2.0.0 Queued\r\n'
+
+    @staticmethod
+    def _recipient_reply(line: str) -> bytes:
+        address = line.partition(':')[2].strip().strip('<>').lower()
+        if address.startswith('reject'):
+            return b'550 5.1.1 Recipient rejected\r\n'
+        if address.startswith('defer'):
+            return b'451 4.2.0 Recipient deferred\r\n'
+        return b'250 2.1.5 OK\r\n'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats['connections'] += 1
+        tls_active = False
+        recipients = 0
+
+        async def reply(data: bytes, delay: float = None):
+            delay = self.command_latency if delay is None else delay
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            await reply(b'220 localhost ESMTP Inbox Genie sink\r\n')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                text = line.decode('utf-8', 'replace').strip()
+                verb = text.split(' ', 1)[0].upper()
+
+                if verb in ('EHLO', 'HELO'):
+                    lines = ['localhost'] + self._extensions(tls_active) if verb == 'EHLO' else ['localhost']
+                    await reply(''.join(
+                        f"250{'-' if i < len(lines) - 1 else ' '}{value}\r\n" for i, value in enumerate(lines)
+                    ).encode('ascii'))
+                elif verb == 'STARTTLS' and self.ssl_context and not tls_active:
+                    await reply(b'220 2.0.0 Ready to start TLS\r\n')
+                    await start_tls(writer, self.ssl_context, server_side=True)
+                    tls_active = True
+                elif verb == 'AUTH':
+                    parts = text.split()
+                    if len(parts) == 2 and parts[1].upper() == 'LOGIN':
+                        await reply(b'334 VXNlcm5hbWU6\r\n')
+                        await reader.readline()
+                        await reply(b'334 UGFzc3dvcmQ6\r\n')
+                        await reader.readline()
+                    elif len(parts) == 2:
+                        await reply(b'334 \r\n')
+                        await reader.readline()
+                    await reply(b'235 2.7.0 Authentication successful\r\n')
+                elif verb == 'MAIL':
+                    recipients = 0
+                    await reply(b'250 2.1.0 OK\r\n')
+                elif verb == 'RCPT':
+                    response = self._recipient_reply(text)
+                    if response.startswith(b'250'):
+                        recipients += 1
+                    await reply(response)
+                elif verb == 'DATA':
+                    if not recipients:
+                        await reply(b'503 5.5.1 No valid recipients\r\n')
+                        continue
+                    await reply(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    while True:
+                        data = await reader.readline()
+                        if not data:
+                            return
+                        if data == b'.\r\n':
+                            break
+                        self.stats['bytes'] += len(data)
+                    self.stats['recipients'] += recipients
+                    await reply(self._message_reply(), self.latency)
+                elif verb == 'BDAT':
+                    parts = text.split()
+                    size = int(parts[1])
+                    await reader.readexactly(size)
+                    self.stats['bytes'] += size
+                    if len(parts) > 2 and parts[2].upper() == 'LAST':
+                        if not recipients:
+                            await reply(b'503 5.5.1 No valid recipients\r\n')
+                            continue
+                        self.stats['recipients'] += recipients
+                        await reply(self._message_reply(), self.latency)
+                    else:
+                        await reply(f'250 2.0.0 {size} octets received\r\n'.encode('ascii'))
+                elif verb == 'RSET':
+                    recipients = 0
+                    await reply(b'250 2.0.0 OK\r\n')
+                elif verb == 'QUIT':
+                    await reply(b'221 2.0.0 Bye\r\n', 0)
+                    return
+                elif verb == 'NOOP':
+                    await reply(b'250 2.0.0 OK\r\n')
+                else:
+                    await reply(b'502 5.5.2 Command not recognised\r\n')
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Listen until cancelled"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self) -> 'SMTPSink':
+        """Run the sink on a background thread and return once it is listening"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        """Stop a sink started with start()"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def smtp_config(self) -> Dict:
+        """An SMTP configuration dictionary pointing at this sink"""
+        return {
+            'server': self.host,
+            'port': self.port,
+            'use_tls': bool(self.ssl_context),
+            'username': 'sink',
+            'password': 'sink',
+            'email': 'sender@example.com',
+            'name': 'Inbox Genie Sink'
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink for Inbox Genie')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to wait before accepting each message')
+    parser.add_argument('--command-latency', type=float, default=0.0,
+                        help='Seconds to wait before every other reply')
+    parser.add_argument('--temp-fail-rate', type=float, default=0.0,
+                        help='Fraction of messages answered with 451')
+    parser.add_argument('--perm-fail-rate', type=float, default=0.0,
+                        help='Fraction of messages answered with 554')
+    parser.add_argument('--certfile', help='Certificate to enable STARTTLS')
+    parser.add_argument('--keyfile', help='Private key for --certfile')
+    args = parser.parse_args()
+
+    sink = SMTPSink(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        command_latency=args.command_latency,
+        temp_fail_rate=args.temp_fail_rate,
+        perm_fail_rate=args.perm_fail_rate,
+        certfile=args.certfile,
+        keyfile=args.keyfile
+    )
+    print(f"SMTP sink listening on {args.host}:{args.port}")
+    started = time.monotonic()
+    try:
+        asyncio.run(sink.serve())
+    except KeyboardInterrupt:
+        elapsed = time.monotonic() - started
+        print(f"Sink stopped after {elapsed:.1f}s: {sink.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,117 @@
 import base64
+import hashlib
+import hmac
+import os
 import secrets
-from datetime import datetime
-from flask import make_response, redirect
-from ..models import EmailHistory, db
+import tempfile
+from typing import Optional
+
+# Bytes of the HMAC-SHA256 digest kept in a token
+SIGNATURE_BYTES = 12
+
+# Key used when neither TRACKING_SECRET nor SECRET_KEY is set. It is created
+# once and shared by the processes of one host; processes on other hosts or
+# containers get their own key and cannot verify each other's tokens.
+SECRET_FILE = os.getenv('TRACKING_SECRET_FILE',
+                        os.path.join(tempfile.gettempdir(), 'inbox_genie_tracking_secret'))
+
+_generated_key = None
+
+
+def _load_or_create_secret(path: str) -> bytes:
+    """Read the generated key, creating it first if no process has yet"""
+    try:
+        with open(path, 'rb') as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+
+    # Written to a private file first and linked into place, so a concurrent
+    # reader never sees a partial key and the first process to link wins
+    key = secrets.token_urlsafe(32).encode()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            with open(path, 'rb') as f:
+                return f.read().strip()
+    finally:
+        os.unlink(temp_path)
+    return key
+
+
+def _signing_key() -> bytes:
+    """
+    TRACKING_SECRET, falling back to SECRET_KEY, falling back to a generated key
+
+    Tracking tokens signed with a publicly known key could be forged, so there
+    is no hardcoded default.
+    """
+    global _generated_key
+    secret = os.getenv('TRACKING_SECRET') or os.getenv('SECRET_KEY')
+    if secret:
+        return secret.encode()
+    if _generated_key is None:
+        _generated_key = _load_or_create_secret(SECRET_FILE)
+        print("WARNING: neither TRACKING_SECRET nor SECRET_KEY is set; tracking links are signed with "
+              f"a generated key from {SECRET_FILE}. Set TRACKING_SECRET to the same value for the web "
+              "server and the workers, or links sent from other hosts will not be tracked.")
+    return _generated_key
+
+
+def _sign(message: str) -> str:
+    digest = hmac.new(_signing_key(), message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode().rstrip('=')
+
+
+def _signature(email_id: int) -> str:
+    return _sign(f"track:{email_id}")
+
 
 def generate_tracking_token(email_id):
-    """Generate a secure token for email tracking"""
-    token_data = f"{email_id}:{secrets.token_hex(8)}"
-    return base64.urlsafe_b64encode(token_data.encode()).decode()
+    """
+    Generate a signed token for email tracking
+
+    The token is the email ID and an HMAC of it keyed with TRACKING_SECRET
+    (or SECRET_KEY), so it can be verified without a database lookup. It is
+    deterministic: compute it once per email and use it for the pixel and
+    every link.
+    """
+    return f"{int(email_id)}.{_signature(int(email_id))}"
+
 
 def decode_tracking_token(token):
-    """Decode the tracking token to extract email_id"""
-    try:
-        decoded = base64.urlsafe_b64decode(token.encode()).decode()
-        email_id = int(decoded.split(':')[0])
-        return email_id
-    except (ValueError, IndexError):
+    """Verify a tracking token and return its email_id, or None if it is invalid"""
+    email_id, _, signature = token.partition('.')
+    if not signature or not email_id.isdigit():
+        return None
+    if not hmac.compare_digest(signature, _signature(int(email_id))):
         return None
+    return int(email_id)
+
+
+def click_key(token: str) -> bytes:
+    """
+    Key for signing an email's click targets, derived from its token
+
+    Messages have dozens of links, so each target is signed with a keyed
+    BLAKE2b hash under this key, derived once per message, rather than with
+    a full HMAC per link.
+    """
+    return hmac.new(_signing_key(), f"click:{token}".encode(), hashlib.sha256).digest()
+
+
+def click_signature(key: bytes, url: str) -> str:
+    """Signature binding a click-tracking redirect target to the email's token"""
+    digest = hashlib.blake2b(url.encode(), key=key, digest_size=SIGNATURE_BYTES).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def verify_click_url(token: str, url: str, signature: Optional[str]) -> bool:
+    """Whether a click redirect target was signed for this token"""
+    return bool(signature) and hmac.compare_digest(signature, click_signature(click_key(token), url))
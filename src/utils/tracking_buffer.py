@@ -0,0 +1,201 @@
+"""
+Write-behind buffer for open and click tracking.
+
+Tracking hits arrive in bursts when a campaign lands in inboxes at once, and
+one transaction per hit saturates the database. The tracking endpoints only
+record the hit in memory and return; a background thread writes the pending
+hits as one bulk UPDATE per kind every TRACKING_FLUSH_MS milliseconds, or
+sooner once TRACKING_FLUSH_EVENTS hits are waiting. Pending hits are also
+written when the process exits.
+
+Only the first open and first click of an email are recorded, as before: the
+UPDATE skips rows already marked, and the emails it does mark are added to
+their campaign's opened and clicked counters. Mail-client prefetchers and
+proxies load the same pixel over and over, so recently recorded hits are
+remembered in an LRU cache and repeats are dropped before they reach the
+buffer.
+"""
+
+import atexit
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import case, or_, update
+
+from ..models import EmailHistory, db
+from .campaigns import add_tracking_counts
+from .dashboard_stats import stats_cache
+
+FLUSH_MS = float(os.getenv('TRACKING_FLUSH_MS', 250))
+FLUSH_EVENTS = int(os.getenv('TRACKING_FLUSH_EVENTS', 500))
+
+# Recorded (kind, email_id) pairs remembered to drop repeat hits
+SEEN_CACHE_SIZE = int(os.getenv('TRACKING_SEEN_CACHE_SIZE', 100000))
+
+# Rows per UPDATE statement, keeping bound parameters well under driver limits
+CHUNK_SIZE = 1000
+
+# (flag column, timestamp column) updated for each kind of hit
+_COLUMNS = {
+    'open': (EmailHistory.opened, EmailHistory.opened_at),
+    'click': (EmailHistory.clicked, EmailHistory.clicked_at)
+}
+
+
+class SeenCache:
+    """
+    Bounded LRU set of recently recorded hits
+
+    Not thread-safe on its own; TrackingBuffer uses it under its lock.
+    """
+
+    def __init__(self, capacity: int = SEEN_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    def add(self, key) -> bool:
+        """Remember a key; returns False if it was already known"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return False
+        self._entries[key] = None
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TrackingBuffer:
+    """
+    Collects tracking hits in memory and writes them to EmailHistory in bulk
+
+    Args:
+        flush_ms: Milliseconds between flushes
+        flush_events: Pending hits that trigger an early flush
+        seen_cache_size: Recorded hits remembered to drop repeats
+    """
+
+    def __init__(self, flush_ms: float = FLUSH_MS, flush_events: int = FLUSH_EVENTS,
+                 seen_cache_size: int = SEEN_CACHE_SIZE):
+        self.flush_seconds = flush_ms / 1000
+        self.flush_events = flush_events
+        self._seen = SeenCache(seen_cache_size)
+        # kind -> {email_id: time of the first hit}
+        self._pending: Dict[str, Dict[int, datetime]] = {kind: {} for kind in _COLUMNS}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._app = None
+        self._thread = None
+
+    def ensure_started(self, app):
+        """Start the flusher thread for this process if it is not running yet"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            if self._app is None:
+                atexit.register(self.flush)
+            self._app = app
+            self._thread = threading.Thread(target=self._run, name='tracking-flusher', daemon=True)
+            self._thread.start()
+
+    def record(self, kind: str, email_id: int) -> bool:
+        """
+        Queue a tracking hit
+
+        Args:
+            kind: 'open' or 'click'
+            email_id: ID of the EmailHistory record
+
+        Returns:
+            False if the hit repeats one recorded recently and was dropped
+        """
+        with self._lock:
+            if not self._seen.add((kind, email_id)):
+                return False
+            self._pending[kind][email_id] = datetime.utcnow()
+            self._count += 1
+            if self._count >= self.flush_events:
+                self._wake.set()
+            return True
+
+    def pending(self) -> int:
+        """Number of hits waiting to be written"""
+        with self._lock:
+            return self._count
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing tracking hits: {str(e)}")
+
+    def flush(self) -> int:
+        """
+        Write every pending hit to the database
+
+        Returns:
+            Number of hits written
+        """
+        with self._lock:
+            if not self._count or self._app is None:
+                return 0
+            batches = self._pending
+            self._pending = {kind: {} for kind in _COLUMNS}
+            self._count = 0
+
+        written = 0
+        user_ids = set()
+        with self._flush_lock, self._app.app_context():
+            try:
+                for kind, hits in batches.items():
+                    if not hits:
+                        continue
+                    flag, timestamp = _COLUMNS[kind]
+                    email_ids = list(hits)
+                    for start in range(0, len(email_ids), CHUNK_SIZE):
+                        chunk = {email_id: hits[email_id] for email_id in email_ids[start:start + CHUNK_SIZE]}
+                        marked = db.session.execute(
+                            update(EmailHistory)
+                            .where(EmailHistory.id.in_(list(chunk)), or_(flag.is_(None), flag.is_(False)))
+                            .values({flag: True, timestamp: case(chunk, value=EmailHistory.id)})
+                            .returning(EmailHistory.campaign_id, EmailHistory.user_id)
+                            .execution_options(synchronize_session=False)
+                        ).all()
+                        # Only rows this statement marked are counted, so concurrent flushes never double count
+                        add_tracking_counts(kind, (row.campaign_id for row in marked))
+                        user_ids.update(row.user_id for row in marked)
+                    written += len(hits)
+                db.session.commit()
+                stats_cache.invalidate(*user_ids)
+            except Exception:
+                db.session.rollback()
+                self._requeue(batches)
+                raise
+            finally:
+                db.session.remove()
+        return written
+
+    def _requeue(self, batches: Dict[str, Dict[int, datetime]]):
+        """Put hits from a failed flush back, keeping their original times"""
+        with self._lock:
+            for kind, hits in batches.items():
+                for email_id, hit_at in hits.items():
+                    if email_id not in self._pending[kind]:
+                        self._pending[kind][email_id] = hit_at
+                        self._count += 1
+
+
+# Buffer shared by the whole process
+tracking_buffer = TrackingBuffer()
@@ -0,0 +1,669 @@
+"""
+Background worker for bulk email campaigns.
+
+Bulk sends are submitted as SendJob rows by the web application and executed
+here, outside of the request cycle. Run it next to the web server with:
+
+    python -m src.worker
+
+Any number of workers, on one machine or several, can run against the same
+database. They claim emails in leased batches, so a campaign is shared
+between them without double-sending and a crashed worker's batch is picked
+up again once its lease expires.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import undefer_group
+
+from .app import app
+from .models import DeadLetter, EmailBody, EmailHistory, SendJob, SMTPConfig, db
+from .email_service import EmailService
+from .async_email_service import run_dispatcher
+from .utils.rate_limiter import RateLimitExceeded, shared_rate_limiter
+from .utils.dispatch import MultiSenderDispatcher
+from .utils.campaigns import add_campaign_counts
+from .utils.email_bodies import migrate_stored_contents, record_content
+from .utils.mime_builder import CampaignMessageBuilder
+from .utils.progress import notify_progress
+from .utils.scheduling import fit_to_window, get_timezone, parse_send_window
+from .utils.smtp_health import CircuitOpenError, save_health
+from .utils.retry_policy import (
+    MAX_ATTEMPTS, PERMANENT, TRANSIENT, classify_smtp_error, next_attempt_time
+)
+
+# Rate limiter shared by every worker process, created on first use
+_rate_limiter = None
+
+# Concurrent sends per SMTP configuration within one job
+THREADS_PER_CONFIG = int(os.getenv('WORKER_THREADS_PER_CONFIG', 4))
+
+# 'threads' sends with smtplib from a thread pool; 'async' with the asyncio engine
+SMTP_ENGINE = os.getenv('SMTP_ENGINE', 'threads')
+
+# Emails claimed per batch, and how long a claim lasts without being renewed
+BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', 100))
+LEASE_SECONDS = int(os.getenv('WORKER_LEASE_SECONDS', 300))
+
+# Results are committed at least this often
+FLUSH_EVERY = 50
+FLUSH_SECONDS = 1.0
+
+# Longest a send waits for its rate limit before its email goes back on the
+# queue until the limiter allows it, so a capped sender does not hold a batch
+RATE_LIMIT_MAX_WAIT = float(os.getenv('WORKER_RATE_LIMIT_MAX_WAIT', 60))
+
+ACTIVE_JOB_STATUSES = ('scheduled', 'queued', 'running')
+
+# Scheduled emails moved to the send queue per scheduler pass
+RELEASE_LIMIT = 1000
+
+# Identifies this process in EmailHistory.claimed_by
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _claimable(now):
+    """Emails that are due, or whose claim was abandoned by a crashed worker"""
+    return or_(
+        and_(
+            EmailHistory.status == 'queued',
+            or_(EmailHistory.next_attempt_at.is_(None), EmailHistory.next_attempt_at <= now)
+        ),
+        and_(EmailHistory.status == 'sending', EmailHistory.lease_expires_at < now)
+    )
+
+
+def release_due_emails(now=None, limit=RELEASE_LIMIT):
+    """
+    Move scheduled emails whose due time has passed onto the send queue
+
+    Emails are released in due-time order using the (status, due_at) index,
+    so each pass only reads the rows it releases. Running it from several
+    workers at once is harmless: only rows still 'scheduled' are updated.
+
+    Returns:
+        Number of emails released
+    """
+    now = now or datetime.utcnow()
+    ids = [row.id for row in db.session.query(EmailHistory.id).filter(
+        EmailHistory.status == 'scheduled',
+        EmailHistory.due_at <= now
+    ).order_by(EmailHistory.due_at).limit(limit)]
+    if not ids:
+        db.session.commit()
+        return 0
+
+    released = EmailHistory.query.filter(
+        EmailHistory.id.in_(ids),
+        EmailHistory.status == 'scheduled'
+    ).update({'status': 'queued'}, synchronize_session=False)
+    db.session.commit()
+    return released
+
+
+def claim_batch(job_id, worker_id=WORKER_ID, batch_size=BATCH_SIZE, lease_seconds=LEASE_SECONDS):
+    """
+    Claim up to batch_size sendable emails of a job
+
+    On PostgreSQL the candidates are locked with SELECT ... FOR UPDATE SKIP
+    LOCKED, so concurrent workers take disjoint batches without waiting on
+    each other. Everywhere else the claiming UPDATE repeats the conditions,
+    so a row another worker claimed in between is simply left out.
+
+    Args:
+        job_id: ID of the SendJob to claim from
+        worker_id: Name recorded on the claimed emails
+        batch_size: Maximum number of emails to claim
+        lease_seconds: How long the claim lasts unless renewed
+
+    Returns:
+        Tuple of (claim token, list of claimed EmailHistory records)
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+
+    candidates = db.session.query(EmailHistory.id).filter(
+        EmailHistory.job_id == job_id,
+        _claimable(now)
+    ).order_by(EmailHistory.id).limit(batch_size)
+    if db.engine.dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+    ids = [row.id for row in candidates]
+    if not ids:
+        db.session.commit()
+        return token, []
+
+    EmailHistory.query.filter(
+        EmailHistory.id.in_(ids),
+        _claimable(now)
+    ).update({
+        'status': 'sending',
+        'claimed_by': worker_id,
+        'claim_token': token,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+    db.session.commit()
+
+    # Bodies are deferred; old rows still holding their own content need it to send
+    records = EmailHistory.query.options(undefer_group('body')).filter_by(
+        claim_token=token, status='sending'
+    ).order_by(EmailHistory.id).all()
+    return token, records
+
+
+def claim_next_batch(worker_id=WORKER_ID, batch_size=BATCH_SIZE, lease_seconds=LEASE_SECONDS):
+    """
+    Claim a batch from the oldest active job that has sendable emails
+
+    Several workers can work on the same job at once; each gets its own
+    batch. The job is marked running when its first batch is claimed.
+
+    Returns:
+        Tuple of (SendJob, claim token, records) or None if there is nothing to do
+    """
+    now = datetime.utcnow()
+    has_work = db.session.query(EmailHistory.id).filter(
+        EmailHistory.job_id == SendJob.id,
+        _claimable(now)
+    ).exists()
+    job = SendJob.query.filter(
+        SendJob.status.in_(ACTIVE_JOB_STATUSES),
+        has_work
+    ).order_by(SendJob.created_at).first()
+    if not job:
+        db.session.commit()
+        return None
+
+    token, records = claim_batch(job.id, worker_id, batch_size, lease_seconds)
+    if not records:
+        return None
+
+    SendJob.query.filter(SendJob.id == job.id, SendJob.status.in_(('scheduled', 'queued'))).update({
+        'status': 'running',
+        'started_at': func.coalesce(SendJob.started_at, now),
+        'next_run_at': None
+    }, synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(job)
+    return job, token, records
+
+
+def renew_lease(token, lease_seconds=LEASE_SECONDS):
+    """Extend the claim on the emails of a batch that are still being sent"""
+    EmailHistory.query.filter_by(claim_token=token, status='sending').update({
+        'lease_expires_at': datetime.utcnow() + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+
+
+class LeaseHeartbeat:
+    """
+    Renews a batch's lease from a background thread while it is being sent
+
+    Results only arrive as sends finish, and a send can wait on its rate
+    limit or a slow server for longer than the lease. Without renewal another
+    worker would claim the same emails and send them again.
+
+    Args:
+        token: Claim token of the batch
+        lease_seconds: Lease length; it is renewed every third of it
+    """
+
+    def __init__(self, token, lease_seconds=LEASE_SECONDS):
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        with app.app_context():
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    renew_lease(self.token, self.lease_seconds)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Lease renewal failed: {str(e)}")
+
+
+def prepare_email_record(email, base_url, builder):
+    """
+    Add tracking to a queued email and build its message
+
+    Args:
+        email: Dictionary with the id, recipient, subject and content of the email
+        base_url: Base URL for tracking links
+        builder: CampaignMessageBuilder for the SMTP configuration
+
+    Returns:
+        Tuple of (envelope recipients, message bytes)
+    """
+    content = email['content'] or ''
+    if base_url:
+        content = EmailService.add_tracking(content, email['id'], base_url)
+    return (
+        builder.envelope_recipients(email['recipient']),
+        builder.build(email['recipient'], email['subject'], content)
+    )
+
+
+def send_email_record(email, smtp_config_dict, base_url, builder):
+    """
+    Add tracking to a queued email and send it
+
+    Args:
+        email: Dictionary with the id, recipient, subject and content of the email
+        smtp_config_dict: SMTP configuration in EmailService format
+        base_url: Base URL for tracking links
+        builder: CampaignMessageBuilder for the SMTP configuration
+
+    Returns:
+        Tuple containing success status (bool) and message (str)
+
+    Raises:
+        Whatever EmailService.deliver_prebuilt raises, so the failure can be classified
+    """
+    recipients, message = prepare_email_record(email, base_url, builder)
+    EmailService.deliver_prebuilt(recipients, message, smtp_config_dict)
+    return True, "Email sent successfully"
+
+
+def _release(record):
+    record.claimed_by = None
+    record.claim_token = None
+    record.lease_expires_at = None
+
+
+def record_failure(job_id, record, message, error):
+    """
+    Schedule a retry for a transient failure, or fail the email for good
+
+    Transient failures are re-queued with exponential backoff. Permanent
+    failures fail immediately; transient ones that have used up their
+    attempts are also copied to the dead-letter table.
+
+    Emails refused by an open circuit breaker, or whose rate limit would
+    have kept them waiting too long, were never attempted: they go back to
+    the queue until the breaker's next probe or the limiter allows them,
+    without using up an attempt.
+
+    Returns:
+        True if the email failed for good
+    """
+    record.error_message = message
+    _release(record)
+    if isinstance(error, (CircuitOpenError, RateLimitExceeded)):
+        record.status = 'queued'
+        record.next_attempt_at = datetime.utcnow() + timedelta(seconds=error.retry_after)
+        return False
+
+    record.attempts = (record.attempts or 0) + 1
+    kind = classify_smtp_error(error) if error else PERMANENT
+
+    if kind == TRANSIENT and record.attempts < MAX_ATTEMPTS:
+        record.status = 'queued'
+        record.next_attempt_at = next_attempt_time(record.attempts)
+        return False
+
+    record.status = 'failed'
+    record.next_attempt_at = None
+    if kind == TRANSIENT:
+        db.session.add(DeadLetter(
+            user_id=record.user_id,
+            email_history_id=record.id,
+            job_id=job_id,
+            attempts=record.attempts,
+            error_message=message
+        ))
+    return True
+
+
+def hold_outside_window(job, records, now=None):
+    """
+    Put back emails that may not be sent now because of the job's send window
+
+    Due times respect the window, but retries and late releases can come up
+    after it has closed. Those emails go back to 'scheduled' until the window
+    next opens in the recipient's time zone, without using up an attempt.
+
+    Args:
+        job: SendJob the emails belong to
+        records: Claimed EmailHistory records by id; held ones are removed
+
+    Returns:
+        Number of emails held
+    """
+    window = parse_send_window(job.window_start, job.window_end)
+    if not window:
+        return 0
+    now = now or datetime.utcnow()
+    held = 0
+    for record in list(records.values()):
+        opens_at = fit_to_window(now, window, get_timezone(record.timezone))
+        if opens_at > now:
+            record.status = 'scheduled'
+            record.due_at = opens_at
+            _release(record)
+            del records[record.id]
+            held += 1
+    return held
+
+
+def get_rate_limiter():
+    """Get the rate limiter shared by every worker process"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = shared_rate_limiter(db)
+    return _rate_limiter
+
+
+def _push_app_context():
+    """Give dispatcher threads their own application context"""
+    app.app_context().push()
+
+
+def process_batch(job, token, records, lease_seconds=LEASE_SECONDS):
+    """
+    Send a claimed batch of emails, committing progress as results arrive
+
+    The batch is split across the job's SMTP configurations and sent
+    concurrently; database updates stay on this thread. Results are committed
+    in small groups. A heartbeat keeps the lease alive however long the sends
+    take, and sends that would wait more than RATE_LIMIT_MAX_WAIT for their
+    rate limit are put back on the queue instead. If the worker dies, it
+    loses at most the uncommitted group, and the worker that picks up the
+    expired claim sends those emails again.
+
+    Args:
+        job: SendJob the emails belong to
+        token: Claim token returned by claim_batch
+        records: EmailHistory records claimed with that token
+        lease_seconds: Lease length to keep renewing the claim for
+    """
+    job_id = job.id
+    campaign_id = job.campaign_id
+    smtp_configs = SMTPConfig.query.filter(
+        SMTPConfig.id.in_(job.get_smtp_config_ids()),
+        SMTPConfig.user_id == job.user_id
+    ).all()
+    if not smtp_configs:
+        fail_job(job_id, campaign_id, token, 'SMTP configuration no longer exists')
+        return
+
+    dispatcher = MultiSenderDispatcher(
+        {config.id: config.to_smtp_config() for config in smtp_configs},
+        threads_per_config=THREADS_PER_CONFIG,
+        rate_limiter=get_rate_limiter(),
+        delay_seconds=job.delay_seconds,
+        thread_initializer=_push_app_context,
+        max_wait=RATE_LIMIT_MAX_WAIT
+    )
+
+    records = {record.id: record for record in records}
+    # Committed with the first group of results
+    hold_outside_window(job, records)
+    # Load the batch's shared bodies in one query rather than once per email
+    bodies = {
+        body.hash: body for body in EmailBody.query.filter(
+            EmailBody.hash.in_({record.body_hash for record in records.values() if record.body_hash})
+        )
+    }
+    emails = [
+        {'id': record.id, 'recipient': record.recipient, 'subject': record.subject,
+         'content': record_content(record, bodies)}
+        for record in records.values()
+    ]
+
+    # Sender threads must not touch ORM objects: the session is not thread-safe
+    # and every commit below expires the job's attributes
+    base_url = job.base_url
+
+    # One message builder per sender, so shared headers are encoded once per job
+    builders = {
+        config_id: CampaignMessageBuilder(smtp_config_dict)
+        for config_id, smtp_config_dict in dispatcher.smtp_configs.items()
+    }
+
+    def send(config_id, smtp_config_dict, email):
+        return send_email_record(email, smtp_config_dict, base_url, builders[config_id])
+
+    def prepare(config_id, smtp_config_dict, email):
+        return prepare_email_record(email, base_url, builders[config_id])
+
+    if SMTP_ENGINE == 'async':
+        results = run_dispatcher(dispatcher, dispatcher.plan(emails), prepare)
+    else:
+        results = dispatcher.run(dispatcher.plan(emails), send)
+
+    counts = {'sent': 0, 'failed': 0}
+    pending = 0
+    last_flush = time.monotonic()
+
+    def flush():
+        # Job and campaign counters are incremented in SQL because other workers update them too
+        if counts['sent'] or counts['failed']:
+            SendJob.query.filter_by(id=job_id).update({
+                'sent': SendJob.sent + counts['sent'],
+                'failed': SendJob.failed + counts['failed']
+            }, synchronize_session=False)
+            add_campaign_counts(campaign_id, sent_at=datetime.utcnow() if counts['sent'] else None, **counts)
+            counts['sent'] = counts['failed'] = 0
+        renew_lease(token, lease_seconds)
+        db.session.commit()
+        save_health(db)
+        notify_progress(job_id)
+
+    with LeaseHeartbeat(token, lease_seconds):
+        for config_id, email, success, message, error in results:
+            record = records[email['id']]
+            record.smtp_config_id = config_id
+            record.sent_at = datetime.utcnow()
+            if success:
+                record.status = 'sent'
+                record.next_attempt_at = None
+                _release(record)
+                counts['sent'] += 1
+            elif record_failure(job_id, record, message, error):
+                counts['failed'] += 1
+
+            pending += 1
+            if pending >= FLUSH_EVERY or time.monotonic() - last_flush >= FLUSH_SECONDS:
+                flush()
+                pending = 0
+                last_flush = time.monotonic()
+
+        flush()
+    update_job_status(job_id)
+
+
+def update_job_status(job_id):
+    """
+    Complete a job with nothing left to send, or park it until its next retry
+    or scheduled email is due
+
+    Safe to call from several workers at once: the updates only apply to jobs
+    that are still active.
+    """
+    remaining = dict(db.session.query(EmailHistory.status, func.count(EmailHistory.id)).filter(
+        EmailHistory.job_id == job_id,
+        EmailHistory.status.in_(('scheduled', 'queued', 'sending'))
+    ).group_by(EmailHistory.status).all())
+    active = SendJob.query.filter(SendJob.id == job_id, SendJob.status.in_(ACTIVE_JOB_STATUSES))
+
+    if not remaining:
+        active.update({'status': 'completed', 'finished_at': datetime.utcnow()}, synchronize_session=False)
+    elif not remaining.get('sending'):
+        next_retry = db.session.query(func.min(EmailHistory.next_attempt_at)).filter(
+            EmailHistory.job_id == job_id,
+            EmailHistory.status == 'queued'
+        ).scalar()
+        next_due = db.session.query(func.min(EmailHistory.due_at)).filter(
+            EmailHistory.job_id == job_id,
+            EmailHistory.status == 'scheduled'
+        ).scalar()
+        upcoming = [moment for moment in (next_retry, next_due) if moment]
+        if upcoming and min(upcoming) > datetime.utcnow():
+            # Nothing can be sent until the next retry or scheduled email is due
+            status = 'scheduled' if next_due and next_due == min(upcoming) else 'queued'
+            active.update({'status': status, 'next_run_at': min(upcoming)}, synchronize_session=False)
+    db.session.commit()
+    notify_progress(job_id)
+
+
+def fail_job(job_id, campaign_id, token, message):
+    """
+    Fail a job together with the emails it still has to send
+
+    The emails of the batch claimed with token, and any still queued or
+    scheduled, are failed in the same transaction as the job. Otherwise they
+    would stay claimed forever, since failed jobs are never claimed from
+    again. Emails other workers are sending right now are left to them.
+
+    Args:
+        job_id: ID of the SendJob to fail
+        campaign_id: Campaign whose failed counter is updated, if any
+        token: Claim token of this worker's batch
+        message: Error message recorded on the job and the emails
+    """
+    now = datetime.utcnow()
+    failed = EmailHistory.query.filter(
+        EmailHistory.job_id == job_id,
+        or_(
+            and_(EmailHistory.status == 'sending', EmailHistory.claim_token == token),
+            EmailHistory.status.in_(('queued', 'scheduled'))
+        )
+    ).update({
+        'status': 'failed',
+        'error_message': message,
+        'next_attempt_at': None,
+        'claimed_by': None,
+        'claim_token': None,
+        'lease_expires_at': None
+    }, synchronize_session=False)
+    SendJob.query.filter_by(id=job_id).update({
+        'status': 'failed',
+        'failed': SendJob.failed + failed,
+        'error_message': message,
+        'finished_at': now
+    }, synchronize_session=False)
+    add_campaign_counts(campaign_id, failed=failed)
+    db.session.commit()
+    notify_progress(job_id)
+
+
+def release_batch(job_id, token, message):
+    """
+    Put a batch back on the queue after an unexpected error while sending it
+
+    Only the emails of this batch still being sent are released; results
+    already committed stand and the rest of the job is untouched. They are
+    retried after a backoff without using up an attempt, since the error was
+    not theirs.
+
+    Args:
+        job_id: ID of the SendJob the batch belongs to
+        token: Claim token of the batch
+        message: Error message recorded on the emails
+
+    Returns:
+        Number of emails released
+    """
+    records = EmailHistory.query.filter_by(job_id=job_id, claim_token=token, status='sending').all()
+    for record in records:
+        _release(record)
+        record.status = 'queued'
+        record.error_message = message
+        record.next_attempt_at = next_attempt_time(max(1, record.attempts or 0))
+    db.session.commit()
+    update_job_status(job_id)
+    return len(records)
+
+
+def migrate_idle():
+    """
+    Move one batch of old full-content rows to shared bodies while idle
+
+    Returns:
+        Number of rows migrated; 0 once there is nothing left to move
+    """
+    try:
+        return migrate_stored_contents()
+    except Exception as e:
+        # The rows are retried by a later pass
+        db.session.rollback()
+        print(f"Body migration pass failed: {str(e)}")
+        return 0
+
+
+def run_worker(poll_interval=2.0, once=False):
+    """
+    Poll for sendable emails and process them batch by batch until interrupted
+
+    Each pass first releases scheduled emails that have become due, so the
+    workers double as the campaign scheduler. Idle passes migrate old email
+    contents to shared bodies before sleeping.
+
+    A batch that fails with an unexpected error is put back on the queue with
+    a backoff; only errors the job cannot recover from, such as its SMTP
+    configuration having been deleted, fail the whole job.
+
+    Args:
+        poll_interval: Seconds to wait when the queue is empty
+        once: Process at most one batch and return (useful for cron and tests)
+    """
+    with app.app_context():
+        while True:
+            release_due_emails()
+            batch = claim_next_batch()
+            if batch:
+                job, token, records = batch
+                job_id = job.id
+                print(f"Processing {len(records)} emails of send job {job_id}")
+                try:
+                    process_batch(job, token, records)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Batch of send job {job_id} failed, releasing it for a retry: {str(e)}")
+                    try:
+                        release_batch(job_id, token, str(e))
+                    except Exception as release_error:
+                        # The lease expires and another pass claims the batch again
+                        db.session.rollback()
+                        print(f"Releasing batch of send job {job_id} failed: {str(release_error)}")
+
+            if once:
+                return
+            if not batch and not migrate_idle():
+                time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inbox Genie background email worker')
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help='Seconds to wait between polls when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='Process a single batch and exit')
+    args = parser.parse_args()
+
+    try:
+        run_worker(poll_interval=args.poll_interval, once=args.once)
+    except KeyboardInterrupt:
+        print("Worker stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Shared setup for tests that need the application and a database.
+
+Import this before anything that imports src.app: it points the app at a
+throwaway SQLite database unless DATABASE_URI is already set.
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tests.db'))
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ['AUTO_MIGRATE'] = '0'
+
+from src import migrations  # noqa: E402
+from src.app import app  # noqa: E402
+from src.models import SMTPConfig, User, db  # noqa: E402
+
+
+def reset_database():
+    """Drop every table and migrate an empty database to the latest version"""
+    with app.app_context():
+        db.drop_all()
+        migrations.schema_migrations.drop(db.engine, checkfirst=True)
+        migrations.upgrade(db.engine)
+
+
+def create_user(username='sender', **smtp_settings):
+    """A user with one SMTP configuration; returns (user id, config id)"""
+    with app.app_context():
+        user = User(username=username, email=f'{username}@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        config = SMTPConfig(user_id=user.id, name='Default', server='127.0.0.1', port=2525, use_tls=False,
+                            username='u', password='p', email=f'{username}@example.com',
+                            **dict({'max_per_second': 1000, 'burst': 100}, **smtp_settings))
+        db.session.add(config)
+        db.session.commit()
+        return user.id, config.id
@@ -0,0 +1,75 @@
+import itertools
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from src.utils import ai_generation
+from src.utils.ai_generation import ResponseCache, generate_ai_emails
+from src.utils.mock_completion_server import MockCompletionServer
+
+NAMES = ['Ann', 'Bob', 'Cy', 'Dee', 'Eve', 'Flo']
+
+
+class RecordingCache(ResponseCache):
+    """ResponseCache that notes which threads it is called from"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+
+    def put_many(self, entries):
+        self.threads.add(threading.get_ident())
+        super().put_many(entries)
+
+
+class GenerateAIEmailsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockCompletionServer(port=0, rate_limit_rate=0.3).start()
+        self.addCleanup(self.server.stop)
+        self.cache = RecordingCache(os.path.join(tempfile.mkdtemp(), 'cache.sqlite3'))
+        self.addCleanup(self.cache.close)
+
+    def _generate(self, recipients):
+        return generate_ai_emails(recipients, cache=self.cache, base_url=self.server.base_url, api_key='test',
+                                  batch_size=2, batch_wait_ms=5, max_retries=10)
+
+    def test_order_dedup_and_cache(self):
+        names = NAMES + ['Ann', 'Cy', 'Ann']
+        emails = self._generate([{'name': name, 'company': 'Acme'} for name in names])
+
+        self.assertEqual([email.splitlines()[0] for email in emails], [f'Hi {name},' for name in names])
+        # Repeated recipients are asked for once
+        self.assertEqual(self.server.stats['prompts'], len(NAMES))
+        self.assertGreater(self.server.stats['requests'], 0)
+        self.assertNotIn(threading.get_ident(), self.cache.threads)
+
+        requests = self.server.stats['requests']
+        self.assertEqual(self._generate([{'name': name, 'company': 'Acme'} for name in reversed(NAMES)]),
+                         [emails[NAMES.index(name)] for name in reversed(NAMES)])
+        self.assertEqual(self.server.stats['requests'], requests)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResponseCache(os.path.join(tempfile.mkdtemp(), 'cache.sqlite3'), max_entries=5)
+        self.addCleanup(cache.close)
+        with mock.patch.object(ai_generation.time, 'time', side_effect=itertools.count(1)):
+            for key in 'abcde':
+                cache.put_many({key: key.upper()})
+            self.assertEqual(cache.get('a'), 'A')
+            cache.put_many({'f': 'F'})
+
+        self.assertEqual(len(cache), 4)
+        self.assertEqual([cache.get(key) for key in 'abcdef'], ['A', None, None, 'D', 'E', 'F'])
+
+
+if __name__ == '__main__':
+    unittest.main()
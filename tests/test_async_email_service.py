@@ -0,0 +1,136 @@
+import asyncio
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from src import async_email_service
+from src.async_email_service import AsyncSMTPClient, wait_for_rate_limit
+from src.utils.rate_limiter import RateLimiter, RateLimitExceeded
+
+
+class StartTLSServer:
+    """One-connection SMTP server that upgrades to TLS on STARTTLS and records what it receives"""
+
+    def __init__(self, certfile, keyfile):
+        self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.context.load_cert_chain(certfile, keyfile)
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.commands = []
+        self.data = b''
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        conn, _ = self.listener.accept()
+        reader = conn.makefile('rb')
+        conn.sendall(b'220 localhost ready\r\n')
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            command = line.decode().strip()
+            self.commands.append(command)
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                conn.sendall(b'250-localhost\r\n250 STARTTLS\r\n')
+            elif verb == 'STARTTLS':
+                conn.sendall(b'220 go ahead\r\n')
+                conn = self.context.wrap_socket(conn, server_side=True)
+                reader = conn.makefile('rb')
+            elif verb == 'DATA':
+                conn.sendall(b'354 end with .\r\n')
+                while True:
+                    line = reader.readline()
+                    if line == b'.\r\n':
+                        break
+                    self.data += line
+                conn.sendall(b'250 queued\r\n')
+            elif verb == 'QUIT':
+                conn.sendall(b'221 bye\r\n')
+                break
+            else:
+                conn.sendall(b'250 ok\r\n')
+        conn.close()
+        self.listener.close()
+
+
+@unittest.skipUnless(shutil.which('openssl'), 'needs openssl to create a test certificate')
+class StartTLSTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.mkdtemp()
+        cls.certfile = os.path.join(directory, 'cert.pem')
+        cls.keyfile = os.path.join(directory, 'key.pem')
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                        '-keyout', cls.keyfile, '-out', cls.certfile],
+                       check=True, capture_output=True)
+
+    def test_send_over_starttls(self):
+        server = StartTLSServer(self.certfile, self.keyfile)
+        client_context = ssl.create_default_context(cafile=self.certfile)
+
+        async def send():
+            client = AsyncSMTPClient('127.0.0.1', server.port, use_tls=True, timeout=5)
+            with mock.patch.object(async_email_service.ssl, 'create_default_context', return_value=client_context):
+                await client.connect()
+            self.assertIsInstance(client._writer.get_extra_info('ssl_object'), ssl.SSLObject)
+            await client.sendmail('a@example.com', ['b@example.com'], b'Subject: Hi\r\n\r\nHello\r\n')
+            await client.quit()
+
+        asyncio.run(send())
+        server.thread.join(5)
+        self.assertEqual([command.split(' ', 1)[0] for command in server.commands],
+                         ['EHLO', 'STARTTLS', 'EHLO', 'MAIL', 'RCPT', 'DATA', 'QUIT'])
+        self.assertEqual(server.data, b'Subject: Hi\r\n\r\nHello\r\n')
+
+
+class WaitForRateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.calls = []
+        try_acquire = self.limiter.try_acquire
+
+        def recording_try_acquire(*args, **kwargs):
+            self.calls.append(threading.get_ident())
+            return try_acquire(*args, **kwargs)
+
+        self.limiter.try_acquire = recording_try_acquire
+
+    def test_limiter_is_called_off_the_loop_once_per_token(self):
+        smtp_config = {'max_per_second': 50, 'burst': 1}
+
+        async def wait_all():
+            await asyncio.gather(*(wait_for_rate_limit(self.limiter, 'k', smtp_config, None) for _ in range(20)))
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(wait_all())
+        self.assertNotIn(loop_thread, self.calls)
+        # One call that takes a token per send, plus at most one that finds the bucket empty
+        self.assertLessEqual(len(self.calls), 40)
+
+    def test_waiters_queued_past_their_deadline_give_up(self):
+        smtp_config = {'max_per_second': 1, 'burst': 1}
+
+        async def wait_all():
+            return await asyncio.gather(
+                *(wait_for_rate_limit(self.limiter, 'k', smtp_config, None, max_wait=0.5) for _ in range(5)),
+                return_exceptions=True
+            )
+
+        results = asyncio.run(wait_all())
+        self.assertEqual(results[0], None)
+        self.assertTrue(all(isinstance(result, RateLimitExceeded) for result in results[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import io
+import json
+import unittest
+
+from tests.support import app, create_user, reset_database
+
+# Big enough that werkzeug spools the upload to a temporary file
+ROWS = 20000
+CSV_DATA = '﻿name,role,company,email\r\n' + ''.join(
+    f'Name{i},CTO,"Acme, Inc.",n{i}@example.com\r\n' for i in range(ROWS))
+
+
+class BulkUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_database()
+        user_id, _ = create_user()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+    def _records(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_multipart_upload(self):
+        response = self.client.post('/email/generate-bulk', content_type='multipart/form-data',
+                                    data={'file': (io.BytesIO(CSV_DATA.encode()), 'recipients.csv')})
+        records = self._records(response)
+        self.assertEqual(records[-1], {'type': 'summary', 'total_recipients': ROWS,
+                                       'successful_recipients': ROWS, 'errors': 0})
+        self.assertIn('Name0', records[0]['email'])
+        self.assertIn('Acme, Inc.', records[0]['email'])
+        self.assertIn(f'Name{ROWS - 1}', records[-2]['email'])
+
+    def test_raw_body(self):
+        response = self.client.post('/email/generate-bulk', data=CSV_DATA.encode()[:200],
+                                    content_type='text/csv')
+        records = self._records(response)
+        self.assertEqual(records[0]['type'], 'email')
+        self.assertIn('Name0', records[0]['email'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from src.utils.dashboard_stats import StatsCache
+
+
+class StatsCacheTest(unittest.TestCase):
+
+    def test_invalidation_during_computation_is_not_undone(self):
+        cache = StatsCache(ttl=60)
+        calls = []
+
+        def compute(user_id):
+            calls.append(user_id)
+            if len(calls) == 1:
+                cache.invalidate(user_id)
+            return {'call': len(calls)}
+
+        self.assertEqual(cache.get(1, compute), {'call': 1})
+        self.assertEqual(cache.get(1, compute), {'call': 2})
+        self.assertEqual(cache.get(1, compute), {'call': 2})
+
+    def test_invalidation_bookkeeping_does_not_grow_per_user(self):
+        cache = StatsCache(ttl=60, max_users=10)
+        for user_id in range(1000):
+            cache.get(user_id, lambda user_id: {})
+            cache.invalidate(user_id)
+        self.assertEqual(cache._generations, {})
+        self.assertEqual(cache._computing, {})
+        self.assertLessEqual(len(cache._entries), 10)
+
+    def test_failed_computation_is_forgotten(self):
+        cache = StatsCache(ttl=60)
+
+        def fail(user_id):
+            raise RuntimeError('database down')
+
+        with self.assertRaises(RuntimeError):
+            cache.get(1, fail)
+        self.assertEqual(cache._computing, {})
+        self.assertEqual(cache.get(1, lambda user_id: {'ok': True}), {'ok': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
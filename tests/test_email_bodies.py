@@ -0,0 +1,49 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from tests.support import app, db, reset_database
+
+from src.models import EmailBody
+from src.utils import email_bodies
+from src.utils.email_bodies import body_hash, intern_bodies
+
+
+class InternBodiesTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_database()
+
+    def _added_meanwhile(self, content):
+        """Insert a body the way a concurrent request would, after our existence check"""
+        with app.app_context():
+            db.session.add(EmailBody(hash=body_hash(content), content=content, is_template=False))
+            db.session.commit()
+        return {'hash': body_hash(content), 'content': content, 'is_template': False,
+                'created_at': datetime.utcnow()}
+
+    def _check_duplicate_is_skipped(self):
+        row = self._added_meanwhile('<p>Hi</p>')
+        with app.app_context():
+            email_bodies._insert_missing([row, {**row, 'hash': body_hash('<p>Bye</p>'), 'content': '<p>Bye</p>'}])
+            db.session.commit()
+            self.assertEqual(sorted(body.content for body in EmailBody.query), ['<p>Bye</p>', '<p>Hi</p>'])
+
+    def test_duplicate_insert_is_skipped(self):
+        self._check_duplicate_is_skipped()
+
+    def test_duplicate_insert_is_skipped_without_on_conflict(self):
+        with mock.patch.object(email_bodies, 'sqlite', None):
+            self._check_duplicate_is_skipped()
+
+    def test_hashes_follow_input_order(self):
+        bodies = [('b', False), ('a', False), ('b', False), ('a', True)]
+        with app.app_context():
+            hashes = intern_bodies(bodies)
+            db.session.commit()
+            self.assertEqual(hashes, [body_hash(content, is_template) for content, is_template in bodies])
+            self.assertEqual(EmailBody.query.count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
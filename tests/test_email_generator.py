@@ -0,0 +1,34 @@
+import io
+import unittest
+
+from src.utils.email_generator import EmailGenerator
+from src.utils.template_engine import TemplateError
+
+TEMPLATE = "Hi {{name}} in {{city}}\n{{username}}\n{{position}}\n{{contact_info}}"
+
+
+class TemplateGenerationTest(unittest.TestCase):
+
+    def test_recipient_cannot_override_sender_fields(self):
+        recipient = {'name': 'Ann', 'city': 'Oslo', 'username': 'Eve',
+                     'position': 'CEO', 'contact_info': 'call evil.example.com'}
+        expected = "Hi Ann in Oslo\nMe\n[Your Position]\n[Your Contact Information]"
+        self.assertEqual(EmailGenerator.generate_emails_from_template([recipient], TEMPLATE, 'Me'), [expected])
+        self.assertEqual(EmailGenerator.generate_email_from_template(recipient, TEMPLATE, 'Me'), expected)
+
+    def test_csv_column_cannot_override_sender_fields(self):
+        csv_data = "name,role,company,email,position\nAnn,CTO,Acme,ann@example.com,CEO\n"
+        records = list(EmailGenerator.iter_csv_emails(io.StringIO(csv_data), template_content="{{position}}",
+                                                      sender_name='Me'))
+        self.assertEqual([record['email'] for record in records], ['[Your Position]'])
+
+    def test_every_row_is_checked(self):
+        recipients = [{'name': 'Ann', 'city': 'Oslo'}, {'name': 'Bob', 'city': 'Rome'}, {'name': 'Cy'}]
+        with self.assertRaises(TemplateError) as raised:
+            EmailGenerator.generate_emails_from_template(recipients, TEMPLATE, 'Me')
+        self.assertEqual(raised.exception.row, 3)
+        self.assertEqual(raised.exception.missing_fields, ['city'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests.support import app, create_user, db, reset_database
+
+from src import event_ingester
+from src.models import EmailHistory, TrackingEvent
+from src.utils.event_log import EventLog, read_segment, sealed_segments
+
+
+class IngestPendingTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_database()
+        user_id, _ = create_user()
+        with app.app_context():
+            email = EmailHistory(user_id=user_id, recipient='r@example.com', subject='Hello',
+                                 content='<p>Hi</p>', status='sent')
+            db.session.add(email)
+            db.session.commit()
+            self.email_id = email.id
+        self.directory = tempfile.mkdtemp()
+        self.log = EventLog(self.directory)
+
+    def _write_segment(self, *kinds):
+        for kind in kinds:
+            self.log.append(kind, self.email_id)
+        self.log.close()
+
+    def test_bad_segment_is_quarantined_and_the_rest_loaded(self):
+        self._write_segment('open')
+        self._write_segment('click', 'click')
+        bad, _ = sealed_segments(self.directory)
+
+        def read(path):
+            if path == bad:
+                raise ValueError('corrupt segment')
+            return read_segment(path)
+
+        with mock.patch.object(event_ingester, 'read_segment', read):
+            event_ingester.run_ingester(self.directory, once=True)
+
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(bad)[:-len('.log')] + '.failed'])
+        with app.app_context():
+            self.assertEqual([event.kind for event in TrackingEvent.query], ['click', 'click'])
+            self.assertEqual(db.session.get(EmailHistory, self.email_id).click_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src.utils.event_log import EventLog, read_segment, sealed_segments
+
+
+class EventLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = EventLog(self.directory)
+        self.addCleanup(self.log.close)
+
+    def _events(self):
+        self.log.close()
+        return [event for path in sealed_segments(self.directory) for event in read_segment(path)]
+
+    def test_out_of_range_link_index_is_recorded_as_unknown(self):
+        for link_index in (3, 2 ** 31, 2 ** 40, -2, None):
+            self.log.append('click', 7, link_index)
+        self.assertEqual([event[3] for event in self._events()], [3, None, None, None, None])
+
+    def test_quiet_segment_is_sealed_when_it_ages_out(self):
+        log = EventLog(self.directory, segment_seconds=0.2)
+        self.addCleanup(log.close)
+        log.append('open', 7)
+        self.assertEqual(sealed_segments(self.directory), [])
+        deadline = time.monotonic() + 2
+        while not sealed_segments(self.directory) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(sealed_segments(self.directory)), 1)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(sealed_segments(self.directory)[0])])
+
+
+if __name__ == '__main__':
+    unittest.main()
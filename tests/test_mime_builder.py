@@ -0,0 +1,50 @@
+import email
+import unittest
+from email.errors import HeaderParseError
+
+from src.utils.mime_builder import MAX_HEADER_LINE, CampaignMessageBuilder
+
+SMTP_CONFIG = {'email': 'sender@example.com', 'name': 'Sender'}
+
+
+class CampaignMessageBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.builder = CampaignMessageBuilder(SMTP_CONFIG)
+
+    def test_line_break_in_subject_is_rejected(self):
+        for subject in ('Hello\r\nBcc: evil@example.com', 'Hello\nBcc: evil@example.com', 'Hello\rBcc: x'):
+            with self.assertRaises(HeaderParseError):
+                self.builder.build('to@example.com', subject, '<p>Hi</p>')
+
+    def test_line_break_in_recipient_is_rejected(self):
+        recipient = 'to@example.com\r\nBcc: evil@example.com'
+        with self.assertRaises(HeaderParseError):
+            self.builder.build(recipient, 'Hello', '<p>Hi</p>')
+        with self.assertRaises(HeaderParseError):
+            self.builder.envelope_recipients(recipient)
+
+    def test_line_break_in_cc_or_reply_to_is_rejected(self):
+        with self.assertRaises(HeaderParseError):
+            CampaignMessageBuilder(SMTP_CONFIG, cc=['cc@example.com\r\nBcc: evil@example.com'])
+        with self.assertRaises(HeaderParseError):
+            CampaignMessageBuilder(SMTP_CONFIG, reply_to='reply@example.com\nBcc: evil@example.com')
+
+    def test_long_subject_is_folded(self):
+        subject = ' '.join(['word'] * 60)
+        for text in (subject, subject.replace('word', 'wörd')):
+            data = self.builder.build('to@example.com', text, '<p>Hi</p>')
+            lines = data.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+            start = next(i for i, line in enumerate(lines) if line.startswith(b'Subject: '))
+            end = next(i for i in range(start + 1, len(lines)) if not lines[i].startswith(b' '))
+            self.assertGreater(end - start, 1)
+            self.assertTrue(all(len(line) <= MAX_HEADER_LINE for line in lines[start:end]))
+
+            message = email.message_from_bytes(data)
+            decoded = str(email.header.make_header(email.header.decode_header(message['Subject'])))
+            self.assertEqual(decoded.replace('\r\n', '').replace(' ', ''), text.replace(' ', ''))
+            self.assertIsNone(message['Bcc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
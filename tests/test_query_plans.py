@@ -0,0 +1,35 @@
+import unittest
+
+from tests.support import app, db, migrations
+
+from sqlalchemy import text
+
+from benchmarks.query_plans import INDEX_MIGRATION, explain, hot_queries, seed
+
+
+class QueryPlanTest(unittest.TestCase):
+    """The hot queries use the indexes of migration 0003"""
+
+    USERS = 20
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.drop_all()
+            migrations.schema_migrations.drop(db.engine, checkfirst=True)
+            migrations.upgrade(db.engine, INDEX_MIGRATION - 1)
+            seed(cls.USERS, emails_per_user=300, campaigns_per_user=10)
+            migrations.upgrade(db.engine)
+            db.session.execute(text('ANALYZE'))
+            db.session.commit()
+
+    def test_each_query_uses_its_index(self):
+        with app.app_context():
+            for name, index, statement in hot_queries(self.USERS // 2):
+                with self.subTest(name):
+                    plan = explain(statement)
+                    self.assertTrue(any(index in str(line) for line in plan), f"{index} not in {plan}")
+
+
+if __name__ == '__main__':
+    unittest.main()
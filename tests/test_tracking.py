@@ -0,0 +1,25 @@
+import base64
+import unittest
+
+from tests.support import app
+
+from src.utils.tracking import decode_tracking_token, generate_tracking_token
+
+
+class TrackingTokenTest(unittest.TestCase):
+
+    def test_unsigned_token_is_rejected(self):
+        unsigned = base64.urlsafe_b64encode(b'5:0123456789abcdef').decode()
+        self.assertIsNone(decode_tracking_token(unsigned))
+        self.assertIsNone(decode_tracking_token('5'))
+        self.assertEqual(decode_tracking_token(generate_tracking_token(5)), 5)
+
+    def test_unsigned_token_does_not_redirect(self):
+        unsigned = base64.urlsafe_b64encode(b'5:0123456789abcdef').decode()
+        response = app.test_client().get(f'/track/click/{unsigned}?url=https://evil.example.com/')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], '/')
+
+
+if __name__ == '__main__':
+    unittest.main()
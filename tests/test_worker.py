@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from tests.support import app, create_user, db, reset_database
+
+from src import worker
+from src.models import EmailHistory, SendJob
+from src.utils.rate_limiter import RateLimiter
+
+
+class WorkerLeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_database()
+        self.user_id, self.config_id = create_user(max_per_hour=None)
+        with app.app_context():
+            job = SendJob(user_id=self.user_id, smtp_config_id=self.config_id,
+                          smtp_config_ids=str(self.config_id), total=3, status='queued')
+            db.session.add(job)
+            db.session.commit()
+            self.job_id = job.id
+            db.session.add_all([
+                EmailHistory(user_id=self.user_id, job_id=job.id, recipient=f'r{i}@example.com',
+                             subject='Hello', content='<p>Hi</p>', status='queued')
+                for i in range(3)
+            ])
+            db.session.commit()
+        # Each test gets its own buckets
+        patcher = mock.patch.object(worker, '_rate_limiter', RateLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _process(self, lease_seconds):
+        with app.app_context():
+            job, token, records = worker.claim_next_batch(lease_seconds=lease_seconds)
+            worker.process_batch(job, token, records, lease_seconds=lease_seconds)
+
+    def test_slow_send_past_the_lease_is_not_claimed_twice(self):
+        sends = []
+
+        def slow_send(email, smtp_config_dict, base_url, builder):
+            sends.append(email['id'])
+            time.sleep(2.5)
+            return True, "Email sent successfully"
+
+        claimed_by_other = []
+
+        def other_worker():
+            time.sleep(1.5)
+            with app.app_context():
+                _, records = worker.claim_batch(self.job_id, worker_id='other', lease_seconds=1)
+                claimed_by_other.extend(record.id for record in records)
+
+        other = threading.Thread(target=other_worker)
+        with mock.patch.object(worker, 'send_email_record', slow_send):
+            other.start()
+            self._process(lease_seconds=1)
+        other.join()
+
+        self.assertEqual(claimed_by_other, [])
+        self.assertEqual(sorted(sends), sorted(set(sends)))
+        with app.app_context():
+            statuses = [record.status for record in EmailHistory.query.filter_by(job_id=self.job_id)]
+            self.assertEqual(statuses, ['sent'] * 3)
+
+    def test_send_over_its_rate_limit_goes_back_on_the_queue(self):
+        with app.app_context():
+            db.session.get(worker.SMTPConfig, self.config_id).max_per_hour = 1
+            db.session.commit()
+
+        with mock.patch.object(worker, 'RATE_LIMIT_MAX_WAIT', 1.0), \
+                mock.patch.object(worker, 'send_email_record', return_value=(True, "Email sent successfully")):
+            started = datetime.utcnow()
+            self._process(lease_seconds=60)
+
+        with app.app_context():
+            records = EmailHistory.query.filter_by(job_id=self.job_id).all()
+            self.assertEqual(sorted(record.status for record in records), ['queued', 'queued', 'sent'])
+            for record in records:
+                if record.status == 'queued':
+                    self.assertEqual(record.attempts, 0)
+                    self.assertIsNone(record.claim_token)
+                    self.assertGreater(record.next_attempt_at, started + timedelta(minutes=59))
+            self.assertEqual(db.session.get(SendJob, self.job_id).status, 'queued')
+
+    def test_batch_error_releases_the_batch_without_failing_the_job(self):
+        with app.app_context():
+            other_job = SendJob(user_id=self.user_id, smtp_config_id=self.config_id,
+                                smtp_config_ids=str(self.config_id), total=1, status='queued')
+            db.session.add(other_job)
+            db.session.commit()
+            other_job_id = other_job.id
+            db.session.add(EmailHistory(user_id=self.user_id, job_id=other_job_id, recipient='o@example.com',
+                                        subject='Hello', content='<p>Hi</p>', status='queued'))
+            db.session.commit()
+
+        started = datetime.utcnow()
+        with mock.patch.object(worker, 'process_batch', side_effect=RuntimeError('database hiccup')):
+            worker.run_worker(once=True)
+
+        with app.app_context():
+            self.assertEqual(db.session.get(SendJob, self.job_id).status, 'queued')
+            for record in EmailHistory.query.filter_by(job_id=self.job_id):
+                self.assertEqual(record.status, 'queued')
+                self.assertEqual(record.attempts, 0)
+                self.assertIsNone(record.claim_token)
+                self.assertEqual(record.error_message, 'database hiccup')
+                self.assertGreaterEqual(record.next_attempt_at, started)
+            self.assertEqual(db.session.get(SendJob, other_job_id).status, 'queued')
+            self.assertEqual(EmailHistory.query.filter_by(job_id=other_job_id).one().status, 'queued')
+
+
+if __name__ == '__main__':
+    unittest.main()